@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""Measure latency of `/` while a slow fake `status` runs in the collector.
+
+With a non-blocking collection path the p99 under a slow `status` should stay
+close to the idle baseline. Exits non-zero when it does not.
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FAKE_STATUS = """#!/bin/sh
+sleep "$(cat {delay_file})"
+cat <<'OUT'
+        Disk space avail:       51234567 kb
+         Process  Process               Class/    CPU
+          Name      Id       Status    Priority   Used   Argument
+         -------  -------    ------    --------   ----   --------
+       startstop   1         Alive      ??/ 0  00:00:01  -
+OUT
+"""
+
+CONFIG = """[server]
+host = 127.0.0.1
+port = {port}
+
+[collector]
+interval = 0.1
+
+[logging]
+log_dir = {log_dir}
+log_level = WARNING
+"""
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def fetch(url: str) -> float:
+    started = time.perf_counter()
+    with urllib.request.urlopen(url, timeout=30) as resp:
+        resp.read()
+    return time.perf_counter() - started
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+def measure(url: str, requests: int, concurrency: int) -> dict:
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(fetch, [url] * requests))
+    return {
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(max(latencies) * 1000, 2)
+    }
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--status-delay", type=float, default=2.0)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        bin_dir = os.path.join(workdir, "bin")
+        os.makedirs(bin_dir)
+        delay_file = os.path.join(workdir, "delay")
+        with open(delay_file, "w") as f:
+            f.write("0")
+        for name, script in (("status", FAKE_STATUS.format(delay_file=delay_file)),
+                             ("ps", "#!/bin/sh\n")):
+            path = os.path.join(bin_dir, name)
+            with open(path, "w") as f:
+                f.write(script)
+            os.chmod(path, 0o755)
+
+        port = free_port()
+        with open(os.path.join(workdir, "config.cfg"), "w") as f:
+            f.write(CONFIG.format(port=port, log_dir=os.path.join(workdir, "log")))
+
+        env = dict(os.environ, PATH=f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+        server = subprocess.Popen(
+            [sys.executable, os.path.join(REPO_DIR, "main.py")],
+            cwd=workdir, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        url = f"http://127.0.0.1:{port}/"
+        try:
+            for _ in range(100):
+                try:
+                    fetch(url)
+                    break
+                except OSError:
+                    time.sleep(0.1)
+
+            baseline = measure(url, args.requests, args.concurrency)
+            with open(delay_file, "w") as f:
+                f.write(str(args.status_delay))
+            # Let the collector pick up the slow status
+            time.sleep(0.5)
+            loaded = measure(url, args.requests, args.concurrency)
+        finally:
+            server.terminate()
+            server.wait()
+
+    result = {"baseline": baseline, "slow_status": loaded,
+              "status_delay_s": args.status_delay}
+    print(json.dumps(result, indent=2))
+
+    # Fail when a slow status visibly stalls unrelated requests
+    limit = max(baseline["p99_ms"] * 3, baseline["p99_ms"] + 50)
+    return 0 if loaded["p99_ms"] <= limit else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
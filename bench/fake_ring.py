@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""Stand-in Earthworm ring writer for running the exporter without Earthworm.
+
+Creates a SysV shared memory segment laid out like a transport ring (SHM_HEAD
+followed by the data area) and keeps putting messages into it the way
+tport_putmsg does: each message is a TPORT_HEAD plus payload, written at
+keyin % keymax with wrap-around, evicting the oldest messages as needed.
+The segment is removed on exit.
+"""
+import argparse
+import ctypes
+import os
+import signal
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rings import (  # noqa: E402
+    FIRST_BYTE, IPC_CREAT, IPC_RMID, MsgLogo, ShmHead, TportHead, libc
+)
+
+# TRACE2_HEADER from trace_buf.h, little-endian ("i4" data) and big-endian
+# ("s4" data)
+TRACE2_HEADER = struct.Struct('<iiddd7s9s4s3s2s3s2s2s')
+TRACE2_HEADER_BE = struct.Struct('>iiddd7s9s4s3s2s3s2s2s')
+
+def tracebuf2_packet(sta: str, net: str, chan: str, loc: str, endtime: float,
+                     nsamp: int = 100, samprate: float = 100.0, datatype: str = 'i4') -> bytes:
+    starttime = endtime - (nsamp - 1) / samprate
+    layout = TRACE2_HEADER_BE if datatype[0] in 'st' else TRACE2_HEADER
+    header = layout.pack(
+        0, nsamp, starttime, endtime, samprate,
+        sta.encode(), net.encode(), chan.encode(), loc.encode(),
+        b'20', datatype.encode(), b'', b''
+    )
+    return header + bytes(4 * nsamp)
+
+def station_packet(index: int, stations: int, now: float) -> bytes:
+    # Station n lags by (n % 20) * 0.5 seconds
+    station = index % stations
+    return tracebuf2_packet(f"S{station:04d}", "XX", "HHZ", "00", now - (station % 20) * 0.5)
+
+class FakeRing:
+    def __init__(self, key: int, keymax: int):
+        nbytes = ctypes.sizeof(ShmHead) + keymax
+        self.shmid = libc.shmget(key, nbytes, IPC_CREAT | 0o644)
+        if self.shmid == -1:
+            raise OSError(ctypes.get_errno(), f"shmget failed for key {key}")
+        self.addr = libc.shmat(self.shmid, None, 0)
+        self.head = ShmHead.from_address(self.addr)
+        self.head.nbytes = nbytes
+        self.head.keymax = keymax
+        self.head.keyin = 0
+        self.head.keyold = 0
+        self.head.flag = 0
+        self.data = (ctypes.c_ubyte * keymax).from_address(self.addr + ctypes.sizeof(ShmHead))
+        self.keymax = keymax
+        self.seq = 0
+
+    def write(self, key: int, payload: bytes) -> None:
+        pos = key % self.keymax
+        first = min(len(payload), self.keymax - pos)
+        ctypes.memmove(ctypes.addressof(self.data) + pos, payload, first)
+        if first < len(payload):
+            ctypes.memmove(ctypes.addressof(self.data), payload[first:], len(payload) - first)
+
+    def read(self, key: int, size: int) -> bytes:
+        pos = key % self.keymax
+        first = min(size, self.keymax - pos)
+        chunk = bytes(self.data[pos:pos + first])
+        return chunk + bytes(self.data[:size - first])
+
+    def put(self, logo: tuple, payload: bytes) -> None:
+        head = TportHead(FIRST_BYTE, len(payload), MsgLogo(*logo), self.seq)
+        self.seq = (self.seq + 1) % 256
+        message = bytes(head) + payload
+        keyin, keyold = self.head.keyin, self.head.keyold
+
+        # Evict the oldest messages until the new one fits
+        while keyin + len(message) > keyold + self.keymax:
+            old = TportHead.from_buffer_copy(self.read(keyold, ctypes.sizeof(TportHead)))
+            keyold += ctypes.sizeof(TportHead) + old.size
+        self.head.keyold = keyold
+
+        self.write(keyin, message)
+        self.head.keyin = keyin + len(message)
+
+    def remove(self) -> None:
+        libc.shmdt(self.addr)
+        libc.shmctl(self.shmid, IPC_RMID, None)
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--key", type=int, default=1000)
+    parser.add_argument("--size-kb", type=int, default=1024)
+    parser.add_argument("--rate", type=float, default=100.0, help="messages per second")
+    parser.add_argument("--msg-size", type=int, default=1000)
+    parser.add_argument("--logo", default="19,10,2", help="type,module,installation")
+    parser.add_argument("--duration", type=float, default=0, help="seconds (0 = until killed)")
+    parser.add_argument("--tracebuf2-stations", type=int, default=0,
+                        help="put TRACEBUF2 packets from this many stations instead of zero-filled messages")
+    args = parser.parse_args()
+
+    ring = FakeRing(args.key, args.size_kb * 1024)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    logo = tuple(int(v) for v in args.logo.split(","))
+    payload = bytes(args.msg_size)
+    started = time.monotonic()
+    sent = 0
+    try:
+        while not args.duration or time.monotonic() - started < args.duration:
+            if args.tracebuf2_stations:
+                payload = station_packet(sent, args.tracebuf2_stations, time.time())
+            ring.put(logo, payload)
+            sent += 1
+            delay = started + sent / args.rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ring.remove()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
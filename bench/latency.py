@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""Throughput of the ring tailer with TRACEBUF2 latency tracking.
+
+Fills an in-process stand-in ring with TRACEBUF2 packets from a few hundred
+stations, then times RingTailer.poll() alone (the writer is not measured).
+Reports the per-packet cost and the share of one core needed at --rate.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from fake_ring import FakeRing, station_packet  # noqa: E402
+from rings import RingSegment, RingTailer, WaveLatency  # noqa: E402
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--key", type=int, default=4711)
+    parser.add_argument("--stations", type=int, default=600)
+    parser.add_argument("--packets", type=int, default=10000, help="packets per round")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--rate", type=float, default=10000, help="target packets per second")
+    args = parser.parse_args()
+
+    ring = FakeRing(args.key, 32 * 1024 * 1024)
+    try:
+        segment = RingSegment(args.key)
+        latency = WaveLatency([0.5, 1, 2, 5, 10, 30, 60, 120, 300])
+        tailer = RingTailer(segment, latency)
+
+        best = None
+        for _ in range(args.rounds):
+            now = time.time()
+            for i in range(args.packets):
+                ring.put((19, 10, 2), station_packet(i, args.stations, now))
+            started = time.process_time()
+            tailer.poll()
+            elapsed = time.process_time() - started
+            best = elapsed if best is None else min(best, elapsed)
+
+        per_packet = best / args.packets
+        print(json.dumps({
+            "packets_per_round": args.packets,
+            "stations": len(latency.stations),
+            "us_per_packet": round(per_packet * 1e6, 3),
+            "max_packets_per_s": round(1 / per_packet),
+            "core_share_at_rate": round(per_packet * args.rate, 4),
+            "lapped": tailer.lapped
+        }))
+        segment.close()
+    finally:
+        ring.remove()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""Checks and microbenchmarks for the `status` parser.
+
+Parses every file in bench/status_corpus and compares the result with the
+modules, rings and fields expected for it, and checks that StatusParser
+reuses its cached result when only the current time changed. Exits non-zero
+on a mismatch; otherwise times parse_status() and the cached StatusParser
+path on synthetic installations of increasing size, printing one JSON
+object per line.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import timeit
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from status_parser import StatusParser, parse_status  # noqa: E402
+
+HEADER = """
+                    EARTHWORM-64 SYSTEM STATUS
+
+        Hostname-OS:            benchhost - Linux 6.1.0
+        Start time (UTC):       Mon Jan 15 10:00:00 2024
+        Current time (UTC):     Mon Jan 15 12:30:05 2024
+        Disk space avail:       51234567 kb
+{rings}
+        Startstop Version:      v7.10 2019-08-13 (64 bit)
+
+         Process  Process               Class/    CPU
+          Name      Id       Status    Priority   Used   Argument
+         -------  -------    ------    --------   ----   --------
+"""
+
+# Per corpus file: the module keys parsed, fields of some of those modules,
+# the ring numbers and some system fields
+EXPECTED = {
+    'duplicate_programs.txt': {
+        'modules': {
+            'startstop', 'pick_ew', 'wave_serverV:1', 'wave_serverV:2',
+            'export_generic:export_scnl_cwb', 'export_generic:export_scnl_usgs',
+            'import_generic:import_hub_a', 'import_generic:import_hub_b'
+        },
+        'fields': {
+            'wave_serverV:1': {'pid': 40006, 'argument': 'wave_serverV.d', 'cpu_time': '00:10:01'},
+            'wave_serverV:2': {'pid': 40007, 'argument': 'wave_serverV.d', 'cpu_time': '00:09:47'},
+            'export_generic:export_scnl_usgs': {'pid': 40003, 'status': 'Alive'},
+            'import_generic:import_hub_b': {'pid': 40005, 'status': 'Dead'}
+        },
+        'rings': {'1', '2'},
+        'system': {'current_timestamp': 1705320000.0}
+    },
+    'edge_cases.txt': {
+        'modules': {
+            'startstop', 'pick_ew', 'pick_ew_2', 'pick_ew_3', 'slink2ew',
+            'import_ack', 'wave_serverV', 'ew2mseed'
+        },
+        'fields': {
+            'wave_serverV': {'status': 'Not Exec', 'pid': None},
+            'ew2mseed': {'status': 'Not Exec', 'pid': None},
+            'slink2ew': {'status': 'Alive', 'pid': 30005, 'cpu_time': '1 02:03:04',
+                         'priority': 'RT/5', 'argument': 'slink2ew.d -v extra args'},
+            'pick_ew_2': {'status': 'Zombie'},
+            'pick_ew_3': {'status': 'Stop'},
+            'import_ack': {'status': 'Dead', 'pid': 30006, 'cpu_time': None, 'argument': None}
+        },
+        'rings': {'1', '12'},
+        'system': {'disk_space': 0, 'start_timestamp': 1707523200.0}
+    },
+    'no_class_column.txt': {
+        'modules': {'startstop', 'statmgr', 'ew2file'},
+        'fields': {'ew2file': {'pid': 803, 'priority': '-5', 'cpu_time': '00:00:12'}},
+        'rings': {'1'},
+        'system': {'version': 'v7.1 2007-05-01', 'current_timestamp': 1306908000.0}
+    },
+    'startstop_not_running.txt': {'modules': set(), 'fields': {}, 'rings': set(), 'system': {}},
+    'v7_10_linux64.txt': {
+        'modules': {
+            'startstop', 'statmgr', 'import_generic', 'pick_ew', 'pick_ew_2',
+            'binder_ew', 'wave_serverV'
+        },
+        'fields': {'import_generic': {'pid': 20413, 'status': 'Alive', 'priority': 'RT/10'}},
+        'rings': {'1', '2', '3'},
+        'system': {'log_dir': '/opt/earthworm/run_working/log/', 'disk_space': 51234567}
+    },
+    'v7_4_linux32.txt': {
+        'modules': {'startstop', 'statmgr', 'carlstatrig', 'pick_ew'},
+        'fields': {'pick_ew': {'status': 'Dead', 'pid': 2314}},
+        'rings': {'1', '2'},
+        'system': {'version': 'v7.4 2010-03-01', 'start_timestamp': 1425366764.0}
+    },
+    'windows.txt': {
+        'modules': {'startstop_nt.exe', 'statmgr.exe', 'wave_serverV.exe'},
+        'fields': {'wave_serverV.exe': {'pid': 5012, 'priority': 'High/2'}},
+        'rings': {'1'},
+        'system': {'hostname_os': 'EWPC - Windows 10 Pro'}
+    }
+}
+
+class Check:
+    def __init__(self):
+        self.failed = 0
+        self.passed = 0
+
+    def expect(self, label: str, got, expected) -> None:
+        if got == expected:
+            self.passed += 1
+        else:
+            self.failed += 1
+            print(f"FAIL {label}: got {got!r}, expected {expected!r}")
+
+def check_corpus(check: Check) -> None:
+    paths = sorted(glob.glob(os.path.join(BENCH_DIR, "status_corpus", "*.txt")))
+    check.expect("corpus files", {os.path.basename(path) for path in paths}, set(EXPECTED))
+    for path in paths:
+        name = os.path.basename(path)
+        expected = EXPECTED.get(name)
+        if expected is None:
+            continue
+        with open(path) as f:
+            data = parse_status(f.read())
+        check.expect(f"{name} modules", set(data['module']), expected['modules'])
+        for module_name, fields in expected['fields'].items():
+            module = data['module'].get(module_name, {})
+            for field, value in fields.items():
+                check.expect(f"{name} {module_name} {field}", module.get(field), value)
+        check.expect(f"{name} rings", set(data['rings']), expected['rings'])
+        for field, value in expected['system'].items():
+            check.expect(f"{name} system {field}", data['system'].get(field), value)
+
+def check_cache(check: Check) -> None:
+    # A later run differing only in the current time reuses the parsed
+    # result but reports its own time
+    output = synthetic_status(20)
+    later = output.replace("Mon Jan 15 12:30:05 2024", "Mon Jan 15 12:30:35 2024")
+    cached = StatusParser()
+    first = cached.parse(output)
+    parsed = cached.result
+    second = cached.parse(later)
+    check.expect("cache hit on a new current time", cached.result is parsed, True)
+    check.expect("cached current_time", second['system']['current_time'], "Mon Jan 15 12:30:35 2024")
+    check.expect("cached current_timestamp",
+                 second['system']['current_timestamp'] - first['system']['current_timestamp'], 30.0)
+    cached.parse(later.replace("module_0003.d", "module_0003_b.d"))
+    check.expect("cache miss on a changed process line", cached.result is parsed, False)
+
+STATUSES = ("Alive", "Alive", "Alive", "Dead", "Not Exec", "Zombie")
+
+def synthetic_status(modules: int, rings: int = 4) -> str:
+    ring_lines = "\n".join(
+        f"        Ring {i + 1:2d} name/key/size:  RING_{i} / {1000 + i} / 1024 kb"
+        for i in range(rings)
+    )
+    lines = [HEADER.format(rings=ring_lines)]
+    for i in range(modules):
+        status = STATUSES[i % len(STATUSES)]
+        pid = "-" if status == "Not Exec" else str(10000 + i)
+        lines.append(
+            f"    module_{i:04d}  {pid:>7}     {status:<8}   TS/ 0  00:{i % 60:02d}:00  module_{i:04d}.d"
+        )
+    return "\n".join(lines) + "\n"
+
+def bench(label: str, func, number: int) -> dict:
+    seconds = min(timeit.repeat(func, number=number, repeat=5)) / number
+    return {"bench": label, "us_per_call": round(seconds * 1e6, 2)}
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="10,50,100,500,1000")
+    parser.add_argument("--number", type=int, default=200)
+    args = parser.parse_args()
+
+    check = Check()
+    check_corpus(check)
+    check_cache(check)
+    print(f"{check.passed}/{check.passed + check.failed} checks passed")
+    if check.failed:
+        return 1
+
+    for size in (int(s) for s in args.sizes.split(",")):
+        output = synthetic_status(size)
+        cached = StatusParser()
+        cached.parse(output)
+        for label, func in (
+            ("parse_status", lambda: parse_status(output)),
+            ("StatusParser.unchanged", lambda: cached.parse(output))
+        ):
+            result = bench(label, func, args.number)
+            result["modules"] = size
+            result["bytes"] = len(output)
+            print(json.dumps(result))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
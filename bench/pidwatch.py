@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""Check PidWatcher against `sleep` children standing in for Earthworm modules.
+
+A stand-in status reports the children with the PID and start time the real
+collection would find in /proc. The check kills one and expects the exit
+callback and ew_module_exits_total to follow within a poll interval, a stale
+status still listing the dead PID to be reported Dead, a replacement process
+to observe the restart latency and down time histograms once, and a PID whose
+start time no longer matches (reused) to count as an exit and be reported
+Dead by that same sync. Runs with pidfds
+and with the /proc polling fallback; exits non-zero when a check fails.
+"""
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prometheus_client import CollectorRegistry  # noqa: E402
+
+import procfs  # noqa: E402
+from pidwatch import PidWatcher  # noqa: E402
+
+INSTANCE = 'test'
+
+def spawn() -> subprocess.Popen:
+    return subprocess.Popen(['sleep', '600'])
+
+def module(proc: subprocess.Popen, status: str = 'Alive', starttime_offset: int = 0) -> dict:
+    # What status plus the /proc reads report for a running module
+    return {'pid': proc.pid, 'status': status, 'starttime': procfs.read_starttime(proc.pid) + starttime_offset}
+
+class Check:
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.failed = 0
+        self.passed = 0
+
+    def expect(self, label: str, condition: bool, detail: str = '') -> None:
+        if condition:
+            self.passed += 1
+        else:
+            self.failed += 1
+            print(f"FAIL [{self.mode}] {label} {detail}")
+
+async def wait_for(condition, timeout: float = 2.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        await asyncio.sleep(0.01)
+    return condition()
+
+async def run(use_pidfd: bool) -> Check:
+    check = Check('pidfd' if use_pidfd else 'poll')
+    registry = CollectorRegistry()
+    exits = []
+    watcher = PidWatcher(registry, lambda instance, name: exits.append((instance, name)), poll_interval=0.05)
+    watcher.use_pidfd = use_pidfd and watcher.use_pidfd
+
+    def value(name: str, module_name: str) -> float:
+        return registry.get_sample_value(name, {'ew_instance': INSTANCE, 'module': module_name}) or 0.0
+
+    procs = {'pick_ew': spawn(), 'wave_serverV': spawn()}
+    try:
+        watcher.sync(INSTANCE, {name: module(proc) for name, proc in procs.items()})
+        check.expect("both modules watched", len(watcher.watched) == 2, str(watcher.watched))
+
+        # Exit: the callback and the counter follow without a status run
+        killed_at = time.monotonic()
+        procs['pick_ew'].kill()
+        procs['pick_ew'].wait()
+        seen = await wait_for(lambda: ('test', 'pick_ew') in exits)
+        check.expect("exit callback", seen, str(exits))
+        if seen:
+            print(f"[{check.mode}] exit noticed after {(time.monotonic() - killed_at) * 1000:.1f} ms")
+        check.expect("exit counted", value('ew_module_exits_total', 'pick_ew') == 1)
+        check.expect("other module not counted", value('ew_module_exits_total', 'wave_serverV') == 0)
+
+        # A status that ran before the exit still lists the old PID as Alive
+        stale = {'pick_ew': {'pid': procs['pick_ew'].pid, 'status': 'Alive', 'starttime': None},
+                 'wave_serverV': module(procs['wave_serverV'])}
+        watcher.sync(INSTANCE, stale)
+        check.expect("stale status reported Dead", stale['pick_ew']['status'] == 'Dead', stale['pick_ew']['status'])
+        check.expect("stale status not counted again", value('ew_module_exits_total', 'pick_ew') == 1)
+
+        # startstop restarts it: latency and down time observed once
+        await asyncio.sleep(0.1)
+        procs['pick_ew'] = spawn()
+        watcher.sync(INSTANCE, {name: module(proc) for name, proc in procs.items()})
+        watcher.sync(INSTANCE, {name: module(proc) for name, proc in procs.items()})
+        check.expect("restart latency observed", value('ew_module_restart_latency_seconds_count', 'pick_ew') == 1)
+        check.expect("down time observed", value('ew_module_down_seconds_count', 'pick_ew') == 1)
+        down = value('ew_module_down_seconds_sum', 'pick_ew')
+        check.expect("down time covers the gap", 0.1 <= down < 5, f"{down:.3f}s")
+        check.expect("replacement watched", watcher.watched.get((INSTANCE, 'pick_ew'), (None,))[0] == procs['pick_ew'].pid)
+
+        # PID reused by another process: the start time no longer matches
+        reused = {name: module(proc) for name, proc in procs.items()}
+        reused['wave_serverV']['starttime'] += 1
+        watcher.sync(INSTANCE, reused)
+        seen = await wait_for(lambda: ('test', 'wave_serverV') in exits)
+        check.expect("reused PID counted as an exit", seen and value('ew_module_exits_total', 'wave_serverV') == 1)
+        check.expect("reused PID reported Dead", reused['wave_serverV']['status'] == 'Dead', reused['wave_serverV']['status'])
+
+        # Module gone from status: its series are dropped
+        watcher.sync(INSTANCE, {'pick_ew': module(procs['pick_ew'])})
+        check.expect("departed module series removed",
+                     registry.get_sample_value('ew_module_exits_total', {'ew_instance': INSTANCE, 'module': 'wave_serverV'}) is None)
+    finally:
+        watcher.close()
+        for proc in procs.values():
+            proc.kill()
+            proc.wait()
+    return check
+
+def main() -> int:
+    checks = [asyncio.run(run(use_pidfd=True)), asyncio.run(run(use_pidfd=False))]
+    failed = sum(check.failed for check in checks)
+    for check in checks:
+        print(f"[{check.mode}] {check.passed}/{check.passed + check.failed} checks passed")
+    if not hasattr(os, 'pidfd_open'):
+        print("pidfd_open unavailable here; both runs used /proc polling")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""Replay a journal recorded with `[journal] record = true`.
+
+Feeds each recorded `status` output and /proc capture through the same
+parser, /proc merge and collector the exporter uses, rendering the
+exposition after every record like the exporter does. --speed 1 keeps the
+original timing, --speed N runs N times faster and --speed 0 (the default)
+as fast as possible. Prints one JSON object with throughput and the mean
+cost of each step.
+
+--dump DIR writes the exposition after each status record, to reproduce
+what a field host exported at a given moment.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from prometheus_client import CollectorRegistry, generate_latest  # noqa: E402
+
+import procfs  # noqa: E402
+from collector import EarthwormCollector  # noqa: E402
+from journal import read_journal  # noqa: E402
+from status_parser import StatusParser  # noqa: E402
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("journal")
+    parser.add_argument("--speed", type=float, default=0.0,
+                        help="replay speed factor (1 = original timing, 0 = no waiting)")
+    parser.add_argument("--dump", help="directory to write the exposition after each status record")
+    args = parser.parse_args()
+
+    if args.dump:
+        os.makedirs(args.dump, exist_ok=True)
+
+    registry = CollectorRegistry()
+    collector = EarthwormCollector()
+    registry.register(collector)
+    # Per recorded instance, like the exporter keeps them
+    status_parsers = {}
+    cpu_trackers = {}
+    instances_data = {}
+    counts = {"header": 0, "status": 0, "proc": 0}
+    spent = {"parse": 0.0, "process": 0.0, "render": 0.0}
+    first_t = previous_t = None
+    started = time.perf_counter()
+
+    for record in read_journal(args.journal):
+        counts[record["kind"]] = counts.get(record["kind"], 0) + 1
+        if first_t is None:
+            first_t = record["t"]
+        if args.speed > 0 and previous_t is not None:
+            time.sleep(max(record["t"] - previous_t, 0) / args.speed)
+        previous_t = record["t"]
+
+        if record["kind"] == "status":
+            instance = record["instance"]
+            t0 = time.perf_counter()
+            data = status_parsers.setdefault(instance, StatusParser()).parse(record["output"])
+            data["system"]["collected_at"] = record["t"]
+            instances_data[instance] = data
+            spent["parse"] += time.perf_counter() - t0
+        elif record["kind"] == "proc" and instances_data:
+            t0 = time.perf_counter()
+            for instance, data in instances_data.items():
+                procfs.apply_process_stats(
+                    data["module"], record["procs"], record["mem_total_kb"],
+                    record["uptime"], cpu_trackers.setdefault(instance, procfs.CpuRateTracker()), record["t"]
+                )
+            spent["process"] += time.perf_counter() - t0
+        else:
+            continue
+
+        t0 = time.perf_counter()
+        collector.data = instances_data
+        body = generate_latest(registry)
+        spent["render"] += time.perf_counter() - t0
+
+        if args.dump and record["kind"] == "status":
+            path = os.path.join(args.dump, f"{counts['status']:06d}-{int(record['t'])}.prom")
+            with open(path, "wb") as f:
+                f.write(body)
+
+    wall = time.perf_counter() - started
+    span = (previous_t - first_t) if first_t is not None else 0.0
+    renders = counts["status"] + counts["proc"]
+    print(json.dumps({
+        "bench": "replay",
+        "records": counts,
+        "journal_span_s": round(span, 1),
+        "wall_s": round(wall, 3),
+        "speedup": round(span / wall, 1) if wall > 0 else None,
+        "parse_us_mean": round(spent["parse"] / max(counts["status"], 1) * 1e6, 1),
+        "process_us_mean": round(spent["process"] / max(counts["proc"], 1) * 1e6, 1),
+        "render_us_mean": round(spent["render"] / max(renders, 1) * 1e6, 1)
+    }, indent=2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
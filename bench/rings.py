@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""Check RingMonitor's header metrics against a stand-in ring of known size.
+
+Puts fixed-size messages into a FakeRing and compares ew_ring_fill_ratio,
+ew_ring_write_rate_bytes, ew_ring_written_bytes_total and ew_ring_wraps_total
+with what the writer did: before the first wrap, across it, over several
+more, after keyin goes backwards (transport renormalizing the keys),
+which must not count a bogus delta, and after the ring is removed and
+created again under the same key (Earthworm restarted), which must be
+reattached. Exits non-zero when a check fails.
+"""
+import argparse
+import ctypes
+import os
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from prometheus_client import CollectorRegistry  # noqa: E402
+
+from fake_ring import FakeRing  # noqa: E402
+from rings import RingMonitor, TportHead  # noqa: E402
+
+RING = 'TEST_RING'
+LOGO = (19, 10, 2)
+
+class Check:
+    def __init__(self, registry: CollectorRegistry, key: int):
+        self.registry = registry
+        self.labels = {'ring': RING, 'key': str(key)}
+        self.failed = 0
+        self.passed = 0
+
+    def value(self, name: str) -> float:
+        return self.registry.get_sample_value(name, self.labels)
+
+    def expect(self, label: str, name: str, expected: float, tolerance: float = 0.0) -> None:
+        got = self.value(name)
+        if got is not None and abs(got - expected) <= tolerance:
+            self.passed += 1
+        else:
+            self.failed += 1
+            print(f"FAIL {label}: {name} = {got}, expected {expected}")
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--key", type=int, default=4712)
+    parser.add_argument("--size", type=int, default=64 * 1024, help="data area bytes (keymax)")
+    parser.add_argument("--msg-size", type=int, default=1000, help="bytes per message, header included")
+    args = parser.parse_args()
+
+    payload = bytes(args.msg_size - ctypes.sizeof(TportHead))
+    # Messages retained once the ring is full: the oldest are evicted until
+    # the next one fits
+    retained = args.size // args.msg_size
+
+    ring = FakeRing(args.key, args.size)
+    registry = CollectorRegistry()
+    monitor = RingMonitor()
+    registry.register(monitor)
+    try:
+        monitor.sync({'1': {'name': RING, 'key': str(args.key), 'size': args.size // 1024}})
+        monitor.sample(now=0.0)
+        check = Check(registry, args.key)
+        check.expect("empty ring", "ew_ring_fill_ratio", 0.0)
+        check.expect("empty ring", "ew_ring_written_bytes_total", 0)
+
+        # Half full, no wrap yet
+        count = retained // 2
+        for _ in range(count):
+            ring.put(LOGO, payload)
+        monitor.sample(now=2.0)
+        written = count * args.msg_size
+        check.expect("before wrap", "ew_ring_fill_ratio", written / args.size, 1e-4)
+        check.expect("before wrap", "ew_ring_written_bytes_total", written)
+        check.expect("before wrap", "ew_ring_write_rate_bytes", written / 2.0, 0.1)
+        check.expect("before wrap", "ew_ring_wraps_total", 0)
+
+        # Across the first wrap: full, oldest messages evicted
+        count = retained
+        for _ in range(count):
+            ring.put(LOGO, payload)
+        monitor.sample(now=3.0)
+        written += count * args.msg_size
+        check.expect("across wrap", "ew_ring_fill_ratio", retained * args.msg_size / args.size, 1e-4)
+        check.expect("across wrap", "ew_ring_written_bytes_total", written)
+        check.expect("across wrap", "ew_ring_write_rate_bytes", count * args.msg_size, 0.1)
+        check.expect("across wrap", "ew_ring_wraps_total", written // args.size)
+
+        # Several wraps between two samples
+        count = retained * 3 + 1
+        for _ in range(count):
+            ring.put(LOGO, payload)
+        monitor.sample(now=4.0)
+        written += count * args.msg_size
+        check.expect("several wraps", "ew_ring_written_bytes_total", written)
+        check.expect("several wraps", "ew_ring_wraps_total", written // args.size)
+
+        # keyin goes backwards: counting restarts from the new position
+        wraps = written // args.size
+        ring.head.keyold = 0
+        ring.head.keyin = 0
+        monitor.sample(now=5.0)
+        check.expect("reset", "ew_ring_written_bytes_total", written)
+        check.expect("reset", "ew_ring_wraps_total", wraps)
+        check.expect("reset", "ew_ring_fill_ratio", 0.0)
+        count = 3
+        for _ in range(count):
+            ring.put(LOGO, payload)
+        monitor.sample(now=6.0)
+        written += count * args.msg_size
+        check.expect("after reset", "ew_ring_written_bytes_total", written)
+        check.expect("after reset", "ew_ring_write_rate_bytes", count * args.msg_size, 0.1)
+        check.expect("after reset", "ew_ring_wraps_total", wraps)
+
+        # Removed and created again: the next sync attaches to the new
+        # segment, counting what was written to it from key 0
+        ring.remove()
+        ring = FakeRing(args.key, args.size)
+        count = 20
+        for _ in range(count):
+            ring.put(LOGO, payload)
+        monitor.sync({'1': {'name': RING, 'key': str(args.key), 'size': args.size // 1024}})
+        monitor.sample(now=7.0)
+        written += count * args.msg_size
+        check.expect("recreated", "ew_ring_written_bytes_total", written)
+        check.expect("recreated", "ew_ring_fill_ratio", count * args.msg_size / args.size, 1e-4)
+        check.expect("recreated", "ew_ring_wraps_total", wraps)
+        for _ in range(count):
+            ring.put(LOGO, payload)
+        monitor.sample(now=8.0)
+        written += count * args.msg_size
+        check.expect("after recreate", "ew_ring_written_bytes_total", written)
+        check.expect("after recreate", "ew_ring_write_rate_bytes", count * args.msg_size, 0.1)
+    finally:
+        monitor.close()
+        ring.remove()
+
+    print(f"{check.passed}/{check.passed + check.failed} checks passed")
+    return 1 if check.failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""End-to-end scrape benchmark against a synthetic Earthworm installation.
+
+Puts generated stand-in `status`, `ps`, `restart` and `stopmodule` commands
+on PATH, starts the exporter for each module count and drives /metrics with
+concurrent requests. Alive modules get real (sleeping) processes so the /proc
+reads are exercised too. Prints one JSON object per module count with
+throughput, p50/p99 latency, exporter CPU and RSS, and the mean time of each
+collection phase reported by the exporter itself.
+
+With --baseline, compares against an earlier run's output and exits non-zero
+when p99 or CPU per scrape got worse than --tolerance times the baseline.
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from concurrency import free_port, percentile  # noqa: E402
+from parser import HEADER, STATUSES  # noqa: E402
+
+FAKE_STATUS = """#!/bin/sh
+sleep {delay}
+cat {output}
+"""
+
+# Control commands only record what they were asked to do
+FAKE_CONTROL = """#!/bin/sh
+echo "$(basename "$0") $*" >> {log}
+"""
+
+CONFIG = """[server]
+host = 127.0.0.1
+port = {port}
+
+[collector]
+interval = {interval}
+max_age = {max_age}
+process_interval = {process_interval}
+disk_interval = 0
+
+[logging]
+log_dir = {log_dir}
+log_level = WARNING
+"""
+
+PHASE_SUM = re.compile(r'^ew_exporter_phase_duration_seconds_sum\{phase="(\w+)"\} (\S+)$', re.M)
+PHASE_COUNT = re.compile(r'^ew_exporter_phase_duration_seconds_count\{phase="(\w+)"\} (\S+)$', re.M)
+
+def installation(pids, padding: int, rings: int = 4) -> str:
+    ring_lines = "\n".join(
+        f"        Ring {i + 1:2d} name/key/size:  RING_{i} / {1000 + i} / 1024 kb"
+        for i in range(rings)
+    )
+    lines = [HEADER.format(rings=ring_lines)]
+    argument_pad = "x" * padding
+    for i, pid in enumerate(pids):
+        status = STATUSES[i % len(STATUSES)]
+        pid = "-" if status == "Not Exec" else str(pid)
+        lines.append(
+            f"    module_{i:04d}  {pid:>7}     {status:<8}   TS/ 0  "
+            f"00:{i % 60:02d}:00  module_{i:04d}.d{argument_pad}"
+        )
+    return "\n".join(lines) + "\n"
+
+def write_script(path: str, text: str) -> None:
+    with open(path, "w") as f:
+        f.write(text)
+    os.chmod(path, 0o755)
+
+def fetch(url: str, use_gzip: bool) -> float:
+    request = urllib.request.Request(url, headers={"Accept-Encoding": "gzip"} if use_gzip else {})
+    started = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=60) as resp:
+        resp.read()
+    return time.perf_counter() - started
+
+def cpu_seconds(pid: int) -> float:
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rpartition(")")[2].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+def rss_kb(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+def phase_means(body: str) -> dict:
+    counts = {phase: float(value) for phase, value in PHASE_COUNT.findall(body)}
+    return {
+        phase: round(float(total) / counts[phase] * 1000, 3)
+        for phase, total in PHASE_SUM.findall(body)
+        if counts.get(phase)
+    }
+
+def run(modules: int, args) -> dict:
+    sleepers = []
+    with tempfile.TemporaryDirectory() as workdir:
+        try:
+            # One live process per module that status reports with a PID
+            for i in range(modules):
+                status = STATUSES[i % len(STATUSES)]
+                if status in ("Alive", "Zombie") and args.live_pids:
+                    sleepers.append(subprocess.Popen(["sleep", "3600"]))
+                else:
+                    sleepers.append(None)
+            pids = [proc.pid if proc else 100000 + i for i, proc in enumerate(sleepers)]
+
+            bin_dir = os.path.join(workdir, "bin")
+            os.makedirs(bin_dir)
+            output = os.path.join(workdir, "status.txt")
+            with open(output, "w") as f:
+                f.write(installation(pids, args.padding))
+            write_script(os.path.join(bin_dir, "status"),
+                         FAKE_STATUS.format(delay=args.status_delay, output=output))
+            control_log = os.path.join(workdir, "control.log")
+            for name in ("ps", "restart", "stopmodule"):
+                write_script(os.path.join(bin_dir, name), FAKE_CONTROL.format(log=control_log))
+
+            port = free_port()
+            with open(os.path.join(workdir, "config.cfg"), "w") as f:
+                f.write(CONFIG.format(
+                    port=port,
+                    interval=args.interval,
+                    max_age=args.max_age,
+                    process_interval=args.process_interval,
+                    log_dir=os.path.join(workdir, "log")
+                ))
+
+            env = dict(os.environ, PATH=f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+            server = subprocess.Popen(
+                [sys.executable, os.path.join(REPO_DIR, "main.py")],
+                cwd=workdir, env=env,
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+            url = f"http://127.0.0.1:{port}/metrics"
+            try:
+                for _ in range(100):
+                    try:
+                        fetch(url, False)
+                        break
+                    except OSError:
+                        time.sleep(0.1)
+
+                # Warm up, then measure the load only
+                for _ in range(args.concurrency):
+                    fetch(url, args.gzip)
+                cpu_before = cpu_seconds(server.pid)
+                started = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                    latencies = list(pool.map(lambda _: fetch(url, args.gzip), range(args.requests)))
+                wall = time.perf_counter() - started
+                cpu = cpu_seconds(server.pid) - cpu_before
+                rss = rss_kb(server.pid)
+
+                with urllib.request.urlopen(url, timeout=60) as resp:
+                    body = resp.read().decode()
+                size = len(body)
+            finally:
+                server.terminate()
+                server.wait()
+        finally:
+            for proc in sleepers:
+                if proc is not None:
+                    proc.kill()
+                    proc.wait()
+
+    return {
+        "bench": "scrape",
+        "modules": modules,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "throughput_rps": round(args.requests / wall, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "cpu_ms_per_scrape": round(cpu / args.requests * 1000, 3),
+        "rss_kb": rss,
+        "body_bytes": size,
+        "phase_mean_ms": phase_means(body)
+    }
+
+def regressions(results, baseline_file: str, tolerance: float):
+    with open(baseline_file) as f:
+        baseline = {
+            entry["modules"]: entry
+            for entry in map(json.loads, filter(str.strip, f))
+            if entry.get("bench") == "scrape"
+        }
+    for result in results:
+        before = baseline.get(result["modules"])
+        if before is None:
+            continue
+        for key in ("p99_ms", "cpu_ms_per_scrape"):
+            if before[key] > 0 and result[key] > before[key] * tolerance:
+                yield f"{result['modules']} modules: {key} {before[key]} -> {result[key]}"
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--modules", default="10,100,1000", help="comma-separated module counts")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--status-delay", type=float, default=0.0, help="seconds status sleeps")
+    parser.add_argument("--padding", type=int, default=0, help="extra argument bytes per module line")
+    parser.add_argument("--interval", type=float, default=0,
+                        help="[collector] interval (0 = collect on scrape)")
+    parser.add_argument("--max-age", type=float, default=0,
+                        help="[collector] max_age (0 = every scrape wants a fresh collection)")
+    parser.add_argument("--process-interval", type=float, default=0)
+    parser.add_argument("--gzip", action="store_true", help="request gzip responses")
+    parser.add_argument("--no-live-pids", dest="live_pids", action="store_false",
+                        help="do not spawn a process per module")
+    parser.add_argument("--baseline", help="output of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=1.5)
+    args = parser.parse_args()
+
+    results = []
+    for modules in (int(n) for n in args.modules.split(",")):
+        result = run(modules, args)
+        results.append(result)
+        print(json.dumps(result), flush=True)
+
+    if args.baseline:
+        failed = list(regressions(results, args.baseline, args.tolerance))
+        for line in failed:
+            print(f"regression: {line}", file=sys.stderr)
+        return 1 if failed else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""Check what ChangeFeed.subscribe sends clients reconnecting with Last-Event-ID.
+
+A client gets the diffs it missed while they are retained, nothing when it is
+up to date, and the full state for any id the feed does not know: one older
+than the retained diffs, or one ahead of the feed (from before an exporter
+restart). Exits non-zero when one of the cases fails.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stream import ChangeFeed  # noqa: E402
+
+def instance_data(pid: int) -> dict:
+    return {'': {'module': {'pick_ew': {'status': 'Alive', 'pid': pid}}}}
+
+def kinds(initial) -> list:
+    return [(kind, seq) for kind, seq, _ in initial]
+
+def check(feed: ChangeFeed, label: str, last_seq, expected: list) -> bool:
+    got = kinds(feed.subscribe(last_seq)[1])
+    if got != expected:
+        print(f"FAIL {label} (Last-Event-ID {last_seq}): expected {expected}, got {got}")
+        return False
+    return True
+
+def main() -> int:
+    results = []
+
+    # Restarted exporter: one event published, the client last saw id 500
+    feed = ChangeFeed(replay_size=4)
+    feed.publish(instance_data(100))
+    results.append(check(feed, "id ahead of the feed", 500, [('state', 1)]))
+    results.append(check(feed, "up to date", 1, []))
+    results.append(check(feed, "no id", None, [('state', 1)]))
+
+    # seq 7, diffs 4 to 7 retained
+    for pid in range(101, 107):
+        feed.publish(instance_data(pid))
+    results.append(check(feed, "missed retained diffs", 5, [('diff', 6), ('diff', 7)]))
+    results.append(check(feed, "missed all retained diffs", 3, [('diff', 4), ('diff', 5), ('diff', 6), ('diff', 7)]))
+    results.append(check(feed, "missed diffs no longer retained", 2, [('state', 7)]))
+    results.append(check(feed, "id ahead of the feed", 8, [('state', 7)]))
+    results.append(check(feed, "up to date", 7, []))
+
+    print(f"{sum(results)}/{len(results)} cases passed")
+    return 0 if all(results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""Check the ring tailer's per-logo counts and TRACEBUF2 latency against a stand-in ring.
+
+Puts messages with known logos, sizes and data latency into a small FakeRing
+and compares ew_ring_messages_total, ew_ring_message_bytes_total,
+ew_ring_tail_lapped_total and the ew_waveform_latency_seconds buckets with
+what was written: plain messages, TPORT and TRACE2 headers straddling the
+end of the data area, little- and big-endian TRACEBUF2 packets, and a writer
+lapping the reader between two samples, whose overwritten messages must be
+skipped. Exits non-zero when a check fails.
+"""
+import argparse
+import bisect
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from prometheus_client import CollectorRegistry  # noqa: E402
+
+from fake_ring import FakeRing, tracebuf2_packet  # noqa: E402
+from rings import MESSAGE_TYPES, TPORT_HEAD_SIZE, TRACE2_HEADER_SIZE, RingMonitor  # noqa: E402
+
+RING = 'TEST_RING'
+TRACE = (19, 10, 2)
+HEARTBEAT = (3, 20, 1)
+PICK = (8, 30, 2)
+BUCKETS = [1.0, 5.0, 10.0, 30.0]
+
+class Check:
+    def __init__(self, registry: CollectorRegistry):
+        self.registry = registry
+        self.failed = 0
+        self.passed = 0
+
+    def expect(self, label: str, name: str, labels: dict, expected: float, tolerance: float = 0.0) -> None:
+        got = self.registry.get_sample_value(name, labels)
+        if got is not None and abs(got - expected) <= tolerance:
+            self.passed += 1
+        else:
+            self.failed += 1
+            print(f"FAIL {label}: {name}{labels} = {got}, expected {expected}")
+
+    def condition(self, label: str, condition: bool, detail: str = '') -> None:
+        if condition:
+            self.passed += 1
+        else:
+            self.failed += 1
+            print(f"FAIL {label} {detail}")
+
+class Writer:
+    # Puts messages into the ring and keeps what the tailer should report
+    # for the ones it gets to read
+
+    def __init__(self, ring: FakeRing):
+        self.ring = ring
+        # logo -> [messages, payload bytes]
+        self.counts = {}
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.latency_sum = 0.0
+
+    def offset(self) -> int:
+        # Bytes between the write position and the end of the data area
+        return self.ring.keymax - self.ring.head.keyin % self.ring.keymax
+
+    def put(self, logo: tuple, payload: bytes, read: bool = True) -> None:
+        self.ring.put(logo, payload)
+        if read:
+            counter = self.counts.setdefault(logo, [0, 0])
+            counter[0] += 1
+            counter[1] += len(payload)
+
+    def trace(self, latency: float, datatype: str = 'i4', read: bool = True) -> None:
+        payload = tracebuf2_packet("S001", "XX", "HHZ", "00", time.time() - latency, datatype=datatype)
+        self.put(TRACE, payload, read)
+        if read:
+            self.buckets[bisect.bisect_left(BUCKETS, latency)] += 1
+            self.latency_sum += latency
+
+    def pad_to(self, offset: int) -> None:
+        # Heartbeat that leaves the next message starting `offset` bytes
+        # before the end of the data area
+        while (self.offset() - offset) % self.ring.keymax < TPORT_HEAD_SIZE:
+            self.put(HEARTBEAT, bytes(10))
+        self.put(HEARTBEAT, bytes((self.offset() - offset) % self.ring.keymax - TPORT_HEAD_SIZE))
+
+def logo_labels(logo: tuple) -> dict:
+    msg_type, module, installation = logo
+    return {
+        'ring': RING,
+        'type': MESSAGE_TYPES.get(msg_type, str(msg_type)),
+        'module': str(module),
+        'installation': str(installation)
+    }
+
+def expect_counts(check: Check, label: str, writer: Writer) -> None:
+    for logo, (count, size) in writer.counts.items():
+        check.expect(label, "ew_ring_messages_total", logo_labels(logo), count)
+        check.expect(label, "ew_ring_message_bytes_total", logo_labels(logo), size)
+
+def expect_latency(check: Check, label: str, writer: Writer) -> None:
+    cumulative = 0
+    for le, count in zip(BUCKETS, writer.buckets):
+        cumulative += count
+        check.expect(label, "ew_waveform_latency_seconds_bucket", {'ring': RING, 'le': str(le)}, cumulative)
+    total = cumulative + writer.buckets[-1]
+    check.expect(label, "ew_waveform_latency_seconds_bucket", {'ring': RING, 'le': '+Inf'}, total)
+    check.expect(label, "ew_waveform_latency_seconds_count", {'ring': RING}, total)
+    # The tailer measures at poll time, a little after the packet was put
+    check.expect(label, "ew_waveform_latency_seconds_sum", {'ring': RING}, writer.latency_sum, 0.5)
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--key", type=int, default=4713)
+    parser.add_argument("--size", type=int, default=8192, help="data area bytes (keymax)")
+    args = parser.parse_args()
+
+    ring = FakeRing(args.key, args.size)
+    writer = Writer(ring)
+    registry = CollectorRegistry()
+    monitor = RingMonitor(latency_buckets=BUCKETS)
+    registry.register(monitor)
+    check = Check(registry)
+    try:
+        monitor.sync({'1': {'name': RING, 'key': str(args.key), 'size': args.size // 1024}})
+
+        # Known logos and sizes, with latencies in every bucket
+        for latency in (0.2, 3.0, 7.0):
+            writer.trace(latency)
+        for latency in (20.0, 100.0):
+            writer.trace(latency, datatype='s4')
+        for _ in range(3):
+            writer.put(HEARTBEAT, bytes(10))
+        writer.put(PICK, bytes(150))
+        writer.put(PICK, bytes(90))
+        monitor.sample()
+        expect_counts(check, "known logos", writer)
+        expect_latency(check, "known latencies", writer)
+
+        # TPORT header straddling the end of the data area
+        writer.pad_to(TPORT_HEAD_SIZE // 2)
+        monitor.sample()
+        check.condition("TPORT header straddles", writer.offset() < TPORT_HEAD_SIZE, str(writer.offset()))
+        writer.put(PICK, bytes(200))
+        monitor.sample()
+        check.condition("wrapped", ring.head.keyin > ring.keymax, str(ring.head.keyin))
+        expect_counts(check, "TPORT header straddling the end", writer)
+
+        # TRACE2 header straddling the end, little- and big-endian
+        for datatype, latency in (('i4', 3.0), ('s4', 7.0), ('i2', 0.5), ('t4', 50.0)):
+            writer.pad_to(TPORT_HEAD_SIZE + TRACE2_HEADER_SIZE // 2)
+            monitor.sample()
+            check.condition("TRACE2 header straddles",
+                            TPORT_HEAD_SIZE < writer.offset() < TPORT_HEAD_SIZE + TRACE2_HEADER_SIZE,
+                            str(writer.offset()))
+            writer.trace(latency, datatype=datatype)
+            monitor.sample()
+        expect_counts(check, "TRACE2 header straddling the end", writer)
+        expect_latency(check, "TRACE2 header straddling the end", writer)
+        check.expect("not lapped", "ew_ring_tail_lapped_total", {'ring': RING}, 0)
+
+        # The writer laps the reader: the overwritten messages are skipped
+        # and reading resumes at the write position
+        lapped_at = ring.head.keyin
+        while ring.head.keyin - lapped_at <= ring.keymax:
+            writer.put(PICK, bytes(500), read=False)
+            writer.trace(1.5, read=False)
+        monitor.sample()
+        check.expect("lapped", "ew_ring_tail_lapped_total", {'ring': RING}, 1)
+        expect_counts(check, "lapped", writer)
+        expect_latency(check, "lapped", writer)
+
+        writer.put(HEARTBEAT, bytes(10))
+        writer.trace(12.0, datatype='s4')
+        monitor.sample()
+        check.expect("after lap", "ew_ring_tail_lapped_total", {'ring': RING}, 1)
+        expect_counts(check, "after lap", writer)
+        expect_latency(check, "after lap", writer)
+    finally:
+        monitor.close()
+        ring.remove()
+
+    print(f"{check.passed}/{check.passed + check.failed} checks passed")
+    return 1 if check.failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
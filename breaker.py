@@ -0,0 +1,77 @@
+"""Circuit breakers for the external Earthworm commands."""
+import logging
+import time
+from typing import Dict, Optional, Tuple
+from prometheus_client.core import GaugeMetricFamily
+
+class CircuitOpenError(Exception):
+    pass
+
+class CircuitBreaker:
+    # Opens after `threshold` consecutive failures. While open, calls fail
+    # immediately; once `cooldown` has passed a single call is let through
+    # and its outcome closes the circuit or keeps it open for another period.
+
+    def __init__(self, name: str, threshold: int = 3, cooldown: float = 60.0):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def check(self) -> None:
+        if self.opened_at is None:
+            return
+        now = time.monotonic()
+        remaining = self.opened_at + self.cooldown - now
+        if remaining > 0:
+            raise CircuitOpenError(
+                f"'{self.name}' disabled for {remaining:.0f}s after {self.failures} failures"
+            )
+        # Trial call; others keep failing fast until it reports back
+        self.opened_at = now
+
+    def success(self) -> None:
+        if self.opened_at is not None:
+            logging.info(f"'{self.name}' succeeded again, closing circuit")
+        self.failures = 0
+        self.opened_at = None
+
+    def failure(self) -> None:
+        self.failures += 1
+        if self.failures >= self.threshold:
+            if self.opened_at is None:
+                logging.warning(
+                    f"'{self.name}' failed {self.failures} times in a row, "
+                    f"not running it for {self.cooldown:.0f}s"
+                )
+            self.opened_at = time.monotonic()
+
+class CircuitBreakers:
+    # One breaker per command name and instance, created on first use
+
+    def __init__(self, threshold: int = 3, cooldown: float = 60.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+
+    def get(self, name: str, instance: str = '') -> CircuitBreaker:
+        breaker = self.breakers.get((instance, name))
+        if breaker is None:
+            label = f"{instance}/{name}" if instance else name
+            breaker = self.breakers[(instance, name)] = CircuitBreaker(label, self.threshold, self.cooldown)
+        return breaker
+
+    def collect(self):
+        circuit_open = GaugeMetricFamily(
+            "ew_exporter_circuit_open",
+            "Whether the exporter has stopped running a failing command (1=open)",
+            labels=["ew_instance", "command"]
+        )
+        for (instance, name), breaker in self.breakers.items():
+            circuit_open.add_metric([instance, name], 1 if breaker.is_open else 0)
+        yield circuit_open
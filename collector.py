@@ -0,0 +1,307 @@
+"""Prometheus collector that renders the current Earthworm snapshot."""
+import logging
+import time
+from typing import Dict, Any, Optional
+from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily, InfoMetricFamily
+
+STATUS_VALUES = {
+    "Not Exec": 4,
+    "Zombie": 3,
+    "Dead": 2,
+    "Stop": 1,
+    "Alive": 0
+}
+# Status could not be determined
+STATUS_ERROR = 5
+
+def number(value: Any) -> float:
+    # Fields parsed from status may be missing or non-numeric (e.g. "NoPID")
+    try:
+        return float(value) if value is not None else 0.0
+    except (TypeError, ValueError):
+        return 0.0
+
+class EarthwormCollector:
+    # Yields metric families from the latest collected data only, so modules
+    # that disappear from startstop disappear from the exposition as well.
+    # Every series carries the ew_instance label; it is empty for the default
+    # installation, which Prometheus treats the same as no label at all.
+
+    def __init__(self):
+        # instance name -> data of its latest collection
+        self.data: Optional[Dict[str, Dict[str, Any]]] = None
+
+    def describe(self):
+        # Avoid a collection at registration time
+        return []
+
+    def collect(self):
+        instances = self.data
+        if instances is None:
+            return
+
+        try:
+            yield from self.collect_system(instances)
+            yield from self.collect_rings(instances)
+            yield from self.collect_modules(instances)
+            yield from self.collect_expected(instances)
+            yield from self.collect_exporter(instances)
+        except Exception as e:
+            logging.error(f"Error updating metrics: {e}")
+
+    def collect_system(self, instances: Dict[str, Dict[str, Any]]):
+        labels = ["ew_instance"]
+        disk_space = GaugeMetricFamily(
+            "ew_disk_space_bytes",
+            "Earthworm Available disk space in bytes",
+            labels=labels
+        )
+        avail = GaugeMetricFamily(
+            "ew_filesystem_avail_bytes",
+            "Free space in bytes on the filesystem holding the path",
+            labels=labels + ["path"]
+        )
+        size = GaugeMetricFamily(
+            "ew_filesystem_size_bytes",
+            "Size in bytes of the filesystem holding the path",
+            labels=labels + ["path"]
+        )
+        build = InfoMetricFamily(
+            "ew_build",
+            "Earthworm Startstop version and host reported by status",
+            labels=labels
+        )
+        uptime = GaugeMetricFamily(
+            "ew_startstop_uptime_seconds",
+            "Earthworm Startstop uptime in seconds",
+            labels=labels
+        )
+        clock_skew = GaugeMetricFamily(
+            "ew_status_clock_skew_seconds",
+            "Exporter clock minus the current time reported by status, in seconds",
+            labels=labels
+        )
+
+        for instance, data in instances.items():
+            system = data["system"]
+            if system.get("disk_space") is not None:
+                disk_space.add_metric([instance], system["disk_space"])
+
+            for path, usage in data.get("disk", {}).items():
+                avail.add_metric([instance, path], usage["avail"])
+                size.add_metric([instance, path], usage["size"])
+
+            if system.get("version") is not None or system.get("hostname_os") is not None:
+                build.add_metric([instance], {
+                    "version": system.get("version", ""),
+                    "hostname_os": system.get("hostname_os", "")
+                })
+
+            start = system.get("start_timestamp")
+            current = system.get("current_timestamp")
+            if start is not None and current is not None:
+                uptime.add_metric([instance], current - start)
+            if current is not None and system.get("collected_at") is not None:
+                clock_skew.add_metric([instance], round(system["collected_at"] - current, 3))
+
+        for family in (disk_space, avail, size, build, uptime, clock_skew):
+            if family.samples:
+                yield family
+
+    def collect_rings(self, instances: Dict[str, Dict[str, Any]]):
+        ring_size = GaugeMetricFamily(
+            "ew_ring_size_bytes",
+            "Earthworm Ring size in bytes",
+            labels=["ew_instance", "ring", "key"]
+        )
+        for instance, data in instances.items():
+            for ring in data["rings"].values():
+                ring_size.add_metric([instance, ring["name"], ring["key"]], ring["size"] * 1024)
+        yield ring_size
+
+    def collect_modules(self, instances: Dict[str, Dict[str, Any]]):
+        labels = ["ew_instance", "module"]
+        pid = GaugeMetricFamily("ew_module_pid", "Earthworm Module PID", labels=labels)
+        module_status = GaugeMetricFamily(
+            "ew_module_status",
+            "Earthworm Module status (5=Status Error, 4=Not Exec, 3=Zombie, 2=Dead, 1=Stop, 0=Alive)",
+            labels=labels
+        )
+        cpu_usage = GaugeMetricFamily(
+            "ew_module_cpu_usage",
+            "Earthworm Module CPU usage over the last collection interval (%)",
+            labels=labels
+        )
+        memory_usage_total = GaugeMetricFamily(
+            "ew_module_memory_usage_total",
+            "Earthworm Module Memory Usage (Total Memory) (%)",
+            labels=labels
+        )
+        memory_usage_allocated = GaugeMetricFamily(
+            "ew_module_memory_usage_allocated",
+            "Earthworm Module Memory Usage (Allocated Memory) (%)",
+            labels=labels
+        )
+        vsz = GaugeMetricFamily(
+            "ew_module_virtual_memory",
+            "Earthworm Module Virtual memory size (vsz) in kb",
+            labels=labels
+        )
+        rss = GaugeMetricFamily(
+            "ew_module_resident_memory",
+            "Earthworm Module Resident set size (rss) in kb",
+            labels=labels
+        )
+        cpu_user = CounterMetricFamily(
+            "ew_module_cpu_user_seconds",
+            "Earthworm Module CPU time spent in user mode",
+            labels=labels
+        )
+        cpu_system = CounterMetricFamily(
+            "ew_module_cpu_system_seconds",
+            "Earthworm Module CPU time spent in kernel mode",
+            labels=labels
+        )
+        threads = GaugeMetricFamily(
+            "ew_module_threads",
+            "Earthworm Module number of threads",
+            labels=labels
+        )
+        context_switches = CounterMetricFamily(
+            "ew_module_context_switches",
+            "Earthworm Module context switches (kind: voluntary, nonvoluntary)",
+            labels=labels + ["kind"]
+        )
+        open_fds = GaugeMetricFamily(
+            "ew_module_open_fds",
+            "Earthworm Module number of open file descriptors",
+            labels=labels
+        )
+        io_bytes = CounterMetricFamily(
+            "ew_module_io_bytes",
+            "Earthworm Module bytes read from and written to storage (direction: read, write)",
+            labels=labels + ["direction"]
+        )
+        io_chars = CounterMetricFamily(
+            "ew_module_io_chars",
+            "Earthworm Module bytes passed to read and write system calls, "
+            "including sockets and page cache (direction: read, write)",
+            labels=labels + ["direction"]
+        )
+        tcp_sockets = GaugeMetricFamily(
+            "ew_module_tcp_sockets",
+            "Earthworm Module open TCP sockets (state: established, listen, other)",
+            labels=labels + ["state"]
+        )
+
+        for instance, data in instances.items():
+            for module_name, module_data in data["module"].items():
+                label_values = [instance, module_name]
+                module_status.add_metric(
+                    label_values,
+                    STATUS_VALUES.get(module_data.get("status"), STATUS_ERROR)
+                )
+
+                allocated_memory = 0
+                if module_data.get("rss") is not None and module_data.get("vsz"):
+                    allocated_memory = (module_data["rss"]/module_data["vsz"])*100
+
+                pid.add_metric(label_values, number(module_data.get("pid")))
+                memory_usage_allocated.add_metric(label_values, round(allocated_memory, 2))
+                memory_usage_total.add_metric(label_values, number(module_data.get("memory_used")))
+                vsz.add_metric(label_values, number(module_data.get("vsz")))
+                rss.add_metric(label_values, number(module_data.get("rss")))
+
+                # CPU figures only exist for modules with a live process
+                if module_data.get("cpu_user_seconds") is not None:
+                    cpu_usage.add_metric(label_values, number(module_data.get("cpu_used")))
+                    cpu_user.add_metric(label_values, module_data["cpu_user_seconds"])
+                    cpu_system.add_metric(label_values, module_data["cpu_system_seconds"])
+                else:
+                    cpu_usage.add_metric(label_values, 0)
+
+                if module_data.get("threads") is not None:
+                    threads.add_metric(label_values, module_data["threads"])
+                    context_switches.add_metric(label_values + ["voluntary"], module_data["voluntary_ctxt_switches"])
+                    context_switches.add_metric(label_values + ["nonvoluntary"], module_data["nonvoluntary_ctxt_switches"])
+                if module_data.get("fds") is not None:
+                    open_fds.add_metric(label_values, module_data["fds"])
+                    for state, count in module_data["tcp_sockets"].items():
+                        tcp_sockets.add_metric(label_values + [state], count)
+                if module_data.get("io_read_bytes") is not None:
+                    io_bytes.add_metric(label_values + ["read"], module_data["io_read_bytes"])
+                    io_bytes.add_metric(label_values + ["write"], module_data["io_write_bytes"])
+                    io_chars.add_metric(label_values + ["read"], module_data["io_read_chars"])
+                    io_chars.add_metric(label_values + ["write"], module_data["io_write_chars"])
+
+        yield pid
+        yield module_status
+        yield cpu_usage
+        yield memory_usage_total
+        yield memory_usage_allocated
+        yield vsz
+        yield rss
+        yield cpu_user
+        yield cpu_system
+        yield threads
+        yield context_switches
+        yield open_fds
+        yield io_bytes
+        yield io_chars
+        yield tcp_sockets
+
+    def collect_expected(self, instances: Dict[str, Dict[str, Any]]):
+        expected = GaugeMetricFamily(
+            "ew_module_expected",
+            "Earthworm Module configured in the startstop config (always 1)",
+            labels=["ew_instance", "module", "argument", "priority"]
+        )
+        running = GaugeMetricFamily(
+            "ew_module_running",
+            "Earthworm Module configured in startstop has a running process (1) or not (0)",
+            labels=["ew_instance", "module"]
+        )
+        drift = GaugeMetricFamily(
+            "ew_module_config_drift",
+            "Earthworm Module differs from the startstop config (kind: not_in_status, "
+            "not_in_config, argument, priority, config_missing)",
+            labels=["ew_instance", "module", "kind"]
+        )
+        config_changed = GaugeMetricFamily(
+            "ew_startstop_config_changed",
+            "Startstop config modified after startstop started (1), so not yet in effect",
+            labels=["ew_instance"]
+        )
+
+        for instance, data in instances.items():
+            index = data.get("expected")
+            if index is None:
+                continue
+            for module_name, module in index["modules"].items():
+                expected.add_metric(
+                    [instance, module_name, module["argument"], module["priority"] or ""], 1
+                )
+                running.add_metric([instance, module_name], 1 if index["running"].get(module_name) else 0)
+            for module_name, kind in index["drift"]:
+                drift.add_metric([instance, module_name, kind], 1)
+            config_changed.add_metric([instance], 1 if index["config_changed"] else 0)
+
+        if config_changed.samples:
+            yield expected
+            yield running
+            yield drift
+            yield config_changed
+
+    def collect_exporter(self, instances: Dict[str, Dict[str, Any]]):
+        # As of rendering; stale snapshots are re-rendered when served
+        age = GaugeMetricFamily(
+            "ew_exporter_snapshot_age_seconds",
+            "Seconds since the status output behind this snapshot was collected",
+            labels=["ew_instance"]
+        )
+        now = time.time()
+        for instance, data in instances.items():
+            collected_at = data["system"].get("collected_at")
+            if collected_at is not None:
+                age.add_metric([instance], round(now - collected_at, 3))
+        yield age
@@ -0,0 +1,158 @@
+"""Queue of module control jobs (restart, stop) run by a bounded worker pool."""
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Any, List, Optional, Tuple
+from prometheus_client import Histogram, CollectorRegistry
+
+from instances import qualified_name
+
+# Action -> Earthworm command taking the module PID
+COMMANDS = {'restart': 'restart', 'stop': 'stopmodule'}
+
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60)
+
+class ControlItem:
+    # One module of a job
+    __slots__ = ('instance', 'module', 'pid', 'state', 'error', 'exception',
+                 'queued_at', 'started_at', 'finished_at')
+
+    def __init__(self, instance: str, module: str):
+        self.instance = instance
+        self.module = module
+        # PID the command was run with, resolved when the item runs
+        self.pid: Optional[int] = None
+        # queued, running, ok or failed
+        self.state = 'queued'
+        self.error: Optional[str] = None
+        self.exception: Optional[Exception] = None
+        self.queued_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'instance': self.instance,
+            'module': self.module,
+            'pid': self.pid,
+            'state': self.state,
+            'error': self.error,
+            'queued_at': self.queued_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+
+class ControlJob:
+    def __init__(self, action: str, items: List[ControlItem]):
+        self.id = uuid.uuid4().hex[:16]
+        self.action = action
+        self.items = items
+        self.created_at = time.time()
+        self.remaining = len(items)
+        self.finished = asyncio.Event()
+        if not items:
+            self.finished.set()
+
+    @property
+    def state(self) -> str:
+        if self.remaining:
+            return 'queued' if all(item.state == 'queued' for item in self.items) else 'running'
+        return 'failed' if any(item.state == 'failed' for item in self.items) else 'done'
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'action': self.action,
+            'state': self.state,
+            'created_at': self.created_at,
+            'done': len(self.items) - self.remaining,
+            'total': len(self.items),
+            'items': [item.to_dict() for item in self.items]
+        }
+
+class ControlQueue:
+    # Jobs are split into one item per module and queued; `workers` tasks
+    # run them, so a bulk restart of ten modules runs that many commands
+    # at a time at most. A per-module lock keeps two operations on the same
+    # module from overlapping, whichever jobs they belong to. The last
+    # `max_jobs` jobs are kept for polling.
+
+    def __init__(
+        self,
+        registry: CollectorRegistry,
+        execute: Callable[[str, ControlItem], Awaitable[None]],
+        workers: int = 4,
+        max_jobs: int = 100
+    ):
+        self.execute = execute
+        self.workers = workers
+        self.max_jobs = max_jobs
+        self.queue: Optional[asyncio.Queue] = None
+        self.tasks: List[asyncio.Task] = []
+        self.jobs: 'OrderedDict[str, ControlJob]' = OrderedDict()
+        # (instance, module) -> lock
+        self.locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+
+        self.duration = Histogram(
+            "ew_exporter_control_duration_seconds",
+            "Time to run a module control operation, by action and result",
+            ["action", "result"],
+            buckets=DURATION_BUCKETS,
+            registry=registry
+        )
+        self.wait_time = Histogram(
+            "ew_exporter_control_wait_seconds",
+            "Time a module control operation waited for a worker and the module lock",
+            ["action"],
+            buckets=DURATION_BUCKETS,
+            registry=registry
+        )
+
+    def start(self) -> None:
+        self.queue = asyncio.Queue()
+        self.tasks = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+
+    def stop(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+
+    def submit(self, action: str, targets: List[Tuple[str, str]]) -> ControlJob:
+        job = ControlJob(action, [ControlItem(instance, module) for instance, module in targets])
+        self.jobs[job.id] = job
+        while len(self.jobs) > self.max_jobs:
+            self.jobs.popitem(last=False)
+        for item in job.items:
+            self.queue.put_nowait((job, item))
+        return job
+
+    async def worker(self) -> None:
+        while True:
+            job, item = await self.queue.get()
+            lock = self.locks.setdefault((item.instance, item.module), asyncio.Lock())
+            async with lock:
+                await self.run(job, item)
+
+    async def run(self, job: ControlJob, item: ControlItem) -> None:
+        name = qualified_name(item.instance, item.module)
+        item.state = 'running'
+        item.started_at = time.time()
+        self.wait_time.labels(job.action).observe(item.started_at - item.queued_at)
+        started = time.monotonic()
+        try:
+            await self.execute(job.action, item)
+            item.state = 'ok'
+            logging.info(f"{job.action} of module '{name}' (PID: {item.pid}) done")
+        except Exception as e:
+            item.state = 'failed'
+            item.error = str(e)
+            item.exception = e
+            logging.error(f"{job.action} of module '{name}' failed: {e}")
+        finally:
+            self.duration.labels(job.action, item.state).observe(time.monotonic() - started)
+            item.finished_at = time.time()
+            job.remaining -= 1
+            if not job.remaining:
+                job.finished.set()
@@ -0,0 +1,135 @@
+"""Per-snapshot exposition index for filtered /metrics requests."""
+import gzip
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+from prometheus_client import generate_latest
+from prometheus_client.metrics_core import Metric
+from prometheus_client.openmetrics.exposition import generate_latest as generate_openmetrics
+
+OPENMETRICS_EOF = b'# EOF\n'
+
+# Filtered bodies kept per snapshot; checks tend to repeat the same query
+CACHE_SIZE = 32
+
+class Families:
+    # Registry stand-in handing already collected families to the
+    # exposition functions
+    def __init__(self, families: Iterable[Metric]):
+        self.families = families
+
+    def collect(self) -> Iterable[Metric]:
+        return self.families
+
+def exposed_names(family: Metric) -> Tuple[str, ...]:
+    # Names a family can be asked for: its own and the one the text
+    # format exposes it under
+    if family.type == 'counter':
+        return (family.name, family.name + '_total')
+    if family.type == 'info':
+        return (family.name, family.name + '_info')
+    return (family.name,)
+
+class SnapshotIndex:
+    # The collected families of one snapshot with their rendered text
+    # chunks. The full body is the concatenation of the chunks; a request
+    # for some families joins just those. The module index (per family,
+    # the samples of each module) is built on the first request filtering
+    # by module, so snapshots nobody filters cost nothing extra. OpenMetrics
+    # chunks are likewise rendered on the first OpenMetrics request.
+
+    def __init__(self, families: List[Metric], chunks: List[bytes]):
+        self.families = families
+        self.chunks = chunks
+        self.by_name: Dict[str, int] = {}
+        for i, family in enumerate(families):
+            for name in exposed_names(family):
+                self.by_name[name] = i
+        # family index -> module -> samples; None for families without a
+        # module label
+        self.by_module: Optional[List[Optional[Dict[str, list]]]] = None
+        self.openmetrics_chunks: Optional[List[bytes]] = None
+        self.cache: 'OrderedDict[Tuple, bytes]' = OrderedDict()
+
+    @classmethod
+    def render(cls, families: List[Metric]) -> 'SnapshotIndex':
+        return cls(families, [generate_latest(Families([family])) for family in families])
+
+    @property
+    def body(self) -> bytes:
+        return b''.join(self.chunks)
+
+    def openmetrics(self) -> List[bytes]:
+        if self.openmetrics_chunks is None:
+            self.openmetrics_chunks = [
+                generate_openmetrics(Families([family]))[:-len(OPENMETRICS_EOF)]
+                for family in self.families
+            ]
+        return self.openmetrics_chunks
+
+    def module_index(self) -> List[Optional[Dict[str, list]]]:
+        if self.by_module is None:
+            by_module = []
+            for family in self.families:
+                samples: Dict[str, list] = {}
+                for sample in family.samples:
+                    module_name = sample.labels.get('module')
+                    if module_name is not None:
+                        samples.setdefault(module_name, []).append(sample)
+                by_module.append(samples or None)
+            self.by_module = by_module
+        return self.by_module
+
+    def filtered(
+        self,
+        modules: List[str],
+        names: List[str],
+        openmetrics: bool = False,
+        compress: bool = False
+    ) -> bytes:
+        # Families named in `names` (all when empty), restricted to the
+        # series of `modules` (when given). Families without a module label
+        # are left out of module queries.
+        key = (tuple(modules), tuple(names), openmetrics, compress)
+        body = self.cache.get(key)
+        if body is not None:
+            self.cache.move_to_end(key)
+            return body
+        if compress:
+            body = gzip.compress(self.filtered(modules, names, openmetrics), mtime=0)
+            self.store(key, body)
+            return body
+
+        if names:
+            indices = sorted({self.by_name[name] for name in names if name in self.by_name})
+        else:
+            indices = range(len(self.families))
+
+        if not modules:
+            chunks = self.openmetrics() if openmetrics else self.chunks
+            body = b''.join(chunks[i] for i in indices)
+        else:
+            by_module = self.module_index()
+            selected = []
+            for i in indices:
+                samples_by_module = by_module[i]
+                if samples_by_module is None:
+                    continue
+                samples = [sample for module_name in modules for sample in samples_by_module.get(module_name, ())]
+                if samples:
+                    family = self.families[i]
+                    subset = Metric(family.name, family.documentation, family.type, family.unit)
+                    subset.samples = samples
+                    selected.append(subset)
+            if openmetrics:
+                body = generate_openmetrics(Families(selected))[:-len(OPENMETRICS_EOF)]
+            else:
+                body = generate_latest(Families(selected))
+        if openmetrics:
+            body += OPENMETRICS_EOF
+        self.store(key, body)
+        return body
+
+    def store(self, key: Tuple, body: bytes) -> None:
+        self.cache[key] = body
+        if len(self.cache) > CACHE_SIZE:
+            self.cache.popitem(last=False)
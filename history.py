@@ -0,0 +1,273 @@
+"""Fixed-memory history of module and ring metrics, served at /history."""
+import logging
+import time
+from array import array
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily
+
+from collector import STATUS_VALUES, STATUS_ERROR
+
+# Recorded series per kind: metric -> how samples are combined into the
+# coarser resolutions. Status keeps the worst value of the bucket so a
+# short Dead does not average away.
+MODULE_METRICS = {'status': 'max', 'cpu': 'mean', 'rss': 'mean', 'memory': 'mean'}
+RING_METRICS = {'fill_ratio': 'mean', 'write_rate': 'mean'}
+AGGREGATIONS = {'module': MODULE_METRICS, 'ring': RING_METRICS}
+
+# Resolution name -> bucket seconds (0 = every sample)
+RESOLUTIONS = (('raw', 0), ('1m', 60), ('10m', 600))
+
+# Largest timestamp delta a sample can store, in milliseconds
+MAX_DELTA = 0xFFFFFFFF
+
+SeriesKey = Tuple[str, str, str, str]
+
+def module_values(module_data: Dict[str, Any]) -> Iterator[Tuple[str, float]]:
+    yield 'status', STATUS_VALUES.get(module_data.get('status'), STATUS_ERROR)
+    # CPU and memory only exist for modules with a live process
+    if module_data.get('cpu_user_seconds') is not None:
+        yield 'cpu', module_data['cpu_used']
+        yield 'rss', module_data['rss']
+        yield 'memory', module_data['memory_used']
+
+class Tier:
+    # Ring buffer of (time, value) samples in preallocated arrays. Times
+    # are stored as millisecond deltas to the previous sample next to the
+    # time of the oldest one, so a sample takes 8 bytes (uint32 delta and
+    # float32 value).
+    __slots__ = ('deltas', 'values', 'capacity', 'first', 'count', 'start', 'last_time')
+
+    def __init__(self, capacity: int):
+        self.deltas = array('I', bytes(4 * capacity))
+        self.values = array('f', bytes(4 * capacity))
+        self.capacity = capacity
+        # Index of the oldest sample
+        self.first = 0
+        self.count = 0
+        # Time of the oldest and of the newest sample
+        self.start = 0.0
+        self.last_time = 0.0
+
+    def append(self, t: float, value: float) -> None:
+        if self.count == 0:
+            delta = 0
+            self.start = self.last_time = t
+        else:
+            delta = min(max(round((t - self.last_time) * 1000), 0), MAX_DELTA)
+            # Follow the stored deltas so reading back gives the same times
+            self.last_time += delta / 1000
+
+        if self.count == self.capacity:
+            # Overwrite the oldest; the next one's delta is relative to it
+            index = self.first
+            self.first = (self.first + 1) % self.capacity
+            self.start += self.deltas[self.first] / 1000
+        else:
+            index = (self.first + self.count) % self.capacity
+            self.count += 1
+        self.deltas[index] = delta
+        self.values[index] = value
+
+    def points(self, since: float) -> List[Tuple[float, float]]:
+        points = []
+        t = self.start
+        for i in range(self.count):
+            index = (self.first + i) % self.capacity
+            if i:
+                t += self.deltas[index] / 1000
+            if t >= since:
+                points.append((round(t, 3), self.values[index]))
+        return points
+
+class Series:
+    # One tier per resolution. The coarser tiers receive one aggregated
+    # sample when a bucket is complete; the bucket in progress is kept in
+    # `pending` and included in queries.
+    __slots__ = ('tiers', 'aggregation', 'pending', 'last_seen')
+
+    def __init__(self, capacities: Tuple[int, ...], aggregation: str):
+        self.tiers = [Tier(capacity) for capacity in capacities]
+        self.aggregation = aggregation
+        # Per coarser tier: [bucket start, sum or max, sample count]
+        self.pending: List[Optional[List[float]]] = [None] * (len(capacities) - 1)
+        self.last_seen = 0.0
+
+    def add(self, t: float, value: float) -> None:
+        self.last_seen = t
+        self.tiers[0].append(t, value)
+        for i, (_, seconds) in enumerate(RESOLUTIONS[1:]):
+            bucket = t // seconds * seconds
+            pending = self.pending[i]
+            if pending is not None and pending[0] != bucket:
+                self.tiers[i + 1].append(pending[0], self.combine(pending))
+                pending = None
+            if pending is None:
+                self.pending[i] = [bucket, value, 1]
+            elif self.aggregation == 'max':
+                pending[1] = max(pending[1], value)
+                pending[2] += 1
+            else:
+                pending[1] += value
+                pending[2] += 1
+
+    def combine(self, pending: List[float]) -> float:
+        return pending[1] if self.aggregation == 'max' else pending[1] / pending[2]
+
+    def points(self, tier: int, since: float) -> List[Tuple[float, float]]:
+        points = self.tiers[tier].points(since)
+        if tier and self.pending[tier - 1] is not None and self.pending[tier - 1][0] >= since:
+            pending = self.pending[tier - 1]
+            points.append((pending[0], self.combine(pending)))
+        return points
+
+    def oldest(self, tier: int) -> Optional[float]:
+        return self.tiers[tier].start if self.tiers[tier].count else None
+
+class HistoryStore:
+    # Series are keyed by (instance, kind, name, metric), kind being
+    # "module" or "ring". Every series preallocates all its tiers, so memory
+    # use is series count times a fixed size, and no new series is created
+    # once max_bytes would be exceeded. Series not updated for departed_ttl
+    # seconds (modules removed from startstop, rings gone) are dropped, and
+    # the longest departed ones make room for new series first.
+
+    def __init__(
+        self,
+        capacities: Tuple[int, int, int] = (720, 360, 288),
+        max_bytes: int = 32 << 20,
+        departed_ttl: float = 3600.0
+    ):
+        self.capacities = capacities
+        self.series_bytes = 8 * sum(capacities)
+        self.max_series = max(max_bytes // self.series_bytes, 0)
+        self.departed_ttl = departed_ttl
+        self.series: Dict[SeriesKey, Series] = {}
+        self.pruned_at = 0.0
+        # Time of the previous record() pass: series updated then are live
+        self.previous_pass = 0.0
+        self.current_pass = 0.0
+        self.rejected = 0
+        self.rejecting = False
+
+    def record(
+        self,
+        instances_data: Dict[str, Dict[str, Any]],
+        rings: Dict[str, Dict[str, Dict[str, float]]],
+        now: Optional[float] = None
+    ) -> None:
+        now = time.time() if now is None else now
+        self.previous_pass, self.current_pass = self.current_pass, now
+        for instance, data in instances_data.items():
+            for module_name, module_data in data['module'].items():
+                for metric, value in module_values(module_data):
+                    self.add((instance, 'module', module_name, metric), now, value)
+        # Rings are recorded under the instance whose status lists them, so
+        # same-named rings of different installations stay apart
+        for instance, instance_rings in rings.items():
+            for ring_name, values in instance_rings.items():
+                for metric, value in values.items():
+                    self.add((instance, 'ring', ring_name, metric), now, value)
+
+        if now - self.pruned_at >= 60:
+            self.pruned_at = now
+            self.prune(now - self.departed_ttl)
+
+    def add(self, key: SeriesKey, t: float, value: Any) -> None:
+        if value is None:
+            return
+        series = self.series.get(key)
+        if series is None:
+            if len(self.series) >= self.max_series and not self.evict():
+                self.rejected += 1
+                if not self.rejecting:
+                    logging.warning(
+                        f"History holds {len(self.series)} series, the most "
+                        f"[history] max_bytes allows; not recording new ones"
+                    )
+                    self.rejecting = True
+                return
+            series = self.series[key] = Series(self.capacities, AGGREGATIONS[key[1]][key[3]])
+        series.add(t, float(value))
+
+    def evict(self) -> bool:
+        # Drop the series that went without updates the longest, if it
+        # missed the previous pass too. Series updated then are live even
+        # when this pass has not reached them yet.
+        if not self.series:
+            return False
+        key, series = min(self.series.items(), key=lambda item: item[1].last_seen)
+        if series.last_seen >= self.previous_pass:
+            return False
+        del self.series[key]
+        self.rejecting = False
+        return True
+
+    def prune(self, before: float) -> None:
+        for key in [key for key, series in self.series.items() if series.last_seen < before]:
+            del self.series[key]
+            self.rejecting = False
+
+    def query(
+        self,
+        instance: Optional[str] = None,
+        kind: Optional[str] = None,
+        name: Optional[str] = None,
+        metric: Optional[str] = None,
+        since: float = 0.0,
+        resolution: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        # Without a resolution, the finest one whose samples go back to
+        # `since`, or else the one going back furthest
+        names = [res for res, _ in RESOLUTIONS]
+        results = []
+        for (series_instance, series_kind, series_name, series_metric), series in self.series.items():
+            if instance is not None and series_instance != instance:
+                continue
+            if kind is not None and series_kind != kind:
+                continue
+            if name is not None and series_name != name:
+                continue
+            if metric is not None and series_metric != metric:
+                continue
+            if resolution is not None:
+                tier = names.index(resolution)
+            else:
+                tier = 0
+                furthest = None
+                for i in range(len(names)):
+                    oldest = series.oldest(i)
+                    if oldest is None:
+                        continue
+                    if oldest <= since:
+                        tier = i
+                        break
+                    if furthest is None or oldest < furthest:
+                        tier, furthest = i, oldest
+            results.append({
+                'instance': series_instance,
+                series_kind: series_name,
+                'metric': series_metric,
+                'resolution': names[tier],
+                'points': series.points(tier, since)
+            })
+        return results
+
+    def collect(self):
+        series = GaugeMetricFamily(
+            "ew_exporter_history_series",
+            "Series kept in the exporter's in-memory history"
+        )
+        series.add_metric([], len(self.series))
+        size = GaugeMetricFamily(
+            "ew_exporter_history_bytes",
+            "Memory preallocated by the exporter's in-memory history"
+        )
+        size.add_metric([], len(self.series) * self.series_bytes)
+        rejected = CounterMetricFamily(
+            "ew_exporter_history_rejected_samples",
+            "Samples of new series not recorded because the history was full"
+        )
+        rejected.add_metric([], self.rejected)
+        yield series
+        yield size
+        yield rejected
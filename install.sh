@@ -66,7 +66,7 @@ ${VENV_DIR}/bin/pip install -r requirements.txt
 
 # Copy files
 log "Copying files..."
-cp main.py ${INSTALL_DIR}/
+cp *.py ${INSTALL_DIR}/
 cp config.cfg ${INSTALL_DIR}/
 
 # Create wrapper script
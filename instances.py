@@ -0,0 +1,114 @@
+"""Earthworm installations watched by one exporter."""
+import asyncio
+import configparser
+import logging
+import os
+import signal
+from typing import Dict, List, Optional
+
+import procfs
+from startstop import StartstopIndex
+from status_parser import StatusParser
+
+# Section prefix of additional installations, e.g. [instance:backup]
+SECTION_PREFIX = 'instance:'
+
+# Prints the environment left behind by an Earthworm environment script
+SOURCE_SCRIPT = '. "$1" >/dev/null 2>&1; exec env -0'
+
+class Instance:
+    # One Earthworm installation: the environment its commands run in and
+    # the per-installation collection state. The default instance (name "")
+    # uses the exporter's own environment.
+
+    def __init__(
+        self,
+        name: str,
+        env_file: Optional[str] = None,
+        disk_paths: Optional[List[str]] = None,
+        startstop_config: Optional[str] = None,
+        cpu_min_interval: float = 0.0
+    ):
+        self.name = name
+        self.env_file = env_file
+        self.disk_paths = disk_paths or []
+        # Startstop config to index; found via status or EW_PARAMS when unset
+        self.startstop_config = startstop_config
+        self.startstop_index: Optional[StartstopIndex] = None
+        # Environment sourced from env_file, cached until the file changes
+        self.env: Optional[Dict[str, str]] = None
+        self.env_mtime: Optional[float] = None
+        self.status_parser = StatusParser()
+        self.cpu_tracker = procfs.CpuRateTracker(cpu_min_interval)
+        self.process_details = procfs.ProcessDetailReader()
+        # Collection in flight, shared by everyone who needs fresh data
+        self.collection_task: Optional[asyncio.Task] = None
+
+    async def environment(self, timeout: float) -> Optional[Dict[str, str]]:
+        # None means inherit the exporter's environment
+        if self.env_file is None:
+            return None
+        mtime = os.stat(self.env_file).st_mtime
+        if self.env is None or mtime != self.env_mtime:
+            self.env = await source_environment(self.env_file, timeout)
+            self.env_mtime = mtime
+            logging.info(f"Loaded environment of instance '{self.name}' from {self.env_file}")
+        return self.env
+
+async def source_environment(env_file: str, timeout: float) -> Dict[str, str]:
+    proc = await asyncio.create_subprocess_exec(
+        'bash', '-c', SOURCE_SCRIPT, 'bash', env_file,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+        start_new_session=True
+    )
+    try:
+        stdout, _ = await asyncio.wait_for(proc.communicate(), timeout)
+    finally:
+        if proc.returncode is None:
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            await proc.wait()
+    if proc.returncode != 0:
+        raise OSError(f"Sourcing {env_file} failed with exit code {proc.returncode}")
+
+    env = {}
+    for entry in stdout.decode(errors='replace').split('\0'):
+        key, sep, value = entry.partition('=')
+        if sep:
+            env[key] = value
+    return env
+
+def load_instances(
+    config: configparser.ConfigParser,
+    disk_paths: List[str],
+    startstop_config: Optional[str] = None,
+    cpu_min_interval: float = 0.0
+) -> List[Instance]:
+    # Without [instance:<name>] sections the exporter watches the single
+    # installation whose commands are on its own PATH
+    instances = []
+    for section in config.sections():
+        if not section.startswith(SECTION_PREFIX):
+            continue
+        name = section[len(SECTION_PREFIX):].strip()
+        paths = config.get(section, 'disk_paths', fallback='')
+        instances.append(Instance(
+            name,
+            env_file=config.get(section, 'env_file', fallback=None),
+            disk_paths=[path.strip() for path in paths.split(',') if path.strip()] or disk_paths,
+            startstop_config=config.get(section, 'startstop_config', fallback=startstop_config),
+            cpu_min_interval=cpu_min_interval
+        ))
+    return instances or [Instance(
+        '',
+        disk_paths=disk_paths,
+        startstop_config=startstop_config,
+        cpu_min_interval=cpu_min_interval
+    )]
+
+def qualified_name(instance: str, module_name: str) -> str:
+    # "instance/module" in log messages, just the module for the default instance
+    return f"{instance}/{module_name}" if instance else module_name
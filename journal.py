@@ -0,0 +1,120 @@
+"""Append-only journal of raw collector inputs, for replaying them later."""
+import gzip
+import json
+import logging
+import os
+import socket
+import time
+import zlib
+from typing import Any, Dict, Iterator, List, Tuple
+
+from status_parser import CURRENT_TIME_LINE, status_digest
+
+JOURNAL_VERSION = 1
+
+# Lines of /proc/<pid>/status the collector uses; the rest is not recorded
+STATUS_LINES = ('Name:', 'Threads:', 'voluntary_ctxt_switches:', 'nonvoluntary_ctxt_switches:')
+
+# Record kinds, one JSON object per line:
+#   header  {"t", "kind", "version", "hostname"}             once per writer
+#   status  {"t", "kind", "instance", "output"} or
+#           {"t", "kind", "instance", "same": true, "current_time"}
+#   proc    {"t", "kind", "mem_total_kb", "uptime", "procs": {pid: [stat, statm, status]}}
+
+class JournalWriter:
+    # Records are buffered and written as one gzip member per flush, so the
+    # file stays a valid (multi-member) gzip stream that only ever grows and
+    # a crash loses at most the unflushed batch. Status output that only
+    # differs from the previous one in its current time line is stored as a
+    # "same" marker carrying the new time.
+
+    def __init__(self, path: str, flush_interval: float = 60.0, max_bytes: int = 1 << 30):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.buffer: List[bytes] = []
+        self.flushed_at = time.monotonic()
+        # instance -> digest of the last status output recorded
+        self.last_digest: Dict[str, bytes] = {}
+        self.full = False
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.append({
+            'kind': 'header',
+            'version': JOURNAL_VERSION,
+            'hostname': socket.gethostname()
+        })
+
+    def append(self, record: Dict[str, Any]) -> None:
+        if self.full:
+            return
+        record['t'] = time.time()
+        self.buffer.append(json.dumps(record, separators=(',', ':')).encode() + b'\n')
+        if time.monotonic() - self.flushed_at >= self.flush_interval:
+            self.flush()
+
+    def record_status(self, instance: str, output: str) -> None:
+        digest, current_time = status_digest(output)
+        if digest == self.last_digest.get(instance):
+            self.append({'kind': 'status', 'instance': instance, 'same': True, 'current_time': current_time})
+            return
+        self.last_digest[instance] = digest
+        self.append({'kind': 'status', 'instance': instance, 'output': output})
+
+    def record_proc(self, mem_total_kb: int, uptime: float, procs: Dict[int, Tuple[str, str, str]]) -> None:
+        self.append({
+            'kind': 'proc',
+            'mem_total_kb': mem_total_kb,
+            'uptime': uptime,
+            'procs': {
+                pid: (stat, statm, ''.join(
+                    line + '\n' for line in status.split('\n') if line.startswith(STATUS_LINES)
+                ))
+                for pid, (stat, statm, status) in procs.items()
+            }
+        })
+
+    def flush(self) -> None:
+        self.flushed_at = time.monotonic()
+        if not self.buffer:
+            return
+        member = gzip.compress(b''.join(self.buffer), mtime=0)
+        self.buffer = []
+        try:
+            if os.path.exists(self.path) and os.path.getsize(self.path) + len(member) > self.max_bytes:
+                logging.warning(f"Journal {self.path} reached {self.max_bytes} bytes, recording stopped")
+                self.full = True
+                return
+            with open(self.path, 'ab') as f:
+                f.write(member)
+        except OSError as e:
+            logging.error(f"Error writing journal {self.path}: {e}")
+
+    def close(self) -> None:
+        self.flush()
+
+def read_journal(path: str) -> Iterator[Dict[str, Any]]:
+    # Yields records in order with "same" status markers resolved to the
+    # full output, with the marker's current time put back in. A batch cut
+    # short by a crash ends the journal.
+    last_output: Dict[str, str] = {}
+    try:
+        with gzip.open(path, 'rt') as f:
+            for line in f:
+                record = json.loads(line)
+                if record['kind'] == 'status':
+                    instance = record.setdefault('instance', '')
+                    if record.get('same'):
+                        output = last_output[instance]
+                        match = CURRENT_TIME_LINE.search(output)
+                        if match is not None and record.get('current_time') is not None:
+                            output = output[:match.start(1)] + record['current_time'] + output[match.end(1):]
+                        record['output'] = output
+                    last_output[instance] = record['output']
+                elif record['kind'] == 'proc':
+                    record['procs'] = {int(pid): tuple(files) for pid, files in record['procs'].items()}
+                yield record
+    except (EOFError, zlib.error, gzip.BadGzipFile, json.JSONDecodeError) as e:
+        logging.warning(f"Journal {path} ends with an incomplete batch: {e}")
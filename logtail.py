@@ -0,0 +1,418 @@
+"""Incremental tailing of the Earthworm module logs in EW_LOG."""
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import re
+import struct
+import time
+from typing import Dict, Any, Iterable, Optional, Set, Tuple
+from prometheus_client.core import CounterMetricFamily
+
+from status_parser import config_stem
+
+# logit names each file after the module's config file (or program) and the
+# day it was opened: pick_ew_20240115.log, startstop_20240115.log
+LOG_NAME = re.compile(r'^(?P<stem>.+)_(?P<date>\d{8})\.log$')
+
+# Failure modes worth telling apart, matched against the lowercased line;
+# a line counts as the kind matched earliest in it, or "other"
+KINDS = [
+    ('missed_messages', rb'missed (?:\d+ )?(?:messages?|msgs?)|msgs? missed|tport_getmsg'),
+    ('ring_overflow', rb'overflow|overwr(?:ote|itten)|overran'),
+    ('connection', rb'(?:lost|broken|closed|refused|reset) (?:the )?connection'
+                   rb'|connection (?:lost|broken|closed|refused|reset|timed out)|reconnect'),
+    ('timeout', rb'time ?out|timed out'),
+    ('not_found', rb'not found|no such file|cannot open|can\'t open'),
+]
+KIND_PATTERN = re.compile(b'|'.join(b'(?P<%s>%s)' % (name.encode(), pattern) for name, pattern in KINDS))
+LEVEL_PATTERN = re.compile(rb'(?P<error>\b(?:error|fatal|fail(?:ed|ure)?|abort(?:ing|ed)?)\b)|(?P<warning>\bwarn(?:ing)?\b)')
+# Every match of the patterns above contains one of these. Lines without
+# any are plain info lines and never reach the regular expressions, which
+# are far slower than a substring search.
+TRIGGERS = (
+    b'missed', b'tport_getmsg', b'overflow', b'overwr', b'overran', b'connection', b'reconnect',
+    b'timeout', b'time out', b'timed out', b'not found', b'no such file', b'cannot open', b"can't open",
+    b'error', b'fatal', b'fail', b'abort', b'warn'
+)
+# Newlines that end an empty line (the one at the very start aside)
+EMPTY_LINE = re.compile(rb'\n(?=\n)')
+
+# Bytes read from one file per run, so a burst cannot stall the event loop;
+# the rest is read on the next runs
+MAX_READ = 4 << 20
+# Longest line kept while waiting for its newline
+MAX_LINE = 64 << 10
+
+IN_MODIFY = 0x00000002
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+# struct inotify_event: wd, mask, cookie, len, then len bytes of name
+INOTIFY_EVENT = struct.Struct('iIII')
+
+libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+def classify(line: bytes) -> Tuple[str, str]:
+    # (level, kind) of a lowercased log line. A known failure kind without
+    # an explicit level word is still a warning.
+    kind_match = KIND_PATTERN.search(line)
+    level_match = LEVEL_PATTERN.search(line)
+    kind = kind_match.lastgroup if kind_match is not None else 'other'
+    if level_match is not None:
+        level = level_match.lastgroup
+    else:
+        level = 'warning' if kind_match is not None else 'info'
+    return level, kind
+
+def count_lines(text: bytes, counts: Dict[Tuple[str, str], int]) -> None:
+    # Adds the (level, kind) of every non-empty line of `text`, which ends
+    # with a newline, to `counts`
+    lowered = text.lower()
+    flagged = set()
+    for trigger in TRIGGERS:
+        position = lowered.find(trigger)
+        while position >= 0:
+            flagged.add(lowered.rfind(b'\n', 0, position) + 1)
+            position = lowered.find(trigger, lowered.find(b'\n', position))
+    for start in flagged:
+        key = classify(lowered[start:lowered.find(b'\n', start)])
+        counts[key] = counts.get(key, 0) + 1
+
+    empty = len(EMPTY_LINE.findall(lowered)) + (1 if lowered.startswith(b'\n') else 0)
+    plain = lowered.count(b'\n') - len(flagged) - empty
+    if plain > 0:
+        counts[('info', 'other')] = counts.get(('info', 'other'), 0) + plain
+
+def inotify_watch(path: str) -> Optional[int]:
+    # Non-blocking inotify fd watching the directory, None where inotify
+    # is unavailable (the tailer then stats the files it follows)
+    if not hasattr(libc, 'inotify_init1'):
+        return None
+    fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    if fd < 0:
+        return None
+    if libc.inotify_add_watch(fd, os.fsencode(path), IN_MODIFY | IN_CREATE | IN_MOVED_TO) < 0:
+        logging.warning(f"Cannot watch {path} with inotify: {os.strerror(ctypes.get_errno())}")
+        os.close(fd)
+        return None
+    return fd
+
+def read_events(fd: int) -> Optional[Set[str]]:
+    # Names of the files changed since the last call; None when the kernel
+    # queue overflowed and events were lost
+    names: Set[str] = set()
+    while True:
+        try:
+            buffer = os.read(fd, 65536)
+        except BlockingIOError:
+            return names
+        offset = 0
+        while offset < len(buffer):
+            _, mask, _, length = INOTIFY_EVENT.unpack_from(buffer, offset)
+            offset += INOTIFY_EVENT.size
+            if mask & IN_Q_OVERFLOW:
+                return None
+            names.add(os.fsdecode(buffer[offset:offset + length].rstrip(b'\0')))
+            offset += length
+
+class LogFile:
+    __slots__ = ('path', 'stem', 'date', 'fd', 'inode', 'offset', 'partial')
+
+    def __init__(self, path: str, stem: str, date: str):
+        self.path = path
+        self.stem = stem
+        self.date = date
+        self.fd: Optional[int] = None
+        self.inode: Optional[int] = None
+        self.offset = 0
+        self.partial = b''
+
+class LogTailer:
+    # Follows the newest log of every module in one log directory. Each
+    # file is read from the offset reached last time, through a descriptor
+    # kept open, so nothing is read twice and a growing file costs one
+    # pread per run. Offsets are saved by inode and resumed on restart;
+    # files first seen at startup are followed from their end.
+    #
+    # With inotify only the files named in events are looked at, plus those
+    # a capped read left behind, and the directory is listed once; without it the followed files are fstat'ed
+    # every run and the directory is listed every rescan_interval to notice
+    # the next day's files. A module whose log rolls over has its previous
+    # file read to the end before switching.
+
+    def __init__(self, state_path: Optional[str] = None, rescan_interval: float = 60.0):
+        self.state_path = state_path
+        self.rescan_interval = rescan_interval
+        self.log_dir: Optional[str] = None
+        self.inotify_fd: Optional[int] = None
+        self.rescanned_at = 0.0
+        # stem -> file currently followed
+        self.files: Dict[str, LogFile] = {}
+        # stem -> module name, from the latest status
+        self.module_names: Dict[str, str] = {}
+        # stem -> (level, kind) -> lines
+        self.messages: Dict[str, Dict[Tuple[str, str], int]] = {}
+        # stem -> bytes
+        self.bytes_read: Dict[str, int] = {}
+        # Files with more to read than the last read took; with inotify no
+        # event may come for them again
+        self.behind: Set[LogFile] = set()
+        self.saved_offsets = self.load_state()
+
+    def load_state(self) -> Dict[str, Tuple[int, int]]:
+        if self.state_path is None:
+            return {}
+        try:
+            with open(self.state_path, 'r') as f:
+                return {path: tuple(value) for path, value in json.load(f).items()}
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logging.error(f"Cannot read log offsets from {self.state_path}: {e}")
+            return {}
+
+    def save_state(self) -> None:
+        if self.state_path is None:
+            return
+        state = {
+            log_file.path: (log_file.inode, log_file.offset)
+            for log_file in self.files.values()
+            if log_file.inode is not None
+        }
+        try:
+            directory = os.path.dirname(self.state_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(f'{self.state_path}.tmp', 'w') as f:
+                json.dump(state, f)
+            os.replace(f'{self.state_path}.tmp', self.state_path)
+        except OSError as e:
+            logging.error(f"Cannot save log offsets to {self.state_path}: {e}")
+
+    def set_modules(self, modules: Dict[str, Dict[str, Any]]) -> None:
+        names = {}
+        for module_name, module_data in modules.items():
+            names[module_name] = module_name
+            stem = config_stem(module_data.get('argument'))
+            if stem is not None:
+                names[stem] = module_name
+        self.module_names = names
+
+    def set_log_dir(self, log_dir: str) -> None:
+        log_dir = log_dir.rstrip('/') or '/'
+        if log_dir == self.log_dir:
+            return
+        self.close_files()
+        if self.inotify_fd is not None:
+            os.close(self.inotify_fd)
+        self.log_dir = log_dir
+        self.inotify_fd = inotify_watch(log_dir)
+        logging.info(
+            f"Following module logs in {log_dir} "
+            f"({'inotify' if self.inotify_fd is not None else 'polling'})"
+        )
+        self.rescan(startup=True)
+
+    def poll(self) -> None:
+        if self.log_dir is None:
+            return
+        now = time.monotonic()
+        if self.inotify_fd is not None:
+            names = read_events(self.inotify_fd)
+            if names is None:
+                logging.warning(f"inotify queue overflowed for {self.log_dir}, listing it again")
+                self.rescan()
+                return
+            for log_file in list(self.behind):
+                self.read(log_file)
+            self.follow_names(names)
+        else:
+            if now - self.rescanned_at >= self.rescan_interval:
+                self.rescan()
+                return
+            for log_file in list(self.files.values()):
+                self.read(log_file)
+        if now - self.rescanned_at >= self.rescan_interval:
+            # Offsets only need to survive restarts, not every read
+            self.rescanned_at = now
+            self.save_state()
+
+    def follow_names(self, names: Iterable[str]) -> None:
+        for name in names:
+            match = LOG_NAME.match(name)
+            if match is None:
+                continue
+            current = self.files.get(match['stem'])
+            if current is None or current.fd is None or match['date'] > current.date:
+                self.switch(os.path.join(self.log_dir, name), match['stem'], match['date'], startup=False)
+            elif match['date'] == current.date:
+                self.check_replaced(current)
+                self.read(current)
+
+    def rescan(self, startup: bool = False) -> None:
+        self.rescanned_at = time.monotonic()
+        newest: Dict[str, Tuple[str, str]] = {}
+        try:
+            with os.scandir(self.log_dir) as entries:
+                for entry in entries:
+                    match = LOG_NAME.match(entry.name)
+                    if match is None:
+                        continue
+                    stem, date = match['stem'], match['date']
+                    if stem not in newest or date > newest[stem][1]:
+                        newest[stem] = (entry.path, date)
+        except OSError as e:
+            logging.error(f"Cannot list log directory {self.log_dir}: {e}")
+            return
+
+        for stem, (path, date) in newest.items():
+            current = self.files.get(stem)
+            if current is None or current.fd is None or date > current.date:
+                self.switch(path, stem, date, startup)
+            else:
+                self.check_replaced(current)
+                self.read(current)
+        self.save_state()
+
+    def switch(self, path: str, stem: str, date: str, startup: bool) -> None:
+        previous = self.files.get(stem)
+        if previous is not None:
+            # Lines written just before the rollover
+            self.read(previous, limit=None)
+            self.close_file(previous)
+        log_file = self.files[stem] = LogFile(path, stem, date)
+        if not self.open(log_file):
+            return
+        saved = self.saved_offsets.pop(path, None)
+        size = os.fstat(log_file.fd).st_size
+        if saved is not None and saved[0] == log_file.inode and saved[1] <= size:
+            log_file.offset = saved[1]
+        elif startup:
+            # History written before the exporter started is not counted
+            log_file.offset = size
+        self.read(log_file)
+
+    def open(self, log_file: LogFile) -> bool:
+        try:
+            log_file.fd = os.open(log_file.path, os.O_RDONLY | os.O_CLOEXEC)
+        except OSError as e:
+            logging.error(f"Cannot open module log {log_file.path}: {e}")
+            return False
+        log_file.inode = os.fstat(log_file.fd).st_ino
+        return True
+
+    def read(self, log_file: LogFile, limit: Optional[int] = MAX_READ) -> None:
+        if log_file.fd is None:
+            self.behind.discard(log_file)
+            return
+        size = os.fstat(log_file.fd).st_size
+        if size < log_file.offset:
+            # Truncated in place
+            log_file.offset = 0
+            log_file.partial = b''
+        if size == log_file.offset:
+            self.behind.discard(log_file)
+            return
+        length = size - log_file.offset if limit is None else min(size - log_file.offset, limit)
+        chunk = os.pread(log_file.fd, length, log_file.offset)
+        log_file.offset += len(chunk)
+        if log_file.offset < size:
+            self.behind.add(log_file)
+        else:
+            self.behind.discard(log_file)
+        self.bytes_read[log_file.stem] = self.bytes_read.get(log_file.stem, 0) + len(chunk)
+
+        text = log_file.partial + chunk
+        end = text.rfind(b'\n') + 1
+        log_file.partial = text[end:][-MAX_LINE:]
+        if end:
+            count_lines(text[:end], self.messages.setdefault(log_file.stem, {}))
+
+    def check_replaced(self, log_file: LogFile) -> None:
+        # A file replaced under the same name (moved or recreated) is
+        # followed from its start, after what is left of the old one
+        try:
+            inode = os.stat(log_file.path).st_ino
+        except FileNotFoundError:
+            return
+        if inode != log_file.inode:
+            self.read(log_file, limit=None)
+            self.close_file(log_file)
+            log_file.offset = 0
+            log_file.partial = b''
+            self.open(log_file)
+
+    def close_file(self, log_file: LogFile) -> None:
+        self.behind.discard(log_file)
+        if log_file.fd is not None:
+            os.close(log_file.fd)
+            log_file.fd = None
+
+    def close_files(self) -> None:
+        for log_file in self.files.values():
+            self.close_file(log_file)
+        self.files = {}
+
+    def close(self) -> None:
+        self.save_state()
+        self.close_files()
+        if self.inotify_fd is not None:
+            os.close(self.inotify_fd)
+            self.inotify_fd = None
+
+class LogTailers:
+    # One tailer per instance, created on first use
+
+    def __init__(self, state_dir: Optional[str] = None, rescan_interval: float = 60.0):
+        self.state_dir = state_dir
+        self.rescan_interval = rescan_interval
+        self.tailers: Dict[str, LogTailer] = {}
+
+    def get(self, instance: str = '') -> LogTailer:
+        tailer = self.tailers.get(instance)
+        if tailer is None:
+            state_path = None
+            if self.state_dir is not None:
+                name = f"log_offsets-{instance}.json" if instance else "log_offsets.json"
+                state_path = os.path.join(self.state_dir, name)
+            tailer = self.tailers[instance] = LogTailer(state_path, self.rescan_interval)
+        return tailer
+
+    def close(self) -> None:
+        for tailer in self.tailers.values():
+            tailer.close()
+
+    def collect(self):
+        messages = CounterMetricFamily(
+            "ew_module_log_messages",
+            "Earthworm Module log lines, by level (error, warning, info) and kind",
+            labels=["ew_instance", "module", "level", "kind"]
+        )
+        log_bytes = CounterMetricFamily(
+            "ew_module_log_bytes",
+            "Earthworm Module log bytes read by the exporter",
+            labels=["ew_instance", "module"]
+        )
+        for instance, tailer in self.tailers.items():
+            # Logs of modules no longer in status keep their file name
+            totals: Dict[Tuple[str, str, str], int] = {}
+            for stem, counts in tailer.messages.items():
+                module_name = tailer.module_names.get(stem, stem)
+                for (level, kind), count in counts.items():
+                    key = (module_name, level, kind)
+                    totals[key] = totals.get(key, 0) + count
+            for (module_name, level, kind), count in totals.items():
+                messages.add_metric([instance, module_name, level, kind], count)
+
+            byte_totals: Dict[str, int] = {}
+            for stem, count in tailer.bytes_read.items():
+                module_name = tailer.module_names.get(stem, stem)
+                byte_totals[module_name] = byte_totals.get(module_name, 0) + count
+            for module_name, count in byte_totals.items():
+                log_bytes.add_metric([instance, module_name], count)
+        yield messages
+        yield log_bytes
@@ -1,18 +1,47 @@
 import json
 import time
-from fastapi import FastAPI, Response, HTTPException, status
+import asyncio
+import gzip
+import hashlib
+import shutil
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from fastapi import FastAPI, Request, Response, HTTPException, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
 from prometheus_client import (
-    Gauge, 
-    generate_latest, 
     CONTENT_TYPE_LATEST,
-    CollectorRegistry
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    ProcessCollector
 )
+from prometheus_client.openmetrics.exposition import CONTENT_TYPE_LATEST as OPENMETRICS_CONTENT_TYPE
 import subprocess
 import configparser
 import logging
 import os
+import signal
+import functools
+import fnmatch
+import threading
 import uvicorn
-from typing import Dict, Any
+import procfs
+from collector import EarthwormCollector
+from rings import RingMonitor
+from pidwatch import PidWatcher
+from scheduler import Scheduler
+from breaker import CircuitBreakers, CircuitOpenError
+from profiler import Profiler, ProfileBusyError
+from journal import JournalWriter
+from logtail import LogTailers
+from history import HistoryStore, RESOLUTIONS
+from stream import ChangeFeed, StreamFullError
+from exposition import SnapshotIndex
+from control import ControlQueue, ControlItem, COMMANDS
+from instances import Instance, load_instances
+import startstop
+from typing import Dict, Any, List, Optional, Tuple
 
 # Load configuration
 config = configparser.ConfigParser()
@@ -32,246 +61,605 @@ logging.basicConfig(
     ]
 )
 
-# Create FastAPI app
-app = FastAPI(
-    title="Earthworm Exporter",
-    description="Prometheus exporter for Earthworm seismic processing system",
-    version="1.0.0"
+# Collector settings
+collect_interval = config.getfloat('collector', 'interval', fallback=15.0)
+max_age = config.getfloat('collector', 'max_age', fallback=max(collect_interval * 2, 5.0))
+# Cheaper sources refresh between status runs
+process_interval = config.getfloat('collector', 'process_interval', fallback=min(collect_interval, 5.0))
+disk_interval = config.getfloat('collector', 'disk_interval', fallback=60.0)
+# I/O, fd, thread and socket counts on top of CPU and memory
+process_details = config.getboolean('collector', 'process_details', fallback=True)
+disk_paths = [
+    path.strip() for path in config.get('collector', 'disk_paths', fallback='').split(',') if path.strip()
+]
+# Scheduling: random spread of each interval, and backoff when a run takes
+# more than backoff_share of its interval (up to max_backoff times slower)
+collect_jitter = config.getfloat('collector', 'jitter', fallback=0.1)
+backoff_share = config.getfloat('collector', 'backoff_share', fallback=0.5)
+max_backoff = config.getfloat('collector', 'max_backoff', fallback=8.0)
+
+# External command settings
+command_timeout = config.getfloat('commands', 'timeout', fallback=10.0)
+control_timeout = config.getfloat('commands', 'control_timeout', fallback=30.0)
+failure_threshold = config.getint('commands', 'failure_threshold', fallback=3)
+cooldown = config.getfloat('commands', 'cooldown', fallback=60.0)
+
+# Opt-in sampling profiler at /debug/profile
+profile_enabled = config.getboolean('debug', 'profile', fallback=False)
+profile_interval = config.getfloat('debug', 'profile_interval', fallback=0.005)
+profile_max_seconds = config.getfloat('debug', 'profile_max_seconds', fallback=60.0)
+
+# Expected modules from the startstop config
+startstop_enabled = config.getboolean('startstop', 'enabled', fallback=True)
+startstop_config = config.get('startstop', 'config', fallback=None)
+
+# Journal of raw status and /proc captures, for bench/replay.py
+journal_enabled = config.getboolean('journal', 'record', fallback=False)
+journal_path = config.get('journal', 'path', fallback='/opt/ew_exporter/journal/ew_exporter.journal.gz')
+journal_flush_interval = config.getfloat('journal', 'flush_interval', fallback=60.0)
+journal_max_bytes = config.getint('journal', 'max_bytes', fallback=1 << 30)
+
+# Ring monitor settings
+rings_enabled = config.getboolean('rings', 'enabled', fallback=False)
+rings_interval = config.getfloat('rings', 'interval', fallback=0.5)
+rings_tail = config.getboolean('rings', 'tail', fallback=False)
+
+# Waveform latency settings (TRACEBUF2 headers read by the ring tailer)
+latency_enabled = config.getboolean('latency', 'enabled', fallback=False)
+latency_buckets = [
+    float(le) for le in config.get('latency', 'buckets', fallback='0.5,1,2,5,10,30,60,120,300').split(',')
+]
+latency_rings = [
+    name.strip() for name in config.get('latency', 'rings', fallback='').split(',') if name.strip()
+]
+latency_top_k = config.getint('latency', 'top_k', fallback=10)
+
+# Module exit detection settings
+pidwatch_enabled = config.getboolean('pidwatch', 'enabled', fallback=True)
+pidwatch_poll_interval = config.getfloat('pidwatch', 'poll_interval', fallback=0.2)
+
+# Module log settings
+logs_enabled = config.getboolean('logs', 'enabled', fallback=True)
+logs_interval = config.getfloat('logs', 'interval', fallback=1.0)
+logs_rescan_interval = config.getfloat('logs', 'rescan_interval', fallback=60.0)
+logs_state_dir = config.get('logs', 'state_dir', fallback=None)
+
+# In-memory history settings
+history_enabled = config.getboolean('history', 'enabled', fallback=True)
+history_interval = config.getfloat('history', 'interval', fallback=process_interval or collect_interval)
+# Samples kept at each resolution (raw, 1 minute, 10 minutes)
+history_capacities = (
+    max(config.getint('history', 'raw_samples', fallback=720), 2),
+    max(config.getint('history', 'minute_samples', fallback=360), 2),
+    max(config.getint('history', 'ten_minute_samples', fallback=288), 2)
 )
+history_max_bytes = config.getint('history', 'max_bytes', fallback=32 << 20)
+history_departed_ttl = config.getfloat('history', 'departed_ttl', fallback=3600.0)
+
+# Change feed settings
+stream_enabled = config.getboolean('stream', 'enabled', fallback=True)
+stream_queue_size = config.getint('stream', 'queue_size', fallback=64)
+stream_max_clients = config.getint('stream', 'max_clients', fallback=100)
+stream_keepalive = config.getfloat('stream', 'keepalive', fallback=15.0)
+
+# Module control settings
+control_workers = max(config.getint('control', 'workers', fallback=4), 1)
+control_max_jobs = max(config.getint('control', 'max_jobs', fallback=100), 1)
 
 # Create a custom registry
 registry = CollectorRegistry()
 
-# Metrics Definitions
-disk_space = Gauge(
-    "ew_disk_space_bytes", 
-    "Earthworm Available disk space in bytes",
-    registry=registry
-)
-pid = Gauge(
-    "ew_module_pid", 
-    "Earthworm Module PID", 
-    ["module"],
-    registry=registry
-)
-module_status = Gauge(
-    "ew_module_status", 
-    "Earthworm Module status (3=Not Exec, 2=Zombie, 1=Alive, 0=Dead)", 
-    ["module"],
-    registry=registry
-)
-module_cpu_usage = Gauge(
-    "ew_module_cpu_usage", 
-    "Earthworm Module CPU usage (%)", 
-    ["module"],
-    registry=registry
-)
-module_memory_usage_total = Gauge(
-    "ew_module_memory_usage_total", 
-    "Earthworm Module Memory Usage (Total Memory) (%)", 
-    ["module"],
+# Metric families are built from the data of the latest collection
+earthworm_collector = EarthwormCollector()
+registry.register(earthworm_collector)
+
+# Optional reader of ring headers in shared memory
+ring_monitor = RingMonitor(
+    tail=rings_tail,
+    latency_buckets=latency_buckets if latency_enabled else None,
+    latency_rings=latency_rings,
+    latency_top_k=latency_top_k
+) if rings_enabled else None
+if ring_monitor is not None:
+    registry.register(ring_monitor)
+
+# Runs each collection source on its own interval
+scheduler = Scheduler(jitter=collect_jitter, backoff_share=backoff_share, max_backoff=max_backoff)
+registry.register(scheduler)
+
+# Follows the module logs of each instance
+log_tailers = LogTailers(
+    state_dir=logs_state_dir,
+    rescan_interval=logs_rescan_interval
+) if logs_enabled else None
+if log_tailers is not None:
+    registry.register(log_tailers)
+
+# Recent module and ring metrics for /history
+history = HistoryStore(
+    capacities=history_capacities,
+    max_bytes=history_max_bytes,
+    departed_ttl=history_departed_ttl
+) if history_enabled else None
+if history is not None:
+    registry.register(history)
+
+# Pushes module state changes of each new snapshot to /stream clients
+change_feed = ChangeFeed(
+    queue_size=stream_queue_size,
+    max_subscribers=stream_max_clients
+) if stream_enabled else None
+if change_feed is not None:
+    registry.register(change_feed)
+
+# Stops running commands that keep failing or hanging
+breakers = CircuitBreakers(threshold=failure_threshold, cooldown=cooldown)
+registry.register(breakers)
+
+collect_failures = Counter(
+    "ew_exporter_collect_failures",
+    "Collection runs that failed, per source",
+    ["ew_instance", "source"],
     registry=registry
 )
-module_memory_usage_allocated = Gauge(
-    "ew_module_memory_usage_allocated", 
-    "Earthworm Module Memory Usage (Allocated Memory) (%)", 
-    ["module"],
+
+# Exporter self-instrumentation
+ProcessCollector(namespace='ew_exporter', registry=registry)
+
+phase_seconds = Histogram(
+    "ew_exporter_phase_duration_seconds",
+    "Time spent in each phase of a collection",
+    ["phase"],
     registry=registry
 )
-module_vsz = Gauge(
-    "ew_module_virtual_memory", 
-    "Earthworm Module Virtual memory size (vsz) in kb", 
-    ["module"],
+
+subprocesses = Counter(
+    "ew_exporter_subprocesses",
+    "External commands run by the exporter, by outcome",
+    ["ew_instance", "command", "result"],
     registry=registry
 )
-module_rss = Gauge(
-    "ew_module_resident_memory", 
-    "Earthworm Module Resident set size (rss) in kb", 
-    ["module"],
-    registry=registry
+
+journal = JournalWriter(
+    journal_path,
+    flush_interval=journal_flush_interval,
+    max_bytes=journal_max_bytes
+) if journal_enabled else None
+
+# Earthworm installations to watch: the one on our own PATH, or one per
+# [instance:<name>] section. CPU rates need samples at least half a /proc
+# interval apart.
+instances = load_instances(
+    config,
+    disk_paths,
+    startstop_config,
+    cpu_min_interval=(process_interval or collect_interval or max_age) / 2
 )
+instances_by_name = {instance.name: instance for instance in instances}
 
-def get_earthworm_status() -> Dict[str, Any]:
+async def run_command(instance: Instance, args: List[str], timeout: float = command_timeout) -> str:
+    # Run an external command without blocking the event loop; a command
+    # that hangs (e.g. status on wedged rings) is killed after `timeout`
+    breaker = breakers.get(args[0], instance.name)
     try:
-        data = {
-            'system': {},
-            'rings': {},
-            'module': {}
-        }
+        breaker.check()
+    except CircuitOpenError:
+        subprocesses.labels(instance.name, args[0], 'circuit_open').inc()
+        raise
+    try:
+        env = await instance.environment(command_timeout)
+    except Exception:
+        breaker.failure()
+        raise
+    proc = await asyncio.create_subprocess_exec(
+        *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        env=env,
+        # Own process group, so children holding the pipes are killed too
+        start_new_session=True
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        breaker.failure()
+        subprocesses.labels(instance.name, args[0], 'timeout').inc()
+        raise subprocess.TimeoutExpired(args, timeout)
+    finally:
+        if proc.returncode is None:
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            await proc.wait()
+    if proc.returncode != 0:
+        breaker.failure()
+        subprocesses.labels(instance.name, args[0], 'error').inc()
+        raise subprocess.CalledProcessError(proc.returncode, args, stdout, stderr)
+    breaker.success()
+    subprocesses.labels(instance.name, args[0], 'ok').inc()
+    return stdout.decode(errors='replace')
 
+async def get_earthworm_status(instance: Instance) -> Dict[str, Any]:
+    try:
         # Run status command with full path
-        result = subprocess.run(
-            ["status"], 
-            capture_output=True, 
-            text=True, 
-            check=True
-        )
-        output = result.stdout
-
-        # Parse system information
-        for line in output.split("\n"):
-            line = line.strip()
-            
-            if "Hostname-OS:" in line:
-                data['system']['hostname_os'] = line.split(':', 1)[1].strip()
-            elif "Start time (UTC):" in line:
-                data['system']['start_time'] = line.split(':', 1)[1].strip()
-            elif "Current time (UTC):" in line:
-                data['system']['current_time'] = line.split(':', 1)[1].strip()
-            elif "Disk space avail:" in line:
-                data['system']['disk_space'] = int(line.split(':', 1)[1].strip().split()[0])
-            elif "Ring" in line and "name/key/size:" in line:
-                parts = line.split(':', 1)[1].strip().split('/')
-                ring_num = line.split()[1]
-                data['rings'][ring_num] = {
-                    'name': parts[0].strip(),
-                    'key': parts[1].strip(),
-                    'size': int(parts[2].strip().split()[0])
-                }
-            elif "Startstop Version:" in line:
-                data['system']['version'] = line.split(':', 1)[1].strip()
-
-        # Parse module status
-        modules = []
-        process_section = False
-        for line in output.split("\n"):
-            if "Process  Process" in line or "Name" in line or "-------" in line:
-                process_section = True
-                continue
-            
-            if process_section and line.strip():
-                parts = line.split()
-                if len(parts) >= 3:
-                    module_name = parts[0]
-                    if module_name not in data['module']:
-                        data['module'][module_name] = {
-                            'status': None,
-                            'pid': None,
-                            'priority': None,
-                            'cpu_used': None,
-                            'argument': None
-                        }
-                    data['module'][module_name]['status'] = parts[2]
-                    data['module'][module_name]['pid'] = parts[1]
-                    if len(parts) >= 4:
-                        data['module'][module_name]['priority'] = parts[3]
-                    if len(parts) >= 5:
-                        data['module'][module_name]['cpu_used'] = parts[4]
-                    if len(parts) >= 6:
-                        data['module'][module_name]['argument'] = parts[6]
-                    modules.append(module_name)
-
-        # print(modules)
-
-        # Get detailed process info
-        paths = '|'.join(modules)
-        cmd = f'ps aux | grep -E "{paths}" | grep -v grep'
-        result1 = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-        output1 = result1.stdout
-
-        for line in output1.split("\n"):
-            if line.strip():
-                parts = line.split(maxsplit=10)
-                if len(parts) >= 11:
-                    command = parts[10]
-                    module_name = next((name for name in modules if name in command), None)
-                    
-                    if module_name:
-                        data['module'][module_name].update({
-                            'pid': int(parts[1]),
-                            'cpu_used': round(float(parts[2]), 2),
-                            'memory_used': round(float(parts[3]), 2),
-                            'vsz': int(parts[4]),
-                            'rss': int(parts[5]),
-                            'tty': parts[6],
-                            'stat': parts[7],
-                            'start': parts[8],
-                            'time': parts[9],
-                            'command': command
-                        })
-
+        with phase_seconds.labels(phase='status').time():
+            output = await run_command(instance, ["status"])
+        if journal is not None:
+            journal.record_status(instance.name, output)
+        with phase_seconds.labels(phase='parse').time():
+            data = instance.status_parser.parse(output)
+        data['system']['collected_at'] = time.time()
+        update_process_stats({instance.name: data})
         return data
 
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Error running status command: {e}")
+    except CircuitOpenError:
+        raise
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+        logging.error(f"Error running status command of instance '{instance.name}': {e}")
         return None
     except Exception as e:
         logging.error(f"Error: {e}")
         return None
 
-def get_process_info() -> Dict[str, str]:
-    try:
-        # Run status command
-        result = subprocess.run(
-            ["status"], 
-            capture_output=True, 
-            text=True, 
-            check=True
-        )
-        
-        processes = {}
-        process_section = False
-        
-        # Parse output line by line
-        for line in result.stdout.split("\n"):
-            # Detect start of process section
-            if "Process  Process" in line or "Name" in line or "-------" in line:
-                process_section = True
+def update_process_stats(instances_data: Dict[str, Dict[str, Any]]) -> None:
+    with phase_seconds.labels(phase='process').time():
+        read_process_stats(instances_data)
+
+def read_process_stats(instances_data: Dict[str, Dict[str, Any]]) -> None:
+    # Get detailed process info from /proc, keyed by the PIDs status reports
+    mem_total_kb = procfs.read_mem_total_kb()
+    uptime = procfs.read_uptime()
+    procs = {}
+    for data in instances_data.values():
+        for module_data in data['module'].values():
+            if module_data['pid'] is None:
                 continue
-            
-            # Parse process lines
-            if process_section and line.strip():
-                parts = line.split()
-                if len(parts) >= 3:  # Minimal: name, id, status
-                    process_name = parts[0]
-                    process_id = parts[1]
-                    processes[process_name] = process_id
-        
-        return processes
-
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Error running status command: {e}")
-        return {}
-    except Exception as e:
-        logging.error(f"Error parsing status output: {e}")
-        return {}
+            files = procfs.read_process_files(module_data['pid'])
+            if files is not None:
+                procs[module_data['pid']] = files
+    if journal is not None:
+        journal.record_proc(mem_total_kb, uptime, procs)
+
+    # One read of the TCP tables serves every module
+    tcp_states = procfs.read_tcp_states() if process_details else None
+
+    now = time.monotonic()
+    for name, data in instances_data.items():
+        instance = instances_by_name[name]
+        details = None
+        if tcp_states is not None:
+            pids = [module_data['pid'] for module_data in data['module'].values() if module_data['pid'] in procs]
+            details = instance.process_details.read(pids, tcp_states)
+        procfs.apply_process_stats(
+            data['module'], procs, mem_total_kb, uptime, instance.cpu_tracker, now, details
+        )
+        if pid_watcher is not None:
+            pid_watcher.sync(name, data['module'])
+        if startstop_enabled:
+            update_expected_modules(instances_by_name[name], data)
 
-def update_metrics() -> None:
-    data = get_earthworm_status()
+def update_expected_modules(instance: Instance, data: Dict[str, Any]) -> None:
+    path = instance.startstop_config
+    if path is None:
+        params_dir = data['system'].get('params_dir') or (instance.env or os.environ).get('EW_PARAMS')
+        if not params_dir:
+            return
+        path = os.path.join(params_dir, startstop.DEFAULT_CONFIG)
+    index = instance.startstop_index
+    if index is None or index.path != path:
+        index = instance.startstop_index = startstop.StartstopIndex(path)
+    # Parses again only when a config file changed
+    index.refresh()
+    # Nothing to compare against while the config cannot be read
+    data['expected'] = startstop.compare(index, data) if index.mtime is not None else None
+
+def read_disk_usage(paths: List[str]) -> Dict[str, Dict[str, int]]:
+    disk = {}
+    for path in paths:
+        try:
+            usage = shutil.disk_usage(path)
+        except OSError as e:
+            logging.error(f"Error reading disk usage of {path}: {e}")
+            continue
+        disk[path] = {'avail': usage.free, 'size': usage.total}
+    return disk
+
+@dataclass(frozen=True)
+class Snapshot:
+    # instance name -> data of its latest collection
+    data: Dict[str, Dict[str, Any]]
+    body: bytes
+    gzip_body: bytes
+    etag: str
+    # Rendered families, for filtered and OpenMetrics requests
+    index: SnapshotIndex
+    # time.monotonic() of the render
+    rendered_at: float
+
+# Latest snapshot, replaced as a whole whenever any source has new data
+snapshot: Optional[Snapshot] = None
+
+def render_snapshot(instances_data: Dict[str, Dict[str, Any]]) -> Snapshot:
+    if change_feed is not None:
+        change_feed.publish(instances_data)
+    earthworm_collector.data = instances_data
+    with phase_seconds.labels(phase='render').time():
+        index = SnapshotIndex.render(list(registry.collect()))
+        body = index.body
+    # Render, compress and hash once per snapshot rather than once per scrape
+    with phase_seconds.labels(phase='compress').time():
+        gzip_body = gzip.compress(body, mtime=0)
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+    return Snapshot(
+        data=instances_data,
+        body=body,
+        gzip_body=gzip_body,
+        etag=etag,
+        index=index,
+        rendered_at=time.monotonic()
+    )
+
+def copy_data(data: Dict[str, Any]) -> Dict[str, Any]:
+    # Published snapshots are never modified; sources update a copy
+    return dict(data, module={name: dict(module) for name, module in data['module'].items()})
+
+def publish_instance(name: str, data: Dict[str, Any]) -> Snapshot:
+    global snapshot
+    instances_data = dict(snapshot.data) if snapshot is not None else {}
+    instances_data[name] = data
+    snapshot = render_snapshot(instances_data)
+    return snapshot
+
+async def collect_instance(instance: Instance) -> Optional[Snapshot]:
+    # Returns the new snapshot, or None when collecting this instance failed
+    try:
+        data = await get_earthworm_status(instance)
+    except CircuitOpenError:
+        # status was not run, so nothing failed; the skipped run is counted
+        # in ew_exporter_subprocesses_total{result="circuit_open"}
+        return None
+    except Exception as e:
+        logging.error(f"Error collecting metrics: {e}")
+        data = None
     if data is None:
-        logging.error("Failed to get Earthworm status")
+        logging.error(f"Failed to get Earthworm status of instance '{instance.name}'")
+        collect_failures.labels(instance.name, 'status').inc()
+        return None
+    # Keep what the disk source found until its next run
+    previous = snapshot.data.get(instance.name) if snapshot is not None else None
+    data['disk'] = previous.get('disk', {}) if previous is not None else {}
+    return publish_instance(instance.name, data)
+
+def on_module_exit(instance: str, module_name: str) -> None:
+    # Publish the exit right away by re-rendering the current data with the
+    # module marked Dead; no status run is needed
+    current = snapshot
+    if current is None or module_name not in current.data.get(instance, {}).get('module', {}):
         return
+    data = current.data[instance]
+    modules = dict(data['module'])
+    modules[module_name] = dict(modules[module_name], status='Dead')
+    publish_instance(instance, dict(data, module=modules))
+
+pid_watcher = PidWatcher(
+    registry,
+    on_module_exit,
+    poll_interval=pidwatch_poll_interval
+) if pidwatch_enabled else None
+
+def start_refresh(instance: Instance) -> asyncio.Task:
+    # Single flight: callers arriving while a collection runs share it
+    # instead of starting their own
+    if instance.collection_task is None or instance.collection_task.done():
+        instance.collection_task = asyncio.create_task(collect_instance(instance))
+    return instance.collection_task
+
+async def refresh_instance(instance: Instance) -> Optional[Snapshot]:
+    return await asyncio.shield(start_refresh(instance))
 
+# (instance, module) -> PID last restarted or stopped through the exporter;
+# snapshots taken before that still show it
+controlled_pids: Dict[Tuple[str, str], int] = {}
+
+def cached_pid(instance: Instance, module_name: str, verify: bool = True) -> Optional[int]:
+    # PID of the module in the latest snapshot. With `verify`, None when a
+    # different process has it now (the module was restarted since) or it
+    # was already restarted or stopped by us, so the caller refreshes
+    # instead of signalling the wrong process.
+    current = snapshot
+    if current is None:
+        return None
+    module_data = current.data.get(instance.name, {}).get('module', {}).get(module_name)
+    if module_data is None or module_data.get('pid') is None:
+        return None
+    starttime = module_data.get('starttime')
+    if verify:
+        if controlled_pids.get((instance.name, module_name)) == module_data['pid']:
+            return None
+        if starttime is not None and procfs.read_starttime(module_data['pid']) != starttime:
+            return None
+    return module_data['pid']
+
+async def execute_control(action: str, item: ControlItem) -> None:
+    instance = instances_by_name[item.instance]
+    pid = cached_pid(instance, item.module)
+    if pid is None:
+        if await refresh_instance(instance) is None:
+            raise RuntimeError(f"Could not run status for instance '{instance.name}'")
+        pid = cached_pid(instance, item.module, verify=False)
+        if pid is None:
+            raise LookupError(f"Module '{item.module}' not found")
+    item.pid = pid
+    await run_command(instance, [COMMANDS[action], str(pid)], timeout=control_timeout)
+    controlled_pids[(instance.name, item.module)] = pid
+
+# Runs restart and stopmodule for /restart, /stop and /jobs
+control_queue = ControlQueue(
+    registry,
+    execute_control,
+    workers=control_workers,
+    max_jobs=control_max_jobs
+)
+
+def stale_instances() -> List[Instance]:
+    # max_age stretches with the status source's backoff, so scrapes do not
+    # force the runs the backoff is skipping
+    now = time.time()
+    current = snapshot.data if snapshot is not None else {}
+    return [
+        instance for instance in instances
+        if instance.name not in current
+        or now - current[instance.name]['system'].get('collected_at', 0)
+        > max_age * scheduler.backoff('status', instance.name)
+    ]
+
+def publish_stale() -> Snapshot:
+    # Re-render at most once per collection interval, however many scrapes
+    # find the data stale meanwhile
+    global snapshot
+    if time.monotonic() - snapshot.rendered_at >= (collect_interval or max_age):
+        snapshot = render_snapshot(snapshot.data)
+    return snapshot
+
+async def collect_status(instance: Instance) -> bool:
+    return await refresh_instance(instance) is not None
+
+async def collect_process_stats() -> bool:
+    # Re-read /proc for the modules of the latest status output
+    global snapshot
+    current = snapshot
+    if current is None:
+        return False
+    instances_data = {name: copy_data(data) for name, data in current.data.items()}
+    update_process_stats(instances_data)
+    snapshot = render_snapshot(instances_data)
+    return True
+
+async def collect_disk() -> bool:
+    global snapshot
+    current = snapshot
+    if current is None:
+        return False
+    instances_data = dict(current.data)
+    complete = True
+    for instance in instances:
+        data = instances_data.get(instance.name)
+        if data is None:
+            continue
+        # Default to the filesystem holding Startstop's log directory
+        log_dir = data['system'].get('log_dir')
+        paths = instance.disk_paths or ([log_dir] if log_dir else [])
+        disk = read_disk_usage(paths)
+        instances_data[instance.name] = dict(data, disk=disk)
+        if len(disk) != len(paths):
+            collect_failures.labels(instance.name, 'disk').inc()
+            complete = False
+    snapshot = render_snapshot(instances_data)
+    return complete
+
+async def follow_logs(instance: Instance) -> bool:
+    # Tail the module logs in the log directory of the latest status output
+    current = snapshot
+    data = current.data.get(instance.name) if current is not None else None
+    if data is None:
+        return False
+    log_dir = data['system'].get('log_dir') or (instance.env or os.environ).get('EW_LOG')
+    if not log_dir:
+        return False
+    tailer = log_tailers.get(instance.name)
     try:
-        disk_space.set(data["system"]["disk_space"])
-
-        for module_name, module_data in data["module"].items():
-            
-            if module_data.get("status") is not None:
-                status_value = {
-                    "Not Exec": 4,
-                    "Zombie": 3,
-                    "Dead": 2,
-                    "Stop": 1,
-                    "Alive": 0
-                }.get(module_data["status"])
-                module_status.labels(module=module_name).set(status_value)
-            else:
-                # 0 = Status Error
-                module_status.labels(module=module_name).set(5)
-
-            allocated_memory = 0
-            if module_data.get("rss") is not None and module_data.get("vsz") is not None:
-                allocated_memory = (module_data["rss"]/module_data["vsz"])*100
-            
-            pid.labels(module=module_name).set(module_data["pid"] if module_data.get("pid") else 0)
-            module_cpu_usage.labels(module=module_name).set(module_data["cpu_used"] if module_data.get("cpu_used") else 0)
-            module_memory_usage_allocated.labels(module=module_name).set(round(allocated_memory, 2))
-            module_memory_usage_total.labels(module=module_name).set(module_data["memory_used"] if module_data.get("memory_used") else 0)
-            module_vsz.labels(module=module_name).set(module_data["vsz"] if module_data.get("vsz") else 0)
-            module_rss.labels(module=module_name).set(module_data["rss"] if module_data.get("rss") else 0)
-    except Exception as e:
-        logging.error(f"Error updating metrics: {e}")
+        tailer.set_modules(data['module'])
+        tailer.set_log_dir(log_dir)
+        tailer.poll()
+    except Exception:
+        collect_failures.labels(instance.name, 'logs').inc()
+        raise
+    return True
+
+async def record_history() -> bool:
+    current = snapshot
+    if current is None:
+        return False
+    rings: Dict[str, Dict[str, Dict[str, float]]] = {}
+    if ring_monitor is not None:
+        levels = ring_monitor.levels()
+        for name, data in current.data.items():
+            for ring in data['rings'].values():
+                if str(ring['key']).isdigit() and int(ring['key']) in levels:
+                    rings.setdefault(name, {})[ring['name']] = levels[int(ring['key'])]
+    history.record(current.data, rings)
+    return True
+
+# Ring lists (one per instance) the monitor is attached to
+synced_rings: List[Dict[str, Any]] = []
+
+async def sample_rings() -> bool:
+    # Follow the ring lists of the latest status outputs
+    global synced_rings
+    current = snapshot
+    try:
+        if current is not None:
+            rings = [data['rings'] for data in current.data.values()]
+            if len(rings) != len(synced_rings) or any(a is not b for a, b in zip(rings, synced_rings)):
+                # Ring keys are unique per host, so the lists can be merged
+                ring_monitor.sync({
+                    f"{name}/{number}": ring
+                    for name, data in current.data.items()
+                    for number, ring in data['rings'].items()
+                })
+                synced_rings = rings
+        ring_monitor.sample()
+    except Exception:
+        collect_failures.labels('', 'rings').inc()
+        raise
+    return True
+
+# interval = 0 disables a source; with no status source scrapes collect on
+# demand. Each instance runs status on its own, so a hung one holds back
+# nobody else.
+for instance in instances:
+    scheduler.add('status', collect_interval, functools.partial(collect_status, instance), instance.name)
+    if log_tailers is not None:
+        scheduler.add('logs', logs_interval, functools.partial(follow_logs, instance), instance.name)
+scheduler.add('process', process_interval, collect_process_stats)
+scheduler.add('disk', disk_interval, collect_disk)
+if ring_monitor is not None:
+    scheduler.add('rings', rings_interval, sample_rings)
+if history is not None:
+    scheduler.add('history', history_interval, record_history)
+
+profiler = Profiler(interval=profile_interval, max_seconds=profile_max_seconds)
+# Thread running the event loop, i.e. all collection work
+loop_thread_id: Optional[int] = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global loop_thread_id
+    loop_thread_id = threading.get_ident()
+    scheduler.start()
+    control_queue.start()
+    yield
+    control_queue.stop()
+    scheduler.stop()
+    if pid_watcher is not None:
+        pid_watcher.close()
+    if ring_monitor is not None:
+        ring_monitor.close()
+    if journal is not None:
+        journal.close()
+    if log_tailers is not None:
+        log_tailers.close()
+    for instance in instances:
+        instance.process_details.close()
+
+# Create FastAPI app
+app = FastAPI(
+    title="Earthworm Exporter",
+    description="Prometheus exporter for Earthworm seismic processing system",
+    version="1.0.0",
+    lifespan=lifespan
+)
 
 @app.get("/")
 async def root():
@@ -282,77 +670,372 @@ async def root():
         "endpoints": {
             "metrics": "/metrics",
             "restart module": "/restart/pid",
-            "stop module": "/stop/pid"
+            "stop module": "/stop/pid",
+            "control jobs": "/jobs"
         }
     }
 
+def accepts_gzip(accept_encoding: str) -> bool:
+    for coding in accept_encoding.split(','):
+        name, _, params = coding.partition(';')
+        if name.strip().lower() not in ('gzip', '*'):
+            continue
+        params = params.strip()
+        try:
+            q = float(params[2:]) if params.startswith('q=') else 1.0
+        except ValueError:
+            q = 1.0
+        return q > 0
+    return False
+
+def accepts_openmetrics(accept: str) -> bool:
+    # OpenMetrics only when the client prefers it over the text format
+    openmetrics_q = text_q = 0.0
+    for media_range in accept.split(','):
+        media_type, *params = media_range.split(';')
+        media_type = media_type.strip().lower()
+        q = 1.0
+        for param in params:
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    pass
+        if media_type == 'application/openmetrics-text':
+            openmetrics_q = max(openmetrics_q, q)
+        elif media_type in ('text/plain', 'text/*', '*/*'):
+            text_q = max(text_q, q)
+    return openmetrics_q > 0 and openmetrics_q >= text_q
+
+def etag_matches(etag: str, if_none_match: str) -> bool:
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == etag or tag == '*':
+            return True
+    return False
+
 @app.get("/metrics")
-async def metrics():
-    update_metrics()
+async def metrics(request: Request):
+    stale = stale_instances()
+    if stale and (snapshot is None or not collect_interval):
+        # Nothing to serve yet, or collecting on scrape: wait for the data.
+        # Instances are refreshed concurrently; one failing does not keep
+        # the others from being served
+        refreshed = await asyncio.gather(*(refresh_instance(instance) for instance in stale))
+        if not all(refreshed) and snapshot is not None:
+            publish_stale()
+    elif stale:
+        # Refresh in the background and answer right away from the last
+        # data, re-rendered so that ew_exporter_snapshot_age_seconds shows
+        # how old it is; a hanging status never holds up the scrape
+        for instance in stale:
+            start_refresh(instance)
+        publish_stale()
+    current = snapshot
+    if current is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="No metrics collected yet"
+        )
+
+    use_gzip = accepts_gzip(request.headers.get('accept-encoding', ''))
+    use_openmetrics = accepts_openmetrics(request.headers.get('accept', ''))
+    modules = request.query_params.getlist('module')
+    names = request.query_params.getlist('name[]') + request.query_params.getlist('name')
+    variant = modules or names or use_openmetrics
+
+    etag = current.etag
+    if variant:
+        # Filtered bodies are as deterministic as the full one
+        variant_key = repr((modules, names, use_openmetrics)).encode()
+        etag = etag[:-1] + '-' + hashlib.sha1(variant_key).hexdigest()[:12] + '"'
+    if use_gzip:
+        etag = etag[:-1] + '-gzip"'
+    headers = {'ETag': etag, 'Vary': 'Accept, Accept-Encoding'}
+
+    if etag_matches(etag, request.headers.get('if-none-match', '')):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    media_type = OPENMETRICS_CONTENT_TYPE if use_openmetrics else CONTENT_TYPE_LATEST
+    if use_gzip:
+        headers['Content-Encoding'] = 'gzip'
+    if variant:
+        body = current.index.filtered(modules, names, use_openmetrics, compress=use_gzip)
+    else:
+        body = current.gzip_body if use_gzip else current.body
+    return Response(body, media_type=media_type, headers=headers)
+
+@app.get("/debug/profile", response_class=PlainTextResponse)
+async def debug_profile(seconds: float = 10.0):
+    if not profile_enabled:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Profiling is disabled ([debug] profile = false)"
+        )
+    if seconds <= 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="seconds must be positive"
+        )
+    # Sample from a helper thread while this loop keeps collecting and serving
+    try:
+        return await asyncio.to_thread(profiler.profile, loop_thread_id, seconds)
+    except ProfileBusyError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+
+@app.get("/history")
+async def get_history(
+    module: Optional[str] = None,
+    ring: Optional[str] = None,
+    metric: Optional[str] = None,
+    instance: Optional[str] = None,
+    since: float = -3600.0,
+    resolution: Optional[str] = None
+):
+    if history is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="History is disabled ([history] enabled = false)"
+        )
+    if resolution is not None and resolution not in dict(RESOLUTIONS):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"resolution must be one of {', '.join(dict(RESOLUTIONS))}"
+        )
+    if module is not None and ring is not None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Pass either module or ring"
+        )
+    kind = 'module' if module is not None else 'ring' if ring is not None else None
+    # Negative values are seconds before now
+    since = time.time() + since if since < 0 else since
+    series = history.query(instance, kind, module or ring, metric, since, resolution)
+    # Built by hand: the FastAPI encoder is slow on long point lists
     return Response(
-        generate_latest(registry),
-        media_type=CONTENT_TYPE_LATEST
+        json.dumps({'since': since, 'series': series}, separators=(',', ':')),
+        media_type='application/json'
     )
 
-@app.get("/restart/{module_name}")
-async def restart_module(module_name: str):
+def check_stream_available() -> None:
+    if change_feed is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="The change feed is disabled ([stream] enabled = false)"
+        )
+    if len(change_feed.subscribers) >= change_feed.max_subscribers:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Too many /stream clients ([stream] max_clients = {change_feed.max_subscribers})"
+        )
+
+@app.get("/stream")
+async def stream(request: Request):
+    check_stream_available()
+    last_event_id = request.headers.get('last-event-id', '')
+    last_seq = int(last_event_id) if last_event_id.isdigit() else None
+
+    async def events():
+        # Subscribed here so that the finally clause always unsubscribes
+        try:
+            subscriber, initial = change_feed.subscribe(last_seq)
+        except StreamFullError:
+            return
+        try:
+            for kind, seq, message in initial:
+                yield f"event: {kind}\nid: {seq}\ndata: {message}\n\n"
+            async for kind, seq, message in change_feed.events(subscriber, stream_keepalive):
+                if kind == 'keepalive':
+                    yield ": keepalive\n\n"
+                else:
+                    yield f"event: {kind}\nid: {seq}\ndata: {message}\n\n"
+        finally:
+            change_feed.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        events(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.websocket("/stream/ws")
+async def stream_websocket(websocket: WebSocket):
     try:
-        # Get process info
-        pid = get_process_info().get(module_name)
-        if pid is None:
+        check_stream_available()
+        subscriber, initial = change_feed.subscribe()
+    except (HTTPException, StreamFullError):
+        await websocket.close(code=1013)
+        return
+    try:
+        await websocket.accept()
+        for kind, _, message in initial:
+            await websocket.send_text(f'{{"event":"{kind}","data":{message}}}')
+        async for kind, _, message in change_feed.events(subscriber, stream_keepalive):
+            # The WebSocket protocol keeps idle connections alive itself
+            if kind != 'keepalive':
+                await websocket.send_text(f'{{"event":"{kind}","data":{message}}}')
+    except WebSocketDisconnect:
+        pass
+    finally:
+        change_feed.unsubscribe(subscriber)
+
+def find_instance(module_name: str, instance_name: Optional[str]) -> Instance:
+    if instance_name is not None:
+        instance = instances_by_name.get(instance_name)
+        if instance is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"Module '{module_name}' not found"
+                detail=f"Instance '{instance_name}' not found"
             )
+        return instance
+    if len(instances) == 1:
+        return instances[0]
 
-        # Try to restart
-        try:
-            subprocess.run(["restart", str(pid)], check=True)
-            return {
-                "success": True,
-                "message": f"Successfully restarted module '{module_name}' (PID: {pid})"
-            }
-        except subprocess.CalledProcessError as e:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Failed to restart module '{module_name}': {str(e)}"
-            )
+    # Several installations: go by which ones reported the module last time
+    current = snapshot.data if snapshot is not None else {}
+    matches = [
+        instance for instance in instances
+        if module_name in current.get(instance.name, {}).get('module', {})
+    ]
+    if len(matches) != 1:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Module '{module_name}' is in {len(matches)} instances, pass ?instance=<name>"
+        )
+    return matches[0]
+
+async def control_targets(
+    modules: List[str],
+    pattern: Optional[str],
+    instance_name: Optional[str]
+) -> List[Tuple[str, str]]:
+    # (instance, module) pairs named by `modules` or matching `pattern`, as
+    # reported by the latest snapshot. Instances not in it, or missing a
+    # named module, are refreshed once first.
+    if instance_name is not None and instance_name not in instances_by_name:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Instance '{instance_name}' not found"
+        )
+    wanted: Dict[str, List[str]] = {}
+    for module_name in modules:
+        wanted.setdefault(find_instance(module_name, instance_name).name, []).append(module_name)
+    searched = [instances_by_name[instance_name]] if instance_name is not None else instances
+
+    current = snapshot.data if snapshot is not None else {}
+    stale = [
+        instance for instance in instances
+        if (pattern is not None and instance in searched and instance.name not in current)
+        or any(name not in current.get(instance.name, {}).get('module', {}) for name in wanted.get(instance.name, ()))
+    ]
+    if stale:
+        await asyncio.gather(*(refresh_instance(instance) for instance in stale))
+        current = snapshot.data if snapshot is not None else {}
+
+    targets = []
+    for instance in instances:
+        reported = current.get(instance.name, {}).get('module', {})
+        for module_name in wanted.get(instance.name, ()):
+            if module_name not in reported:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f"Module '{module_name}' not found"
+                )
+            if (instance.name, module_name) not in targets:
+                targets.append((instance.name, module_name))
+        if pattern is not None and instance in searched:
+            for module_name in sorted(reported):
+                if fnmatch.fnmatchcase(module_name, pattern) and (instance.name, module_name) not in targets:
+                    targets.append((instance.name, module_name))
+    if not targets:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"No module matches '{pattern}'"
+        )
+    return targets
 
+async def control_module(action: str, done: str, module_name: str, instance: Optional[str]) -> Dict[str, Any]:
+    # One module, answered when the command has run
+    try:
+        target = find_instance(module_name, instance)
+        job = control_queue.submit(action, await control_targets([module_name], None, target.name))
+        await job.finished.wait()
+        item = job.items[0]
+        if item.exception is not None:
+            raise item.exception
+        return {
+            "success": True,
+            "message": f"Successfully {done} module '{module_name}' (PID: {item.pid})"
+        }
+
+    except HTTPException:
+        raise
+    except LookupError as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=str(e)
+        )
+    except CircuitOpenError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e)
+        )
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to {action} module '{module_name}': {str(e)}"
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Unexpected error: {str(e)}"
         )
 
+@app.get("/restart/{module_name}")
+async def restart_module(module_name: str, instance: Optional[str] = None):
+    return await control_module('restart', 'restarted', module_name, instance)
+
 @app.get("/stop/{module_name}")
-async def stop_module(module_name: str):
-    try:
-        # Get process info
-        pid = get_process_info().get(module_name)
-        if pid is None:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"Module '{module_name}' not found"
-            )
+async def stop_module(module_name: str, instance: Optional[str] = None):
+    return await control_module('stop', 'stopped', module_name, instance)
 
-        # Try to stop
-        try:
-            subprocess.run(["stopmodule", str(pid)], check=True)
-            return {
-                "success": True,
-                "message": f"Successfully stopped module '{module_name}' (PID: {pid})"
-            }
-        except subprocess.CalledProcessError as e:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Failed to stop module '{module_name}': {str(e)}"
-            )
+class JobRequest(BaseModel):
+    action: str
+    modules: List[str] = []
+    pattern: Optional[str] = None
+    instance: Optional[str] = None
 
-    except Exception as e:
+@app.post("/jobs", status_code=status.HTTP_202_ACCEPTED)
+async def submit_job(request: JobRequest):
+    if request.action not in COMMANDS:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Unexpected error: {str(e)}"
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"action must be one of {', '.join(COMMANDS)}"
+        )
+    if not request.modules and request.pattern is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Pass modules, a pattern or both"
+        )
+    targets = await control_targets(request.modules, request.pattern, request.instance)
+    return control_queue.submit(request.action, targets).to_dict()
+
+@app.get("/jobs")
+async def list_jobs():
+    return [job.to_dict() for job in reversed(control_queue.jobs.values())]
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = control_queue.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Job '{job_id}' not found"
         )
+    return job.to_dict()
 
 if __name__ == "__main__":
     host = config.get('server', 'host', fallback='localhost')
@@ -0,0 +1,160 @@
+"""Event-driven detection of Earthworm module exits."""
+import asyncio
+import logging
+import os
+import time
+from typing import Callable, Dict, Any, Optional, Tuple
+from prometheus_client import Counter, Histogram, CollectorRegistry
+
+import procfs
+from instances import qualified_name
+
+DURATION_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 900, 3600)
+
+class PidWatcher:
+    # Watches each module PID with a pidfd (readable once the process exits)
+    # registered on the event loop. Where pidfd_open is unavailable it falls
+    # back to polling /proc/<pid>/stat, comparing the process start time so a
+    # reused PID still counts as an exit.
+
+    def __init__(
+        self,
+        registry: CollectorRegistry,
+        on_exit: Callable[[str, str], None],
+        poll_interval: float = 0.2
+    ):
+        self.on_exit = on_exit
+        self.poll_interval = poll_interval
+        self.use_pidfd = hasattr(os, 'pidfd_open')
+        self.poll_task: Optional[asyncio.Task] = None
+        # Keyed by (instance, module)
+        # -> (pid, starttime, pidfd or None)
+        self.watched: Dict[Tuple[str, str], Tuple[int, int, Optional[int]]] = {}
+        # -> (pid, exit time) until the module is seen running again
+        self.exited: Dict[Tuple[str, str], Tuple[int, float]] = {}
+        # instance -> modules seen in its last status
+        self.known: Dict[str, set] = {}
+
+        self.exits = Counter(
+            "ew_module_exits",
+            "Earthworm Module process exits observed by the exporter",
+            ["ew_instance", "module"],
+            registry=registry
+        )
+        self.restart_latency = Histogram(
+            "ew_module_restart_latency_seconds",
+            "Earthworm Module time from process exit to the start of its replacement",
+            ["ew_instance", "module"],
+            buckets=DURATION_BUCKETS,
+            registry=registry
+        )
+        self.down_time = Histogram(
+            "ew_module_down_seconds",
+            "Earthworm Module time from process exit until status reports it Alive again",
+            ["ew_instance", "module"],
+            buckets=DURATION_BUCKETS,
+            registry=registry
+        )
+
+    def sync(self, instance: str, modules: Dict[str, Dict[str, Any]]) -> None:
+        # Called after each collection with the freshly parsed module data
+        now = time.time()
+        boot_time = procfs.read_boot_time()
+
+        for module_name in self.known.get(instance, set()) - modules.keys():
+            key = (instance, module_name)
+            self.unwatch(key)
+            self.exited.pop(key, None)
+            self.remove_series(key)
+        self.known[instance] = set(modules)
+
+        for module_name, module_data in modules.items():
+            key = (instance, module_name)
+            exited = self.exited.get(key)
+            module_pid = module_data.get('pid')
+
+            if exited is not None and module_pid == exited[0]:
+                # status ran before it noticed the exit; trust the event
+                module_data['status'] = 'Dead'
+                continue
+
+            if module_data.get('starttime') is None or module_data.get('status') != 'Alive':
+                continue
+
+            if exited is not None:
+                del self.exited[key]
+                started = boot_time + module_data['starttime'] / procfs.CLK_TCK
+                self.restart_latency.labels(instance, module_name).observe(max(started - exited[1], 0))
+                self.down_time.labels(instance, module_name).observe(max(now - exited[1], 0))
+
+            watched = self.watched.get(key)
+            if watched is None or watched[:2] != (module_pid, module_data['starttime']):
+                self.unwatch(key)
+                self.watch(key, module_pid, module_data['starttime'])
+                exited = self.exited.get(key)
+                if exited is not None and exited[0] == module_pid:
+                    # Gone already between the collection and the watch
+                    module_data['status'] = 'Dead'
+
+    def watch(self, key: Tuple[str, str], pid: int, starttime: int) -> None:
+        pidfd = None
+        if self.use_pidfd:
+            try:
+                pidfd = os.pidfd_open(pid)
+            except ProcessLookupError:
+                self.exited_event(key, pid)
+                return
+            except OSError as e:
+                logging.warning(f"pidfd_open unavailable ({e}), polling /proc for module exits")
+                self.use_pidfd = False
+        self.watched[key] = (pid, starttime, pidfd)
+
+        if procfs.read_starttime(pid) != starttime:
+            # Exited (and maybe reused) between the collection and now
+            self.exited_event(key, pid)
+            return
+
+        if pidfd is not None:
+            asyncio.get_running_loop().add_reader(pidfd, self.exited_event, key, pid)
+        elif self.poll_task is None:
+            self.poll_task = asyncio.create_task(self.poll_loop())
+
+    def unwatch(self, key: Tuple[str, str]) -> None:
+        watched = self.watched.pop(key, None)
+        if watched is not None and watched[2] is not None:
+            asyncio.get_running_loop().remove_reader(watched[2])
+            os.close(watched[2])
+
+    def exited_event(self, key: Tuple[str, str], pid: int) -> None:
+        watched = self.watched.get(key)
+        if watched is not None and watched[0] != pid:
+            return
+        self.unwatch(key)
+        self.exited[key] = (pid, time.time())
+        self.exits.labels(*key).inc()
+        name = qualified_name(*key)
+        logging.warning(f"Module '{name}' (PID: {pid}) exited")
+        try:
+            self.on_exit(*key)
+        except Exception as e:
+            logging.error(f"Error handling exit of module '{name}': {e}")
+
+    async def poll_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            for key, (pid, starttime, _) in list(self.watched.items()):
+                if procfs.read_starttime(pid) != starttime:
+                    self.exited_event(key, pid)
+
+    def remove_series(self, key: Tuple[str, str]) -> None:
+        for metric in (self.exits, self.restart_latency, self.down_time):
+            try:
+                metric.remove(*key)
+            except KeyError:
+                pass
+
+    def close(self) -> None:
+        for key in list(self.watched):
+            self.unwatch(key)
+        if self.poll_task is not None:
+            self.poll_task.cancel()
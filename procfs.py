@@ -0,0 +1,315 @@
+"""Per-process statistics read directly from /proc."""
+import os
+import logging
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+PROC_ROOT = '/proc'
+CLK_TCK = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE_KB = os.sysconf('SC_PAGE_SIZE') // 1024
+
+# TCP states from /proc/net/tcp (include/net/tcp_states.h); the rest are "other"
+TCP_STATES = {'01': 'established', '0A': 'listen'}
+
+# Fields of /proc/<pid>/status read besides Name
+STATUS_FIELDS = {
+    'Threads:': 'threads',
+    'voluntary_ctxt_switches:': 'voluntary_ctxt_switches',
+    'nonvoluntary_ctxt_switches:': 'nonvoluntary_ctxt_switches'
+}
+
+def read_file(path: str) -> Optional[str]:
+    try:
+        with open(path, 'r') as f:
+            return f.read()
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        return None
+
+def read_mem_total_kb(proc_root: str = PROC_ROOT) -> int:
+    meminfo = read_file(f'{proc_root}/meminfo') or ''
+    for line in meminfo.split("\n"):
+        if line.startswith('MemTotal:'):
+            return int(line.split()[1])
+    return 0
+
+def read_uptime(proc_root: str = PROC_ROOT) -> float:
+    uptime = read_file(f'{proc_root}/uptime')
+    return float(uptime.split()[0]) if uptime else 0.0
+
+def read_boot_time(proc_root: str = PROC_ROOT) -> float:
+    stat = read_file(f'{proc_root}/stat') or ''
+    for line in stat.split("\n"):
+        if line.startswith('btime '):
+            return float(line.split()[1])
+    return 0.0
+
+def read_starttime(pid: int, proc_root: str = PROC_ROOT) -> Optional[int]:
+    # Start time in clock ticks since boot; None once the process is gone
+    stat = read_file(f'{proc_root}/{pid}/stat')
+    if stat is None:
+        return None
+    try:
+        return int(stat[stat.rindex(')') + 2:].split()[19])
+    except (ValueError, IndexError):
+        return None
+
+def read_command_lines(proc_root: str = PROC_ROOT) -> Dict[int, List[str]]:
+    # argv of every process on the host (kernel threads have none)
+    commands = {}
+    for entry in os.listdir(proc_root):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'{proc_root}/{entry}/cmdline', 'rb') as f:
+                cmdline = f.read()
+        except OSError:
+            continue
+        if cmdline:
+            commands[int(entry)] = cmdline.rstrip(b'\0').decode(errors='replace').split('\0')
+    return commands
+
+def read_process_files(pid: int, proc_root: str = PROC_ROOT) -> Optional[Tuple[str, str, str]]:
+    # Raw stat, statm and status of a process, as recorded by the journal
+    stat = read_file(f'{proc_root}/{pid}/stat')
+    statm = read_file(f'{proc_root}/{pid}/statm')
+    status = read_file(f'{proc_root}/{pid}/status')
+    if stat is None or statm is None or status is None:
+        return None
+    return stat, statm, status
+
+def read_process_stats(
+    pid: int,
+    mem_total_kb: int,
+    uptime: float,
+    proc_root: str = PROC_ROOT
+) -> Optional[Dict[str, Any]]:
+    files = read_process_files(pid, proc_root)
+    if files is None:
+        return None
+    return parse_process_stats(pid, files, mem_total_kb, uptime)
+
+def parse_process_stats(
+    pid: int,
+    files: Tuple[str, str, str],
+    mem_total_kb: int,
+    uptime: float
+) -> Optional[Dict[str, Any]]:
+    stat, statm, status = files
+    try:
+        # The command name may contain spaces and parentheses, so split
+        # after the last ')'; fields[0] is then the state (field 3 in proc(5))
+        fields = stat[stat.rindex(')') + 2:].split()
+        utime = int(fields[11])
+        stime = int(fields[12])
+        starttime = int(fields[19])
+
+        statm_fields = statm.split()
+        vsz = int(statm_fields[0]) * PAGE_SIZE_KB
+        rss = int(statm_fields[1]) * PAGE_SIZE_KB
+
+        name = None
+        status_fields = {}
+        for line in status.split("\n"):
+            key, _, value = line.partition('\t')
+            if key == 'Name:':
+                name = value.strip()
+            elif key in STATUS_FIELDS:
+                status_fields[STATUS_FIELDS[key]] = int(value)
+    except (ValueError, IndexError) as e:
+        logging.error(f"Error parsing /proc stats for PID {pid}: {e}")
+        return None
+
+    # Same definitions as ps: %CPU is CPU time over process lifetime,
+    # %MEM is resident set over total memory. CpuRateTracker replaces the
+    # lifetime %CPU with the rate over the last interval when it can.
+    cpu_seconds = (utime + stime) / CLK_TCK
+    elapsed = uptime - starttime / CLK_TCK
+    cpu_used = (cpu_seconds / elapsed) * 100 if elapsed > 0 else 0.0
+    memory_used = (rss / mem_total_kb) * 100 if mem_total_kb else 0.0
+
+    return {
+        'pid': pid,
+        'cpu_used': round(cpu_used, 2),
+        'memory_used': round(memory_used, 2),
+        'vsz': vsz,
+        'rss': rss,
+        'stat': fields[0],
+        'command': name,
+        'cpu_user_seconds': utime / CLK_TCK,
+        'cpu_system_seconds': stime / CLK_TCK,
+        'starttime': starttime,
+        'threads': status_fields.get('threads'),
+        'voluntary_ctxt_switches': status_fields.get('voluntary_ctxt_switches'),
+        'nonvoluntary_ctxt_switches': status_fields.get('nonvoluntary_ctxt_switches')
+    }
+
+def apply_process_stats(
+    modules: Dict[str, Dict[str, Any]],
+    procs: Dict[int, Tuple[str, str, str]],
+    mem_total_kb: int,
+    uptime: float,
+    tracker: 'CpuRateTracker',
+    now: float,
+    details: Optional[Dict[int, Dict[str, Any]]] = None
+) -> None:
+    # Merge the stats of each module's process into its status data, with
+    # the I/O, fd and socket details when they were read
+    live_pids = []
+    for module_data in modules.values():
+        pid = module_data.get('pid')
+        files = procs.get(pid)
+        if files is None:
+            continue
+        stats = parse_process_stats(pid, files, mem_total_kb, uptime)
+        if stats is not None:
+            cpu_rate = tracker.update(stats, now)
+            if cpu_rate is not None:
+                stats['cpu_used'] = round(cpu_rate, 2)
+            if details is not None and pid in details:
+                stats.update(details[pid])
+            module_data.update(stats)
+            live_pids.append(pid)
+    tracker.prune(live_pids)
+
+def read_tcp_states(proc_root: str = PROC_ROOT) -> Dict[int, str]:
+    # Socket inode -> state of every TCP socket in the exporter's namespace
+    states = {}
+    for table in ('tcp', 'tcp6'):
+        content = read_file(f'{proc_root}/net/{table}')
+        if content is None:
+            continue
+        for line in content.split("\n")[1:]:
+            fields = line.split()
+            if len(fields) > 9:
+                states[int(fields[9])] = TCP_STATES.get(fields[3], 'other')
+    return states
+
+class ProcessDetailReader:
+    # I/O counters, open file descriptors and TCP sockets of module
+    # processes. A /proc/<pid> directory handle is kept open per PID and
+    # every file is opened relative to it. The handle stays bound to the
+    # process it was opened for: once that process exits reads through it
+    # fail, and the handle is reopened, so a reused PID is never confused
+    # with the old process.
+
+    def __init__(self, proc_root: str = PROC_ROOT):
+        self.proc_root = proc_root
+        self.dirs: Dict[int, int] = {}
+
+    def read(self, pids: Iterable[int], tcp_states: Dict[int, str]) -> Dict[int, Dict[str, Any]]:
+        details = {}
+        for pid in pids:
+            process = self.read_process(pid, tcp_states)
+            if process is not None:
+                details[pid] = process
+        self.prune(details)
+        return details
+
+    def read_process(self, pid: int, tcp_states: Dict[int, str]) -> Optional[Dict[str, Any]]:
+        dir_fd = self.dirs.get(pid)
+        if dir_fd is not None:
+            try:
+                return read_process_details(dir_fd, tcp_states)
+            except (FileNotFoundError, ProcessLookupError):
+                # Handle of an exited process; its PID may have been reused
+                os.close(self.dirs.pop(pid))
+        try:
+            dir_fd = os.open(f'{self.proc_root}/{pid}', os.O_RDONLY | os.O_DIRECTORY)
+        except OSError:
+            return None
+        self.dirs[pid] = dir_fd
+        try:
+            return read_process_details(dir_fd, tcp_states)
+        except (FileNotFoundError, ProcessLookupError):
+            return None
+
+    def prune(self, live_pids: Iterable[int]) -> None:
+        live = set(live_pids)
+        for pid in list(self.dirs):
+            if pid not in live:
+                os.close(self.dirs.pop(pid))
+
+    def close(self) -> None:
+        self.prune(())
+
+def read_process_details(dir_fd: int, tcp_states: Dict[int, str]) -> Dict[str, Any]:
+    # Fields the exporter may not read (processes of other users without
+    # CAP_SYS_PTRACE / CAP_DAC_READ_SEARCH) stay None
+    details: Dict[str, Any] = {
+        'io_read_bytes': None,
+        'io_write_bytes': None,
+        'io_read_chars': None,
+        'io_write_chars': None,
+        'fds': None,
+        'tcp_sockets': None
+    }
+    try:
+        fd = os.open('io', os.O_RDONLY, dir_fd=dir_fd)
+        try:
+            io = os.read(fd, 4096).decode()
+        finally:
+            os.close(fd)
+        for line in io.split("\n"):
+            key, _, value = line.partition(': ')
+            if key in ('read_bytes', 'write_bytes'):
+                details[f'io_{key}'] = int(value)
+            elif key in ('rchar', 'wchar'):
+                details['io_read_chars' if key == 'rchar' else 'io_write_chars'] = int(value)
+    except PermissionError:
+        pass
+
+    try:
+        fd_dir = os.open('fd', os.O_RDONLY | os.O_DIRECTORY, dir_fd=dir_fd)
+    except PermissionError:
+        return details
+    try:
+        names = os.listdir(fd_dir)
+        sockets = {'established': 0, 'listen': 0, 'other': 0}
+        for name in names:
+            try:
+                target = os.readlink(name, dir_fd=fd_dir)
+            except FileNotFoundError:
+                # Closed while listing
+                continue
+            if target.startswith('socket:['):
+                state = tcp_states.get(int(target[8:-1]))
+                if state is not None:
+                    sockets[state] += 1
+        details['fds'] = len(names)
+        details['tcp_sockets'] = sockets
+    except PermissionError:
+        pass
+    finally:
+        os.close(fd_dir)
+    return details
+
+class CpuRateTracker:
+    # Keeps the previous (starttime, utime + stime, timestamp, rate) sample
+    # per PID. The process start time tells a reused PID apart from the
+    # process that was sampled before, so a restart never yields a bogus
+    # delta. Samples less than `min_interval` after the kept one (sources
+    # landing close together, scrape-driven refreshes) return the last rate
+    # instead of one computed from a tick or two.
+
+    def __init__(self, min_interval: float = 0.0):
+        self.min_interval = min_interval
+        self.samples: Dict[int, Tuple[int, int, float, Optional[float]]] = {}
+
+    def update(self, stats: Dict[str, Any], now: float) -> Optional[float]:
+        pid = stats['pid']
+        ticks = round((stats['cpu_user_seconds'] + stats['cpu_system_seconds']) * CLK_TCK)
+        previous = self.samples.get(pid)
+
+        if previous is None or previous[0] != stats['starttime'] or now <= previous[2]:
+            self.samples[pid] = (stats['starttime'], ticks, now, None)
+            return None
+        if now - previous[2] < self.min_interval:
+            return previous[3]
+        rate = (ticks - previous[1]) / CLK_TCK / (now - previous[2]) * 100
+        self.samples[pid] = (stats['starttime'], ticks, now, rate)
+        return rate
+
+    def prune(self, live_pids: Iterable[int]) -> None:
+        live = set(live_pids)
+        for pid in list(self.samples):
+            if pid not in live:
+                del self.samples[pid]
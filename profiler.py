@@ -0,0 +1,70 @@
+"""Sampling CPU profiler for the exporter's event loop thread."""
+import collections
+import os
+import sys
+import threading
+import time
+from typing import Counter, Tuple
+
+# Innermost frame of an event loop waiting for I/O. Sampling wall-clock
+# stacks, an idle loop would fill the profile with it.
+IDLE_FRAME = 'selectors.py:select'
+
+class ProfileBusyError(Exception):
+    pass
+
+def frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+def sample_stacks(thread_id: int, seconds: float, interval: float) -> Tuple[Counter[str], int]:
+    # Runs in a helper thread, so the profiled thread keeps serving while
+    # its stack is sampled every `interval` seconds. Samples taken while
+    # the loop waits in the selector are only counted, not kept.
+    stacks: Counter[str] = collections.Counter()
+    idle = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        if frame is None:
+            break
+        if frame_name(frame) == IDLE_FRAME:
+            idle += 1
+            time.sleep(interval)
+            continue
+        names = []
+        while frame is not None:
+            names.append(frame_name(frame))
+            frame = frame.f_back
+        stacks[';'.join(reversed(names))] += 1
+        time.sleep(interval)
+    return stacks, idle
+
+def format_folded(stacks: Counter[str], idle: int, seconds: float, interval: float) -> str:
+    # Collapsed stack format, readable as is and accepted by flamegraph tools
+    busy = sum(stacks.values())
+    lines = [
+        f"# {busy} busy samples over {seconds:g}s every {interval * 1000:g}ms; "
+        f"{idle} samples idle in {IDLE_FRAME} skipped ({busy / max(busy + idle, 1):.1%} busy)"
+    ]
+    lines.extend(f"{stack} {count}" for stack, count in stacks.most_common())
+    return '\n'.join(lines) + '\n'
+
+class Profiler:
+    # Allows one profile at a time so concurrent requests cannot stack up
+    # sampling threads
+
+    def __init__(self, interval: float = 0.005, max_seconds: float = 60.0):
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.lock = threading.Lock()
+
+    def profile(self, thread_id: int, seconds: float) -> str:
+        if not self.lock.acquire(blocking=False):
+            raise ProfileBusyError("A profile is already running")
+        try:
+            seconds = min(seconds, self.max_seconds)
+            stacks, idle = sample_stacks(thread_id, seconds, self.interval)
+            return format_folded(stacks, idle, seconds, self.interval)
+        finally:
+            self.lock.release()
@@ -0,0 +1,500 @@
+"""Read-only access to Earthworm transport rings in SysV shared memory."""
+import bisect
+import ctypes
+import ctypes.util
+import heapq
+import logging
+import os
+import struct
+import time
+from typing import Dict, Any, Iterable, List, Optional
+from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily, HistogramMetricFamily
+
+IPC_PRIVATE = 0
+IPC_CREAT = 0o1000
+IPC_RMID = 0
+SHM_RDONLY = 0o10000
+
+libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+libc.shmget.argtypes = [ctypes.c_int, ctypes.c_size_t, ctypes.c_int]
+libc.shmget.restype = ctypes.c_int
+libc.shmat.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int]
+libc.shmat.restype = ctypes.c_void_p
+libc.shmdt.argtypes = [ctypes.c_void_p]
+libc.shmdt.restype = ctypes.c_int
+libc.shmctl.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_void_p]
+libc.shmctl.restype = ctypes.c_int
+
+class ShmHead(ctypes.Structure):
+    # SHM_HEAD from Earthworm transport.h. keyin/keyold are byte offsets that
+    # only grow (until transport renormalizes them near overflow); the
+    # position in the data area is key % keymax.
+    _fields_ = [
+        ('nbytes', ctypes.c_long),
+        ('keymax', ctypes.c_long),
+        ('keyin', ctypes.c_long),
+        ('keyold', ctypes.c_long),
+        ('flag', ctypes.c_long)
+    ]
+
+# TPORT_HEAD and MSG_LOGO from Earthworm transport.h. Every message in a ring
+# is a TPORT_HEAD followed by `size` payload bytes.
+FIRST_BYTE = 212
+
+class MsgLogo(ctypes.Structure):
+    _fields_ = [('type', ctypes.c_ubyte), ('mod', ctypes.c_ubyte), ('instid', ctypes.c_ubyte)]
+
+class TportHead(ctypes.Structure):
+    _fields_ = [
+        ('start', ctypes.c_ubyte),
+        ('size', ctypes.c_long),
+        ('logo', MsgLogo),
+        ('seq', ctypes.c_ubyte)
+    ]
+
+TPORT_HEAD_SIZE = ctypes.sizeof(TportHead)
+# Same fields with native alignment, for decoding straight from the ring
+TPORT_HEAD = struct.Struct('@BlBBBB')
+
+# Standard message types from earthworm_global.d
+MESSAGE_TYPES = {
+    2: 'TYPE_ERROR',
+    3: 'TYPE_HEARTBEAT',
+    8: 'TYPE_PICK_SCNL',
+    9: 'TYPE_CODA_SCNL',
+    14: 'TYPE_HYP2000ARC',
+    19: 'TYPE_TRACEBUF2',
+    20: 'TYPE_TRACEBUF',
+    35: 'TYPE_MSEED'
+}
+
+TYPE_TRACEBUF2 = 19
+
+# TRACE2_HEADER from Earthworm trace_buf.h (64 bytes): pinno, nsamp,
+# starttime, endtime, samprate, then sta[7] net[9] chan[4] loc[3]
+# version[2] datatype[3] quality[2] pad[2]. The byte order of the numeric
+# fields follows datatype[0]: 's'/'t' big-endian, 'i'/'f' little-endian.
+TRACE2_HEADER_SIZE = 64
+TRACE2_ENDTIME_OFFSET = 16
+TRACE2_DATATYPE_OFFSET = 57
+TRACE2_BIG_ENDIAN = (ord('s'), ord('t'))
+DOUBLE_BE = struct.Struct('>d')
+DOUBLE_LE = struct.Struct('<d')
+
+def shm_error(call: str, key: int) -> OSError:
+    errno = ctypes.get_errno()
+    return OSError(errno, f"{call} failed for ring key {key}: {os.strerror(errno)}")
+
+class RingSegment:
+    # Attaches SHM_RDONLY to a ring and reads it in place, never copying the
+    # message payloads
+
+    def __init__(self, key: int):
+        self.key = key
+        shmid = libc.shmget(key, 0, 0)
+        if shmid == -1:
+            raise shm_error('shmget', key)
+        # A ring removed and created again (Earthworm restarted) keeps its
+        # key but gets a new id; our attachment keeps the old one alive
+        self.shmid = shmid
+        addr = libc.shmat(shmid, None, SHM_RDONLY)
+        if addr is None or addr == ctypes.c_void_p(-1).value:
+            raise shm_error('shmat', key)
+        self.addr = addr
+        self.keymax = ShmHead.from_address(addr).keymax
+        self.data = memoryview(
+            (ctypes.c_ubyte * self.keymax).from_address(addr + ctypes.sizeof(ShmHead))
+        ).cast('B')
+
+    def view(self, key: int, size: int):
+        # Bytes at ring key `key`; only a message that straddles the end of
+        # the data area needs its two halves joined
+        pos = key % self.keymax
+        end = pos + size
+        if end <= self.keymax:
+            return self.data[pos:end]
+        return bytes(self.data[pos:]) + bytes(self.data[:end - self.keymax])
+
+    def replaced(self) -> bool:
+        return libc.shmget(self.key, 0, 0) != self.shmid
+
+    def read_head(self) -> ShmHead:
+        # Copy the five header words at once so they are consistent with
+        # each other even while a module is writing
+        return ShmHead.from_buffer_copy(
+            (ctypes.c_char * ctypes.sizeof(ShmHead)).from_address(self.addr)
+        )
+
+    def close(self) -> None:
+        if self.addr is not None:
+            self.data.release()
+            libc.shmdt(self.addr)
+            self.addr = None
+
+class RingState:
+    __slots__ = ('name', 'keymax', 'keyin', 'keyold', 'flag', 'sampled_at',
+                 'written_bytes', 'wraps', 'write_rate')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.keymax = 0
+        self.keyin = None
+        self.keyold = 0
+        self.flag = 0
+        self.sampled_at = 0.0
+        self.written_bytes = 0
+        self.wraps = 0
+        self.write_rate = 0.0
+
+class StationLatency:
+    __slots__ = ('last_endtime', 'packets')
+
+    def __init__(self, endtime: float):
+        self.last_endtime = endtime
+        self.packets = 0
+
+def format_scnl(raw: bytes) -> str:
+    sta, net, chan, loc = (
+        raw[start:end].split(b'\0', 1)[0].decode('ascii', 'replace')
+        for start, end in ((0, 7), (7, 16), (16, 20), (20, 23))
+    )
+    return f"{sta}.{chan}.{net}.{loc}"
+
+class WaveLatency:
+    # Data latency (arrival time - packet endtime) of TRACEBUF2 packets on one
+    # ring, aggregated into a fixed-bucket histogram. Each station keeps only
+    # a small fixed record, used to report the K stations furthest behind.
+
+    def __init__(self, buckets: Iterable[float], max_stations: int = 10000):
+        self.buckets: List[float] = sorted(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.max_stations = max_stations
+        self.stations: Dict[bytes, StationLatency] = {}
+
+    def observe(self, header, now: float) -> None:
+        double = DOUBLE_BE if header[TRACE2_DATATYPE_OFFSET] in TRACE2_BIG_ENDIAN else DOUBLE_LE
+        endtime = double.unpack_from(header, TRACE2_ENDTIME_OFFSET)[0]
+        latency = now - endtime
+        self.counts[bisect.bisect_left(self.buckets, latency)] += 1
+        self.sum += latency
+
+        scnl = bytes(header[32:55])
+        station = self.stations.get(scnl)
+        if station is None:
+            if len(self.stations) >= self.max_stations:
+                return
+            station = self.stations[scnl] = StationLatency(endtime)
+        elif endtime > station.last_endtime:
+            station.last_endtime = endtime
+        station.packets += 1
+
+    def expire(self, now: float, ttl: float) -> None:
+        for scnl in [scnl for scnl, station in self.stations.items() if now - station.last_endtime > ttl]:
+            del self.stations[scnl]
+
+    def worst(self, k: int, now: float):
+        # Stations whose newest data is oldest, including ones that stopped
+        return [
+            (format_scnl(scnl), now - station.last_endtime)
+            for scnl, station in heapq.nsmallest(
+                k, self.stations.items(), key=lambda item: item[1].last_endtime
+            )
+        ]
+
+class RingTailer:
+    # Follows the write position of one ring and counts messages and payload
+    # bytes per logo. Only TPORT headers are decoded; payloads are skipped.
+
+    def __init__(self, segment: RingSegment, latency: Optional[WaveLatency] = None):
+        self.segment = segment
+        self.read_key = segment.read_head().keyin
+        # (type << 16 | module << 8 | installation) -> [messages, bytes]
+        self.counters: Dict[int, list] = {}
+        self.lapped = 0
+        self.latency = latency
+
+    def poll(self, max_bytes: int = 64 * 1024 * 1024) -> None:
+        segment = self.segment
+        head = segment.read_head()
+        keyin = head.keyin
+        if keyin < self.read_key or head.keyold > self.read_key:
+            # Keys were renormalized or the writer overwrote what we had not
+            # read yet; resume from the current write position
+            self.lapped += 1
+            self.read_key = keyin
+            return
+
+        counters = self.counters
+        latency = self.latency
+        now = time.time()
+        key = self.read_key
+        stop = min(keyin, key + max_bytes)
+        unpack = TPORT_HEAD.unpack_from
+        while key + TPORT_HEAD_SIZE <= stop:
+            start, size, msg_type, mod, instid, _ = unpack(segment.view(key, TPORT_HEAD_SIZE))
+            if start != FIRST_BYTE or size < 0:
+                # Lost message framing; resynchronize at the write position
+                self.lapped += 1
+                key = keyin
+                break
+            logo = msg_type << 16 | mod << 8 | instid
+            counter = counters.get(logo)
+            if counter is None:
+                counters[logo] = [1, size]
+            else:
+                counter[0] += 1
+                counter[1] += size
+            if msg_type == TYPE_TRACEBUF2 and latency is not None and size >= TRACE2_HEADER_SIZE:
+                latency.observe(segment.view(key + TPORT_HEAD_SIZE, TRACE2_HEADER_SIZE), now)
+            key += TPORT_HEAD_SIZE + size
+
+        # Headers read in this pass are only trustworthy if the writer did
+        # not lap us meanwhile
+        if segment.read_head().keyold > self.read_key:
+            self.lapped += 1
+            key = segment.read_head().keyin
+        self.read_key = key
+
+class RingMonitor:
+    # Samples ring headers at a sub-second interval and keeps the derived
+    # fill level, write rate and wrap counters for the next render
+
+    def __init__(
+        self,
+        tail: bool = False,
+        latency_buckets: Optional[List[float]] = None,
+        latency_rings: Optional[List[str]] = None,
+        latency_top_k: int = 0,
+        latency_ttl: float = 3600.0
+    ):
+        self.segments: Dict[int, RingSegment] = {}
+        self.states: Dict[int, RingState] = {}
+        # Latency tracking reads TRACEBUF2 headers, so it needs the tailer
+        self.tail = tail or latency_buckets is not None
+        self.tailers: Dict[int, RingTailer] = {}
+        self.latency_buckets = latency_buckets
+        self.latency_rings = latency_rings
+        self.latency_top_k = latency_top_k
+        self.latency_ttl = latency_ttl
+        # Keys that could not be attached, so the error is logged once
+        self.unavailable = set()
+
+    def sync(self, rings: Dict[str, Dict[str, Any]]) -> None:
+        # Attach to rings newly reported by status, detach from departed ones
+        wanted = {}
+        for ring in rings.values():
+            if str(ring['key']).isdigit():
+                wanted[int(ring['key'])] = ring['name']
+
+        for key in list(self.segments):
+            if key not in wanted:
+                self.tailers.pop(key, None)
+                self.segments.pop(key).close()
+                self.states.pop(key, None)
+
+        for key, name in wanted.items():
+            previous = None
+            if key in self.segments:
+                if not self.segments[key].replaced():
+                    self.states[key].name = name
+                    continue
+                logging.info(f"Ring {name} ({key}) was recreated, attaching to the new segment")
+                self.segments.pop(key).close()
+                previous = (self.states.pop(key), self.tailers.pop(key, None))
+            try:
+                self.segments[key] = RingSegment(key)
+                state = self.states[key] = RingState(name)
+                tailer = None
+                if self.tail:
+                    latency = None
+                    if self.latency_buckets is not None and (not self.latency_rings or name in self.latency_rings):
+                        latency = WaveLatency(self.latency_buckets)
+                    tailer = self.tailers[key] = RingTailer(self.segments[key], latency)
+                if previous is not None:
+                    # Counters carry on from the old segment. A new ring
+                    # starts at key 0, so what was written to it before
+                    # this sync is counted too.
+                    old_state, old_tailer = previous
+                    state.written_bytes = old_state.written_bytes
+                    state.wraps = old_state.wraps
+                    state.keymax = self.segments[key].keymax
+                    state.keyin = 0
+                    state.sampled_at = old_state.sampled_at
+                    if tailer is not None and old_tailer is not None:
+                        tailer.read_key = 0
+                        tailer.counters = old_tailer.counters
+                        tailer.lapped = old_tailer.lapped
+                        tailer.latency = old_tailer.latency
+                self.unavailable.discard(key)
+            except OSError as e:
+                if key not in self.unavailable:
+                    logging.error(f"Cannot attach to ring {name} ({key}): {e}")
+                    self.unavailable.add(key)
+
+    def sample(self, now: Optional[float] = None) -> None:
+        now = time.monotonic() if now is None else now
+        for key, segment in self.segments.items():
+            head = segment.read_head()
+            state = self.states[key]
+
+            if state.keyin is not None and head.keyin >= state.keyin and head.keymax == state.keymax:
+                delta = head.keyin - state.keyin
+                state.written_bytes += delta
+                state.wraps += head.keyin // head.keymax - state.keyin // state.keymax
+                elapsed = now - state.sampled_at
+                if elapsed > 0:
+                    state.write_rate = delta / elapsed
+            # A smaller keyin means transport renormalized the keys; start
+            # counting again from the new position (a recreated ring is
+            # reattached by sync())
+
+            state.keymax = head.keymax
+            state.keyin = head.keyin
+            state.keyold = head.keyold
+            state.flag = head.flag
+            state.sampled_at = now
+
+        for tailer in self.tailers.values():
+            tailer.poll()
+
+    def levels(self) -> Dict[int, Dict[str, float]]:
+        # Ring key -> current fill ratio and write rate. Keyed like the ring
+        # metrics: installations on one host reuse names like WAVE_RING.
+        return {
+            key: {
+                'fill_ratio': (state.keyin - state.keyold) / state.keymax,
+                'write_rate': state.write_rate
+            }
+            for key, state in self.states.items()
+            if state.keyin is not None and state.keymax
+        }
+
+    def close(self) -> None:
+        self.tailers.clear()
+        for segment in self.segments.values():
+            segment.close()
+        self.segments.clear()
+        self.states.clear()
+
+    def collect(self):
+        labels = ["ring", "key"]
+        fill = GaugeMetricFamily(
+            "ew_ring_fill_ratio",
+            "Earthworm Ring fraction of the data area occupied by retained messages (0-1)",
+            labels=labels
+        )
+        rate = GaugeMetricFamily(
+            "ew_ring_write_rate_bytes",
+            "Earthworm Ring bytes written per second over the last sample interval",
+            labels=labels
+        )
+        written = CounterMetricFamily(
+            "ew_ring_written_bytes",
+            "Earthworm Ring bytes written since the exporter attached",
+            labels=labels
+        )
+        wraps = CounterMetricFamily(
+            "ew_ring_wraps",
+            "Earthworm Ring times the write position wrapped around the data area",
+            labels=labels
+        )
+        flag = GaugeMetricFamily(
+            "ew_ring_flag",
+            "Earthworm Ring header flag (non-zero when termination was requested)",
+            labels=labels
+        )
+        for key, state in list(self.states.items()):
+            if state.keyin is None or not state.keymax:
+                continue
+            label_values = [state.name, str(key)]
+            fill.add_metric(label_values, round((state.keyin - state.keyold) / state.keymax, 4))
+            rate.add_metric(label_values, round(state.write_rate, 1))
+            written.add_metric(label_values, state.written_bytes)
+            wraps.add_metric(label_values, state.wraps)
+            flag.add_metric(label_values, state.flag)
+        yield fill
+        yield rate
+        yield written
+        yield wraps
+        yield flag
+
+        if self.tail:
+            yield from self.collect_logos()
+        if self.latency_buckets is not None:
+            yield from self.collect_latency()
+
+    def collect_logos(self):
+        labels = ["ring", "type", "module", "installation"]
+        messages = CounterMetricFamily(
+            "ew_ring_messages",
+            "Earthworm Ring messages seen per logo since the exporter attached",
+            labels=labels
+        )
+        message_bytes = CounterMetricFamily(
+            "ew_ring_message_bytes",
+            "Earthworm Ring payload bytes seen per logo since the exporter attached",
+            labels=labels
+        )
+        lapped = CounterMetricFamily(
+            "ew_ring_tail_lapped",
+            "Earthworm Ring times the writer overtook the exporter's ring reader",
+            labels=["ring"]
+        )
+        for key, tailer in list(self.tailers.items()):
+            ring = self.states[key].name
+            for logo, (count, size) in list(tailer.counters.items()):
+                msg_type = logo >> 16
+                label_values = [
+                    ring,
+                    MESSAGE_TYPES.get(msg_type, str(msg_type)),
+                    str(logo >> 8 & 0xff),
+                    str(logo & 0xff)
+                ]
+                messages.add_metric(label_values, count)
+                message_bytes.add_metric(label_values, size)
+            lapped.add_metric([ring], tailer.lapped)
+        yield messages
+        yield message_bytes
+        yield lapped
+
+    def collect_latency(self):
+        now = time.time()
+        histogram = HistogramMetricFamily(
+            "ew_waveform_latency_seconds",
+            "Earthworm TRACEBUF2 data latency (arrival time - packet endtime) in seconds",
+            labels=["ring"]
+        )
+        stations = GaugeMetricFamily(
+            "ew_waveform_latency_stations",
+            "Earthworm SCNLs with TRACEBUF2 data seen within the retention window",
+            labels=["ring"]
+        )
+        worst = GaugeMetricFamily(
+            "ew_waveform_latency_worst_seconds",
+            "Earthworm Seconds since the newest sample of the stations furthest behind",
+            labels=["ring", "scnl"]
+        )
+        for key, tailer in list(self.tailers.items()):
+            latency = tailer.latency
+            if latency is None:
+                continue
+            ring = self.states[key].name
+            latency.expire(now, self.latency_ttl)
+
+            cumulative = 0
+            buckets = []
+            for le, count in zip(latency.buckets, latency.counts):
+                cumulative += count
+                buckets.append((str(le), cumulative))
+            buckets.append(("+Inf", cumulative + latency.counts[-1]))
+            histogram.add_metric([ring], buckets, latency.sum)
+            stations.add_metric([ring], len(latency.stations))
+
+            if self.latency_top_k > 0:
+                for scnl, seconds in latency.worst(self.latency_top_k, now):
+                    worst.add_metric([ring, scnl], round(seconds, 3))
+        yield histogram
+        yield stations
+        if self.latency_top_k > 0:
+            yield worst
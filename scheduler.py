@@ -0,0 +1,111 @@
+"""Independent collection loops per data source, with jitter and backoff."""
+import asyncio
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from prometheus_client.core import GaugeMetricFamily
+
+class Source:
+    __slots__ = ('name', 'instance', 'interval', 'run', 'backoff', 'last_duration',
+                 'last_success', 'task')
+
+    def __init__(self, name: str, instance: str, interval: float, run: Callable[[], Awaitable[bool]]):
+        self.name = name
+        self.instance = instance
+        self.interval = interval
+        self.run = run
+        # Multiplier applied to the interval while runs are slow
+        self.backoff = 1.0
+        self.last_duration: Optional[float] = None
+        self.last_success: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+
+def instance_suffix(source: Source) -> str:
+    return f" of instance '{source.instance}'" if source.instance else ''
+
+class Scheduler:
+    # Runs each source on its own interval. Start times are jittered so
+    # sources do not line up, and a source whose run takes more than
+    # `backoff_share` of its interval has its interval doubled (up to
+    # `max_backoff` times), then halved back as runs get fast again.
+
+    def __init__(self, jitter: float = 0.1, backoff_share: float = 0.5, max_backoff: float = 8.0):
+        self.jitter = jitter
+        self.backoff_share = backoff_share
+        self.max_backoff = max_backoff
+        # (source, instance) -> Source; host-wide sources have instance ""
+        self.sources: Dict[Tuple[str, str], Source] = {}
+
+    def add(self, name: str, interval: float, run: Callable[[], Awaitable[bool]], instance: str = '') -> None:
+        if interval > 0:
+            self.sources[(name, instance)] = Source(name, instance, interval, run)
+
+    def backoff(self, name: str, instance: str = '') -> float:
+        # Current backoff multiplier of a source; 1 for unknown ones
+        source = self.sources.get((name, instance))
+        return source.backoff if source is not None else 1.0
+
+    def start(self) -> None:
+        for source in self.sources.values():
+            source.task = asyncio.create_task(self.loop(source))
+
+    def stop(self) -> None:
+        for source in self.sources.values():
+            if source.task is not None:
+                source.task.cancel()
+
+    async def loop(self, source: Source) -> None:
+        while True:
+            started = time.monotonic()
+            try:
+                if await source.run():
+                    source.last_success = time.time()
+            except Exception as e:
+                logging.error(f"Error collecting {source.name}{instance_suffix(source)}: {e}")
+            source.last_duration = time.monotonic() - started
+
+            budget = source.interval * source.backoff * self.backoff_share
+            if source.last_duration > budget:
+                if source.backoff < self.max_backoff:
+                    source.backoff = min(source.backoff * 2, self.max_backoff)
+                    logging.warning(
+                        f"Collecting {source.name}{instance_suffix(source)} took {source.last_duration:.2f}s, "
+                        f"backing off to every {source.interval * source.backoff:.1f}s"
+                    )
+            elif source.backoff > 1 and source.last_duration <= budget / 2:
+                # Only speed up again when the run fits the shorter interval too
+                source.backoff = max(source.backoff / 2, 1.0)
+
+            interval = source.interval * source.backoff
+            delay = interval * (1 + random.uniform(-self.jitter, self.jitter)) - source.last_duration
+            await asyncio.sleep(max(delay, 0))
+
+    def collect(self):
+        now = time.time()
+        labels = ["ew_instance", "source"]
+        duration = GaugeMetricFamily(
+            "ew_exporter_source_duration_seconds",
+            "Duration of the last collection run per source",
+            labels=labels
+        )
+        staleness = GaugeMetricFamily(
+            "ew_exporter_source_staleness_seconds",
+            "Seconds since the last successful collection run per source",
+            labels=labels
+        )
+        interval = GaugeMetricFamily(
+            "ew_exporter_source_interval_seconds",
+            "Current collection interval per source, including backoff",
+            labels=labels
+        )
+        for source in self.sources.values():
+            label_values = [source.instance, source.name]
+            if source.last_duration is not None:
+                duration.add_metric(label_values, source.last_duration)
+            if source.last_success is not None:
+                staleness.add_metric(label_values, now - source.last_success)
+            interval.add_metric(label_values, source.interval * source.backoff)
+        yield duration
+        yield staleness
+        yield interval
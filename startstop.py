@@ -0,0 +1,213 @@
+"""Index of the modules startstop is configured to run."""
+import logging
+import os
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple, TypedDict
+
+import procfs
+from status_parser import module_keys
+
+# Startstop configuration file name on Unix installs, in EW_PARAMS
+DEFAULT_CONFIG = 'startstop_unix.d'
+
+# Scheduling classes as startstop's config spells them -> as status prints them
+CLASS_NAMES = {'OTHER': 'TS', 'TS': 'TS', 'RT': 'RT', 'FIFO': 'RT', 'RR': 'RT'}
+
+class ExpectedModule(TypedDict):
+    # Program name; the index key differs when it runs more than once
+    program: str
+    argument: str
+    priority: Optional[str]
+    # Module configuration file named by the argument, if any
+    config_file: Optional[str]
+    config_exists: bool
+
+def strip_comment(line: str) -> str:
+    # '#' starts a comment except inside quotes
+    quoted = False
+    for i, char in enumerate(line):
+        if char == '"':
+            quoted = not quoted
+        elif char == '#' and not quoted:
+            return line[:i]
+    return line
+
+def parse_priority(tokens: List[str]) -> Optional[str]:
+    # "Class/Priority  OTHER 0" -> "TS/0", matching the status column
+    if len(tokens) < 2:
+        return None
+    return f"{CLASS_NAMES.get(tokens[0].upper(), tokens[0])}/{tokens[1]}"
+
+def parse_config(path: str, params_dir: str, files: Dict[str, Optional[float]]) -> List[Tuple[str, str, Optional[str]]]:
+    # Returns (name, argument, priority) per Process line, following
+    # "@file" includes. Every file read is added to `files` with its mtime.
+    processes = []
+    files[path] = os.stat(path).st_mtime
+    with open(path, 'r', errors='replace') as f:
+        lines = f.read().splitlines()
+
+    for line in lines:
+        line = strip_comment(line).strip()
+        if not line:
+            continue
+        if line.startswith('@'):
+            include = os.path.join(params_dir, line[1:].strip())
+            if include not in files:
+                try:
+                    processes.extend(parse_config(include, params_dir, files))
+                except OSError as e:
+                    logging.error(f"Cannot read {include} included from {path}: {e}")
+            continue
+
+        keyword, _, rest = line.partition(' ')
+        rest = rest.strip()
+        if keyword == 'Process':
+            command = rest.strip('"').split(None, 1)
+            if command:
+                processes.append((command[0], command[1] if len(command) > 1 else '', None))
+        elif keyword == 'Class/Priority' and processes:
+            name, argument, _ = processes[-1]
+            processes[-1] = (name, argument, parse_priority(rest.split()))
+    return processes
+
+class StartstopIndex:
+    # Expected modules parsed from the startstop config. Parsing happens
+    # again only when one of the files read (config, includes, module .d
+    # files) changes mtime or disappears.
+
+    def __init__(self, path: str):
+        self.path = path
+        self.params_dir = os.path.dirname(path)
+        # Every file the index depends on -> mtime (None while missing)
+        self.files: Dict[str, Optional[float]] = {}
+        self.modules: Dict[str, ExpectedModule] = {}
+        self.loaded = False
+        # Process table matches of the modules without a live status PID,
+        # reused until the next status run: (run, modules, running)
+        self.scanned: Optional[Tuple[Any, FrozenSet[str], Dict[str, bool]]] = None
+
+    @property
+    def mtime(self) -> Optional[float]:
+        return self.files.get(self.path)
+
+    def changed(self) -> bool:
+        if not self.loaded:
+            return True
+        for path, mtime in self.files.items():
+            try:
+                if os.stat(path).st_mtime != mtime:
+                    return True
+            except OSError:
+                if mtime is not None:
+                    return True
+        return False
+
+    def refresh(self) -> bool:
+        # Returns True when the index was (re)loaded
+        if not self.changed():
+            return False
+        files: Dict[str, Optional[float]] = {}
+        try:
+            processes = parse_config(self.path, self.params_dir, files)
+        except OSError as e:
+            logging.error(f"Cannot read startstop config {self.path}: {e}")
+            self.modules = {}
+            # Retry once the file shows up
+            self.files = {self.path: None}
+            self.loaded = True
+            return True
+
+        modules = {}
+        # Keyed like status rows, so duplicate programs match up
+        keys = module_keys([(name, argument) for name, argument, _ in processes])
+        for key, (name, argument, priority) in zip(keys, processes):
+            # The first argument is the module's own config, when it has one
+            first = argument.split()[0] if argument else ''
+            config_file = os.path.join(self.params_dir, first) if first.endswith('.d') else None
+            config_exists = False
+            if config_file is not None:
+                try:
+                    files[config_file] = os.stat(config_file).st_mtime
+                    config_exists = True
+                except OSError:
+                    files[config_file] = None
+            modules[key] = {
+                'program': name,
+                'argument': argument,
+                'priority': priority,
+                'config_file': config_file,
+                'config_exists': config_exists
+            }
+
+        self.modules = modules
+        self.files = files
+        self.loaded = True
+        self.scanned = None
+        logging.info(f"Loaded {len(modules)} expected modules from {self.path}")
+        return True
+
+def running_modules(index: StartstopIndex, live: Dict[str, Dict[str, Any]], run: Any) -> Dict[str, bool]:
+    # Whether a process is running for each expected module. Modules whose
+    # status PID is alive (its /proc stats were read) need no further
+    # lookup; for the rest the process table is scanned for a matching
+    # command line, once per status run (`run`) unless the set of such
+    # modules changes in between.
+    modules = index.modules
+    running = {}
+    missing = []
+    for name in modules:
+        module_data = live.get(name)
+        if module_data is not None and module_data.get('starttime') is not None \
+                and module_data.get('status') == 'Alive':
+            running[name] = True
+        else:
+            missing.append(name)
+
+    if missing:
+        scanned = index.scanned
+        if scanned is None or scanned[0] != run or scanned[1] != frozenset(missing):
+            commands = {
+                (os.path.basename(argv[0]), ' '.join(argv[1:]))
+                for argv in procfs.read_command_lines().values()
+            }
+            found = {
+                name: (modules[name]['program'], modules[name]['argument']) in commands
+                for name in missing
+            }
+            scanned = index.scanned = (run, frozenset(missing), found)
+        running.update(scanned[2])
+    return running
+
+def compare(
+    index: StartstopIndex,
+    data: Dict[str, Any]
+) -> Dict[str, Any]:
+    # Expected modules against the latest status and /proc state
+    live = data['module']
+    drift: List[Tuple[str, str]] = []
+    for name, expected in index.modules.items():
+        module_data = live.get(name)
+        if module_data is None:
+            # Configured after startstop started, or startstop is not running
+            drift.append((name, 'not_in_status'))
+            continue
+        if module_data.get('argument') is not None and module_data['argument'] != expected['argument']:
+            drift.append((name, 'argument'))
+        if expected['priority'] is not None and module_data.get('priority') is not None \
+                and module_data['priority'].replace(' ', '') != expected['priority']:
+            drift.append((name, 'priority'))
+        if expected['config_file'] is not None and not expected['config_exists']:
+            drift.append((name, 'config_missing'))
+    for name in live:
+        if name not in index.modules and name != 'startstop':
+            drift.append((name, 'not_in_config'))
+
+    # Edited since startstop read it: takes effect only after a restart
+    start = data['system'].get('start_timestamp')
+    config_changed = index.mtime is not None and start is not None and index.mtime > start
+
+    return {
+        'modules': index.modules,
+        'running': running_modules(index, live, data['system'].get('collected_at')),
+        'drift': drift,
+        'config_changed': config_changed
+    }
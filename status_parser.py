@@ -0,0 +1,222 @@
+"""Single-pass parser for the output of the Earthworm `status` command."""
+import os
+import re
+import time
+import calendar
+import hashlib
+from typing import Dict, List, Optional, Tuple, TypedDict
+
+class RingInfo(TypedDict):
+    name: str
+    key: str
+    size: int
+
+class ModuleInfo(TypedDict, total=False):
+    status: Optional[str]
+    pid: Optional[int]
+    priority: Optional[str]
+    cpu_used: Optional[float]
+    cpu_time: Optional[str]
+    argument: Optional[str]
+
+class EarthwormStatus(TypedDict):
+    system: Dict[str, object]
+    rings: Dict[str, RingInfo]
+    module: Dict[str, ModuleInfo]
+
+# Parser states
+SYSTEM, PROCESS_HEADER, PROCESS = range(3)
+
+RING_LABEL = re.compile(r'Ring\s+(\d+)\s+name/key/size')
+
+# Process line, e.g.
+#   pick_ew     12346    Alive      RT/ 0  00:00:12  pick_ew.d
+#   wave_serverV  -      Not Exec   TS/ 0  00:00:00  wave_serverV.d
+# Class is missing on old releases and "NotExec"/"Not Exec" both occur.
+PROCESS_LINE = re.compile(
+    r'\s*(?P<name>\S+)\s+(?P<pid>\S+)\s+'
+    r'(?P<status>Not\s+Exec|\S+)\s+'
+    r'(?:(?P<cls>[^\s/]*)/\s*)?(?P<priority>-?\d+)\s+'
+    r'(?P<cpu>(?:\d+[\s-])?\d+:\d\d:\d\d)'
+    r'(?:\s+(?P<argument>.*))?'
+)
+
+SYSTEM_FIELDS = {
+    'Hostname-OS': 'hostname_os',
+    'Start time (UTC)': 'start_time',
+    'Current time (UTC)': 'current_time',
+    'Startstop Version': 'version',
+    "Startstop's Log Dir": 'log_dir',
+    "Startstop's Params Dir": 'params_dir',
+    "Startstop's Bin Dir": 'bin_dir'
+}
+
+# Changes on every run, so it is left out of the digest
+CURRENT_TIME_LINE = re.compile(r'^[ \t]*Current time \(UTC\):[ \t]*(.*?)[ \t\r]*$', re.M)
+
+# Times are printed like "Mon Jan 15 10:00:00 2024" (ctime format, UTC)
+TIME_FIELDS = {'start_time': 'start_timestamp', 'current_time': 'current_timestamp'}
+
+def parse_utc_time(value: str) -> Optional[float]:
+    try:
+        return float(calendar.timegm(time.strptime(value, '%a %b %d %H:%M:%S %Y')))
+    except ValueError:
+        return None
+
+def status_digest(output: str) -> Tuple[bytes, Optional[str]]:
+    # Digest of the output without the current time line, and that line's
+    # value: two runs with nothing else changed digest the same
+    match = CURRENT_TIME_LINE.search(output)
+    if match is None:
+        return hashlib.blake2b(output.encode(), digest_size=16).digest(), None
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(output[:match.start()].encode())
+    hasher.update(output[match.end():].encode())
+    return hasher.digest(), match.group(1)
+
+def config_stem(argument: Optional[str]) -> Optional[str]:
+    # "pick_ew.d" -> "pick_ew", the module's config file without directory
+    # and suffix (also the name logit gives the module's log)
+    if not argument:
+        return None
+    first = argument.split()[0]
+    for suffix in ('.d', '.desc'):
+        if first.endswith(suffix):
+            return os.path.basename(first[:-len(suffix)])
+    return None
+
+def module_keys(processes: List[Tuple[str, Optional[str]]]) -> List[str]:
+    # Key of each (name, argument) process: its name, unless the same
+    # program runs more than once (two export_generic with different .d
+    # files). Those are told apart as "name:stem" by their config file, or
+    # as "name:1", "name:2"... in order when the config files do not
+    # separate them.
+    stems: Dict[str, List[Optional[str]]] = {}
+    for name, argument in processes:
+        stems.setdefault(name, []).append(config_stem(argument))
+    by_stem = {
+        name: len(group) > 1 and None not in group and len(set(group)) == len(group)
+        for name, group in stems.items()
+    }
+    keys: List[str] = []
+    seen: Dict[str, int] = {}
+    for name, argument in processes:
+        if len(stems[name]) == 1:
+            keys.append(name)
+        elif by_stem[name]:
+            keys.append(f"{name}:{config_stem(argument)}")
+        else:
+            seen[name] = seen.get(name, 0) + 1
+            keys.append(f"{name}:{seen[name]}")
+    return keys
+
+def parse_process_line(line: str) -> Optional[Tuple[str, ModuleInfo]]:
+    match = PROCESS_LINE.match(line)
+    if match is None:
+        # Unknown column layout: name, pid and status are always first
+        parts = line.split()
+        if len(parts) < 3:
+            return None
+        name, pid, status = parts[0], parts[1], parts[2]
+        priority = cpu_time = argument = None
+    else:
+        name, pid, status = match.group('name', 'pid', 'status')
+        status = ' '.join(status.split())
+        priority = match.group('priority')
+        if match.group('cls'):
+            priority = f"{match.group('cls')}/{priority}"
+        cpu_time = match.group('cpu')
+        argument = (match.group('argument') or '').strip() or None
+
+    if status == 'NotExec':
+        status = 'Not Exec'
+
+    return name, {
+        'status': status,
+        'pid': int(pid) if pid.isdigit() else None,
+        'priority': priority,
+        'cpu_used': None,
+        'cpu_time': cpu_time,
+        'argument': argument
+    }
+
+def parse_status(output: str) -> EarthwormStatus:
+    data: EarthwormStatus = {'system': {}, 'rings': {}, 'module': {}}
+    system = data['system']
+    state = SYSTEM
+    processes: List[Tuple[str, ModuleInfo]] = []
+
+    for line in output.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            continue
+
+        if state == SYSTEM:
+            if stripped.startswith('Process') and stripped.count('Process') >= 2:
+                state = PROCESS_HEADER
+                continue
+
+            label, sep, value = stripped.partition(':')
+            if not sep:
+                continue
+            value = value.strip()
+            field = SYSTEM_FIELDS.get(label.strip())
+            if field is not None:
+                system[field] = value
+                if field in TIME_FIELDS:
+                    system[TIME_FIELDS[field]] = parse_utc_time(value)
+            elif label.startswith('Disk space avail'):
+                amount = value.split()[0] if value else ''
+                if amount.isdigit():
+                    system['disk_space'] = int(amount)
+            elif label.startswith('Ring'):
+                match = RING_LABEL.match(label)
+                parts = [part.strip() for part in value.split('/')]
+                if match and len(parts) >= 3:
+                    size = parts[2].split()[0] if parts[2] else ''
+                    data['rings'][match.group(1)] = {
+                        'name': parts[0],
+                        'key': parts[1],
+                        'size': int(size) if size.isdigit() else 0
+                    }
+
+        elif state == PROCESS_HEADER:
+            # "Name  Id  Status ..." line, then the dashed separator
+            if stripped.startswith('---'):
+                state = PROCESS
+
+        else:
+            parsed = parse_process_line(line)
+            if parsed is not None:
+                processes.append(parsed)
+
+    keys = module_keys([(name, module['argument']) for name, module in processes])
+    for key, (_, module) in zip(keys, processes):
+        data['module'][key] = module
+    return data
+
+class StatusParser:
+    # Skips re-parsing when `status` printed the same text as last time,
+    # apart from the current time, which is filled in on every run
+
+    def __init__(self):
+        self.digest: Optional[bytes] = None
+        self.result: Optional[EarthwormStatus] = None
+
+    def parse(self, output: str) -> EarthwormStatus:
+        digest, current_time = status_digest(output)
+        if digest != self.digest or self.result is None:
+            self.result = parse_status(output)
+            self.digest = digest
+
+        # Callers enrich the result in place, so hand out copies
+        result = self.result
+        system = dict(result['system'])
+        if current_time is not None:
+            system['current_time'] = current_time
+            system['current_timestamp'] = parse_utc_time(current_time)
+        return {
+            'system': system,
+            'rings': {num: dict(ring) for num, ring in result['rings'].items()},
+            'module': {name: dict(module) for name, module in result['module'].items()}
+        }
@@ -0,0 +1,148 @@
+"""Feed of module state changes for /stream subscribers."""
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, Any, List, Optional, Set, Tuple
+from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily
+
+class StreamFullError(Exception):
+    pass
+
+class Subscriber:
+    # Bounded queue of serialized events for one client. A client that falls
+    # `queue_size` events behind loses its queue and is sent the full state
+    # instead, so a slow dashboard never holds up the producer or the others.
+
+    def __init__(self, queue_size: int):
+        self.queue: Deque[Tuple[int, str]] = deque()
+        self.queue_size = queue_size
+        self.wakeup = asyncio.Event()
+        self.resync = False
+
+    def push(self, seq: int, message: str) -> None:
+        if len(self.queue) >= self.queue_size:
+            self.queue.clear()
+            self.resync = True
+        else:
+            self.queue.append((seq, message))
+        self.wakeup.set()
+
+class ChangeFeed:
+    # Single producer: every new snapshot is diffed once against the state
+    # last published, and the diff is serialized once and handed to every
+    # subscriber. Subscribers only read what the collections produce, so
+    # any number of them causes no extra collection.
+
+    def __init__(self, queue_size: int = 64, max_subscribers: int = 100, replay_size: int = 256):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        # instance -> module -> field -> value, as last published
+        self.state: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self.seq = 0
+        self.subscribers: Set[Subscriber] = set()
+        # Recent events, replayed to clients reconnecting with Last-Event-ID
+        self.recent: Deque[Tuple[int, str]] = deque(maxlen=replay_size)
+        self.resyncs = 0
+
+    def publish(self, instances_data: Dict[str, Dict[str, Any]]) -> None:
+        changes: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        removed: Dict[str, List[str]] = {}
+        for instance, data in instances_data.items():
+            known = self.state.setdefault(instance, {})
+            for module_name, module_data in data['module'].items():
+                previous = known.get(module_name)
+                pid = module_data.get('pid')
+                restarts = 0
+                if previous is not None:
+                    restarts = previous['restarts']
+                    if pid is not None and previous['pid'] is not None and pid != previous['pid']:
+                        restarts += 1
+                current = {'status': module_data.get('status'), 'pid': pid, 'restarts': restarts}
+                if previous is None:
+                    changed = current
+                else:
+                    changed = {field: value for field, value in current.items() if previous[field] != value}
+                if changed:
+                    known[module_name] = current
+                    changes.setdefault(instance, {})[module_name] = changed
+            departed = [name for name in known if name not in data['module']]
+            for name in departed:
+                del known[name]
+            if departed:
+                removed[instance] = departed
+
+        if not changes and not removed:
+            return
+        self.seq += 1
+        message = json.dumps(
+            {'seq': self.seq, 't': round(time.time(), 3), 'changes': changes, 'removed': removed},
+            separators=(',', ':')
+        )
+        self.recent.append((self.seq, message))
+        for subscriber in self.subscribers:
+            was_resync = subscriber.resync
+            subscriber.push(self.seq, message)
+            if subscriber.resync and not was_resync:
+                self.resyncs += 1
+
+    def full_state(self) -> Tuple[int, str]:
+        return self.seq, json.dumps(
+            {'seq': self.seq, 't': round(time.time(), 3), 'modules': self.state},
+            separators=(',', ':')
+        )
+
+    def subscribe(self, last_seq: Optional[int] = None) -> Tuple[Subscriber, List[Tuple[str, int, str]]]:
+        # Returns the subscriber and the events to send first: the missed
+        # diffs when they are all still retained, the full state otherwise.
+        # An id ahead of ours comes from before an exporter restart (seq
+        # starts over at 0) and is unknown too.
+        if len(self.subscribers) >= self.max_subscribers:
+            raise StreamFullError(f"{len(self.subscribers)} clients already subscribed")
+        subscriber = Subscriber(self.queue_size)
+        self.subscribers.add(subscriber)
+        if last_seq is not None and last_seq == self.seq and self.seq:
+            return subscriber, []
+        if last_seq is not None and self.recent and self.recent[0][0] <= last_seq + 1 and last_seq < self.seq:
+            return subscriber, [('diff', seq, message) for seq, message in self.recent if seq > last_seq]
+        seq, message = self.full_state()
+        return subscriber, [('state', seq, message)]
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        self.subscribers.discard(subscriber)
+
+    async def events(self, subscriber: Subscriber, keepalive: float) -> AsyncIterator[Tuple[str, int, str]]:
+        # Yields (kind, seq, message) as diffs arrive; ("keepalive", 0, "")
+        # after `keepalive` seconds without any
+        while True:
+            if not subscriber.queue and not subscriber.resync:
+                subscriber.wakeup.clear()
+                try:
+                    await asyncio.wait_for(subscriber.wakeup.wait(), keepalive)
+                except asyncio.TimeoutError:
+                    yield 'keepalive', 0, ''
+                    continue
+            if subscriber.resync:
+                subscriber.resync = False
+                subscriber.queue.clear()
+                logging.warning("Stream client fell behind, sending it the full state")
+                seq, message = self.full_state()
+                yield 'state', seq, message
+                continue
+            seq, message = subscriber.queue.popleft()
+            yield 'diff', seq, message
+
+    def collect(self):
+        subscribers = GaugeMetricFamily(
+            "ew_exporter_stream_subscribers",
+            "Clients subscribed to /stream"
+        )
+        subscribers.add_metric([], len(self.subscribers))
+        resyncs = CounterMetricFamily(
+            "ew_exporter_stream_resyncs",
+            "Times a /stream client fell behind and was sent the full state instead"
+        )
+        resyncs.add_metric([], self.resyncs)
+        yield subscribers
+        yield resyncs